@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import math
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .authentication import CachedTokenAuthentication, token_cache
+from .metrics import Counter, REGISTRY
+
+admission_decisions = REGISTRY.register(Counter(
+    'api_admission', 'Admission control decisions on guarded views: served or shed, and why.', ('view', 'outcome')
+))
+
+
+def admission_settings():
+    return getattr(settings, 'ADMISSION', {})
+
+
+def client_key(request):
+    """Stable client identity: a hash of the ``Authorization`` header, else the client address."""
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if authorization:
+        # Keep raw tokens out of memory dumps and the shared cache's key space.
+        return 'token:' + hashlib.sha256(authorization.encode()).hexdigest()[:32]
+    return 'addr:' + request.META.get('REMOTE_ADDR', '')
+
+
+def rate_limit_key(request):
+    """
+    Rate-limit identity: the user of a token ``token_cache`` already holds,
+    so known to be valid, else the client address.
+
+    Runs before authentication, so an unverified token cannot pick its own
+    bucket: rotating made-up tokens neither escapes the limit nor fills the
+    bucket store with one entry per request.
+    """
+    auth = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(auth) == 2 and auth[0].lower() == CachedTokenAuthentication.keyword.lower():
+        user_id = token_cache.user_id(auth[1])
+        if user_id is not None:
+            return f'user:{user_id}'
+    return 'addr:' + request.META.get('REMOTE_ADDR', '')
+
+
+class TokenBuckets:
+    """
+    Per-client token buckets held in process memory.
+
+    Each client may spend ``burst`` requests at once, refilled at ``rate``
+    per second. Buckets live in an LRU of ``maxsize`` clients; an evicted
+    client simply starts again with a full bucket.
+    """
+
+    def __init__(self, rate, burst, maxsize=100000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Spend one token; returns 0 if admitted, else seconds until one is available."""
+        now = self._clock()
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class SharedTokenBuckets:
+    """
+    ``TokenBuckets`` kept in a shared Django cache, so every process draws
+    from the same budget.
+
+    Cache backends only offer atomic ``incr``, so the bucket is
+    approximated by fixed windows of ``burst / rate`` seconds allowing
+    ``burst`` requests each.
+    """
+
+    def __init__(self, rate, burst, alias, clock=time.time):
+        self.rate = rate
+        self.burst = burst
+        self.window = burst / rate
+        self.cache = caches[alias]
+        self._clock = clock
+
+    def take(self, key):
+        now = self._clock()
+        window = math.floor(now / self.window)
+        cache_key = f'admission:{key}:{window}'
+        self.cache.add(cache_key, 0, timeout=math.ceil(self.window) + 1)
+        try:
+            count = self.cache.incr(cache_key)
+        except ValueError:
+            # Expired between add and incr.
+            self.cache.add(cache_key, 1, timeout=math.ceil(self.window) + 1)
+            count = 1
+        if count <= self.burst:
+            return 0.0
+        return (window + 1) * self.window - now
+
+
+_limiters = weakref.WeakSet()
+
+
+@REGISTRY.register_collector
+def _admission_metrics():
+    yield 'api_admission_in_flight', 'gauge', 'Requests holding an admission slot.', sum(
+        limiter.active for limiter in list(_limiters)
+    )
+
+
+class ConcurrencyLimiter:
+    """At most ``limit`` requests in flight; the rest wait (bounded) for a slot."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._condition = threading.Condition()
+        _limiters.add(self)
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.active >= self.limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            self.active += 1
+            return True
+
+    async def aacquire(self, timeout, poll=0.005):
+        deadline = time.monotonic() + timeout
+        while not self.acquire(0):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(poll)
+        return True
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+def queue_time(request, header='HTTP_X_REQUEST_START'):
+    """
+    Seconds the request waited before reaching Django, from the proxy's
+    ``X-Request-Start`` header (``t=<epoch>`` in seconds, milliseconds or
+    microseconds), or 0 without one.
+    """
+    value = request.META.get(header)
+    if not value:
+        return 0.0
+    try:
+        start = float(value.strip().removeprefix('t='))
+    except ValueError:
+        return 0.0
+    if start > 1e14:
+        start /= 1e6
+    elif start > 1e11:
+        start /= 1e3
+    return max(time.time() - start, 0.0)
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework import exceptions, status
+
+from .authentication import CachedTokenAuthentication
+from .dispatch import complete_service, dispatch_service, dispatch_settings
+from .events import event_bus, event_filter, events_settings
+from .idempotency import idempotent
+from .models import Service
+from .renderers import FastJSONRenderer
+from .serializers import ServiceRequestSerializer, ServiceUpdateSerializer
+from .jobs import enqueue_dispatch
+from .views import (
+    completion_errors, dispatch_status, job_data, queued_response_headers, service_data, wants_queued_dispatch
+)
+
+
+class AsyncAPIView(View):
+    """
+    Minimal async counterpart of DRF's ``APIView`` for the hot endpoints.
+
+    Plain Django async view (DRF 3.14 views are sync only): token
+    authentication through the shared token cache, JSON bodies and the same
+    JSON output and error payloads as the DRF views. Only the
+    transactional work is handed to a thread with ``sync_to_async``, since
+    Django has no async transactions.
+    """
+    authenticator = CachedTokenAuthentication()
+    renderer = FastJSONRenderer()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True  # Token auth only, like APIView.
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            user_auth = await self.authenticator.aauthenticate(request)
+            if user_auth is None:
+                raise exceptions.NotAuthenticated()
+            request.user, request.auth = user_auth
+            handler = getattr(self, request.method.lower(), None)
+            if request.method.lower() not in self.http_method_names or handler is None:
+                raise exceptions.MethodNotAllowed(request.method)
+            return await handler(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return self.error_response(exc)
+
+    def respond(self, data, status_code=status.HTTP_200_OK):
+        return HttpResponse(self.renderer.render(data), status=status_code, content_type='application/json')
+
+    def error_response(self, exc):
+        detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        response = self.respond(detail, exc.status_code)
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            response.status_code = status.HTTP_401_UNAUTHORIZED
+            response['WWW-Authenticate'] = self.authenticator.authenticate_header(None)
+        return response
+
+    @staticmethod
+    def parse_json(request):
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError as exc:
+            raise exceptions.ParseError(f'JSON parse error - {exc}')
+
+
+class AsyncRequestServiceView(AsyncAPIView):
+    http_method_names = ['post', 'options']
+
+    @idempotent
+    async def post(self, request, *args, **kwargs):
+        request_serializer = ServiceRequestSerializer(data=self.parse_json(request))
+        if not request_serializer.is_valid():
+            return self.respond(request_serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+        if wants_queued_dispatch(request):
+            job = await sync_to_async(enqueue_dispatch)(
+                request_serializer.validated_data['latitude'], request_serializer.validated_data['longitude']
+            )
+            response = self.respond(job_data(job), status.HTTP_202_ACCEPTED)
+            for header, value in queued_response_headers(request, job).items():
+                response[header] = value
+            return response
+
+        service = await sync_to_async(dispatch_service)(
+            request_serializer.validated_data['latitude'], request_serializer.validated_data['longitude']
+        )
+        return self.respond(service_data(service), dispatch_status(service))
+
+
+class AsyncCompleteServiceView(AsyncAPIView):
+    http_method_names = ['put', 'patch', 'options']
+
+    async def patch(self, request, pk, *args, **kwargs):
+        try:
+            service = await Service.objects.select_related('assigned_driver').aget(pk=pk)
+        except Service.DoesNotExist:
+            raise exceptions.NotFound()
+
+        serializer = ServiceUpdateSerializer(service, data=self.parse_json(request))
+        if not serializer.is_valid():
+            return self.respond(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        errors = completion_errors(service)
+        if errors:
+            return self.respond(errors, status.HTTP_400_BAD_REQUEST)
+
+        if await sync_to_async(complete_service)(service, serializer.validated_data['status']) is None:
+            # Completed or cancelled by a concurrent request.
+            await service.arefresh_from_db()
+            return self.respond(completion_errors(service), status.HTTP_400_BAD_REQUEST)
+        return self.respond(service_data(service))
+
+    put = patch
+
+
+class AsyncServiceStatusView(AsyncAPIView):
+    """
+    Current state of a service; ``?wait=<seconds>`` long-polls a pending one.
+
+    The wait sleeps on the event loop between lookups, so waiting clients
+    hold no worker thread. It is capped at ``DISPATCH['PENDING_WAIT_MAX']``.
+    """
+    http_method_names = ['get', 'options']
+
+    async def get(self, request, pk, *args, **kwargs):
+        options = dispatch_settings()
+        try:
+            wait = float(request.GET.get('wait', 0))
+        except ValueError:
+            wait = math.nan
+        if not math.isfinite(wait):
+            # A NaN deadline would never run out.
+            return self.respond({"wait": "Debe ser un número de segundos."}, status.HTTP_400_BAD_REQUEST)
+        deadline = time.monotonic() + min(max(wait, 0.0), options.get('PENDING_WAIT_MAX', 30))
+        interval = options.get('PENDING_POLL_INTERVAL', 0.5)
+        while True:
+            try:
+                service = await Service.objects.select_related('assigned_driver').aget(pk=pk)
+            except Service.DoesNotExist:
+                raise exceptions.NotFound()
+            remaining = deadline - time.monotonic()
+            if service.status != Service.StatusChoices.PENDING or remaining <= 0:
+                return self.respond(service_data(service))
+            await asyncio.sleep(min(interval, remaining))
+
+
+class AsyncEventStreamView(AsyncAPIView):
+    """
+    Server-sent events of driver and service changes (ASGI only).
+
+    Filters: ``?types=driver,service``,
+    ``?bbox=min_lat,min_lon,max_lat,max_lon`` and ``?drivers=1,2,3``. Each
+    event is ``id`` (the bus ``seq``), ``event`` (its type) and ``data``
+    (JSON). An ``overflow`` event
+    reports how many events a slow client lost, so it can resync. Streams
+    end after ``EVENTS['MAX_DURATION']`` seconds, and the client reconnects
+    on its own. Django 4.2 does not notice disconnects while streaming, so
+    this bounds how long an abandoned subscription lives.
+    """
+    http_method_names = ['get', 'options']
+
+    async def get(self, request, *args, **kwargs):
+        options = events_settings()
+        predicate = self.parse_filters(request.GET)
+        if len(event_bus) >= options.get('MAX_SUBSCRIBERS', 1000):
+            return self.respond(
+                {"message": "Demasiados clientes conectados; intenta más tarde."}, status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        subscription = event_bus.subscribe(predicate, maxsize=options.get('BUFFER_SIZE', 1000))
+        response = StreamingHttpResponse(self.stream(subscription, options), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    async def stream(subscription, options):
+        heartbeat = options.get('HEARTBEAT', 15)
+        deadline = time.monotonic() + options.get('MAX_DURATION', 300)
+        try:
+            yield f"retry: {options.get('RETRY_MS', 3000)}\n\n"
+            while time.monotonic() < deadline:
+                events, lost = await subscription.get(min(heartbeat, max(deadline - time.monotonic(), 0)))
+                chunk = ''.join(
+                    f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+                    for event in events
+                )
+                if lost:
+                    chunk = f"event: overflow\ndata: {json.dumps({'lost': lost})}\n\n" + chunk
+                yield chunk or ': keep-alive\n\n'
+        finally:
+            subscription.close()
+
+    @staticmethod
+    def parse_filters(params):
+        errors = {}
+        types = params.get('types')
+        if types is not None:
+            types = set(types.split(','))
+            if not types <= {'driver', 'service'}:
+                errors['types'] = "Tipos válidos: driver, service."
+        bbox = params.get('bbox')
+        if bbox is not None:
+            try:
+                bbox = tuple(float(value) for value in bbox.split(','))
+                if len(bbox) != 4 or not (-90 <= bbox[0] <= bbox[2] <= 90):
+                    raise ValueError
+            except ValueError:
+                errors['bbox'] = "Formato: min_lat,min_lon,max_lat,max_lon."
+        drivers = params.get('drivers')
+        if drivers is not None:
+            try:
+                drivers = {int(value) for value in drivers.split(',')}
+            except ValueError:
+                errors['drivers'] = "Lista de ids de conductor separados por comas."
+        if errors:
+            raise exceptions.ValidationError(errors)
+        return event_filter(types, bbox, drivers)
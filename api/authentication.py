@@ -0,0 +1,199 @@
+import copy
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+
+from .cache import LRUCache
+from .metrics import REGISTRY
+
+
+def token_cache_settings():
+    return getattr(settings, 'TOKEN_CACHE', {})
+
+
+class TokenCache:
+    """
+    Resolved tokens (with their user) keyed by token key.
+
+    Lookups go to an in-process LRU first and, when ``TOKEN_CACHE['SHARED']``
+    names a Django cache alias, to that cache next, so a fresh process does
+    not have to look tokens up that other processes already resolved. The
+    shared cache only holds ``(key, user_id, is_active)``, never user rows
+    (password hashes included); a token found there comes back without its
+    user for the caller to load. Entries are dropped by the signal handlers in ``api.signals``
+    when a token is deleted or its user changes; in other processes the
+    local entry lives at most ``TTL`` seconds.
+    """
+    key_prefix = 'auth-token:'
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self):
+        options = token_cache_settings()
+        self.ttl = options.get('TTL', 300)
+        self.local = LRUCache(maxsize=options.get('MAX_SIZE', 10000), ttl=self.ttl)
+        self.shared_alias = options.get('SHARED')
+        self.shared_hits = self.shared_misses = 0
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def _shared_key(self, key):
+        # Keep raw token keys out of the shared cache's key space.
+        return self.key_prefix + hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        token = self.local.get(key)
+        if token is not None:
+            # Callers get their own copies: requests may annotate request.user.
+            return _copy_token(token)
+        entry = self._shared_entry(key)
+        if self.shared_alias:
+            if entry is None:
+                self.shared_misses += 1
+            else:
+                self.shared_hits += 1
+        if entry is None:
+            return None
+        from rest_framework.authtoken.models import Token
+        return Token(key=key, user_id=entry[1])
+
+    def _shared_entry(self, key):
+        if not self.shared_alias:
+            return None
+        entry = self.shared.get(self._shared_key(key))
+        # Only active users are cached; anything else is looked up afresh.
+        return entry if entry is not None and entry[2] else None
+
+    def user_id(self, key):
+        """Pk of the user of ``key`` if it is cached (so known valid), else ``None``; not counted as a lookup."""
+        token = self.local.get(key, count=False)
+        if token is not None:
+            return token.user_id
+        entry = self._shared_entry(key)
+        return entry[1] if entry is not None else None
+
+    def set(self, token, shared=True):
+        self.local.set(token.key, _copy_token(token))
+        if shared and self.shared_alias:
+            entry = (token.key, token.user_id, token.user.is_active)
+            self.shared.set(self._shared_key(token.key), entry, self.ttl)
+
+    def invalidate(self, key):
+        self.local.delete(key)
+        if self.shared_alias:
+            self.shared.delete(self._shared_key(key))
+
+    def invalidate_user(self, user_pk):
+        self.local.delete_where(lambda token: token.user_id == user_pk)
+        if self.shared_alias:
+            from rest_framework.authtoken.models import Token
+            keys = Token.objects.filter(user_id=user_pk).values_list('key', flat=True)
+            self.shared.delete_many([self._shared_key(key) for key in keys])
+
+    def clear(self):
+        self.local.clear()
+        self.shared_hits = self.shared_misses = 0
+
+    def stats(self):
+        stats = self.local.stats()
+        if self.shared_alias:
+            stats.update(shared_hits=self.shared_hits, shared_misses=self.shared_misses)
+        return stats
+
+
+def _copy_token(token):
+    token = copy.copy(token)
+    token.user = copy.copy(token.user)
+    return token
+
+
+token_cache = TokenCache()
+
+
+@REGISTRY.register_collector
+def _token_cache_metrics():
+    stats = token_cache.stats()
+    yield 'api_token_cache_hits_total', 'counter', 'Tokens resolved from the in-process cache.', stats['hits']
+    yield 'api_token_cache_misses_total', 'counter', 'Token lookups that missed the in-process cache.', stats['misses']
+    yield 'api_token_cache_evictions_total', 'counter', 'Tokens evicted from the in-process cache.', stats['evictions']
+    yield 'api_token_cache_size', 'gauge', 'Tokens held in the in-process cache.', stats['size']
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in replacement for ``TokenAuthentication`` that resolves tokens
+    through ``token_cache`` and only queries the database on a miss.
+    """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is not None and not self._has_user(token):
+            user = get_user_model()._default_manager.filter(pk=token.user_id).first()
+            token = self._with_user(token, user)
+        if token is None:
+            try:
+                token = self.get_model().objects.select_related('user').get(key=key)
+            except self.get_model().DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if token.user.is_active:
+                token_cache.set(token)
+        return self._check_active(token)
+
+    async def aauthenticate(self, request):
+        """Async ``authenticate`` for plain Django async views."""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. No credentials provided.'))
+        if len(auth) > 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain spaces.'))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(
+                _('Invalid token header. Token string should not contain invalid characters.')
+            )
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        # Local cache hits never leave the event loop.
+        token = token_cache.get(key)
+        if token is not None and not self._has_user(token):
+            user = await get_user_model()._default_manager.filter(pk=token.user_id).afirst()
+            token = self._with_user(token, user)
+        if token is None:
+            try:
+                token = await self.get_model().objects.select_related('user').aget(key=key)
+            except self.get_model().DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if token.user.is_active:
+                token_cache.set(token)
+        return self._check_active(token)
+
+    def _has_user(self, token):
+        return self.get_model().user.is_cached(token)
+
+    @staticmethod
+    def _with_user(token, user):
+        # A token from the shared cache, completed with its user row.
+        if user is None:
+            return None
+        token.user = user
+        if user.is_active:
+            token_cache.set(token, shared=False)
+        return token
+
+    @staticmethod
+    def _check_active(token):
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return (token.user, token)
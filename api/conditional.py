@@ -0,0 +1,169 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from rest_framework import status
+from rest_framework.response import Response
+
+from .cache import LRUCache
+from .metrics import REGISTRY, Counter
+from .replicas import current_state, replica_settings
+
+conditional_responses = REGISTRY.register(Counter(
+    'api_conditional_responses', 'Cacheable GETs by resource and outcome.', ('resource', 'outcome')
+))
+
+
+def response_cache_settings():
+    return getattr(settings, 'RESPONSE_CACHE', {})
+
+
+class ResourceVersions:
+    """
+    Opaque versions of model instances and of their model's listings.
+
+    A version is ``(token, bumped_at)``; ``bump`` gives an instance and its
+    listing fresh ones. Versions not seen yet get a fresh token, so an
+    evicted entry costs a cache miss, never a wrong 304, and a
+    ``bumped_at`` of 0: no write was seen within the cache's memory. They are kept in an in-process LRU whose entries expire
+    after ``RESPONSE_CACHE['TTL']``, since writes made by other processes
+    are not seen; with ``RESPONSE_CACHE['SHARED']`` naming a Django cache
+    alias they live there instead, and every process sees every bump.
+    """
+    key_prefix = 'resource-version:'
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self):
+        options = response_cache_settings()
+        self.shared_alias = options.get('SHARED')
+        self.local = LRUCache(maxsize=options.get('VERSIONS_SIZE', 100000), ttl=options.get('TTL', 30))
+
+    def get(self, label, pk=None):
+        key = self._key(label, pk)
+        if self.shared_alias:
+            shared = caches[self.shared_alias]
+            version = shared.get(key)
+            if version is None:
+                shared.add(key, _new_version())
+                version = shared.get(key) or _new_version()
+            return version
+        version = self.local.get(key, count=False)
+        if version is None:
+            version = _new_version()
+            self.local.set(key, version)
+        return version
+
+    def bump(self, label, pks):
+        keys = [self._key(label)] + [self._key(label, pk) for pk in pks]
+        if self.shared_alias:
+            bumped_at = time.time()
+            caches[self.shared_alias].set_many({key: _new_version(bumped_at) for key in keys})
+        else:
+            for key in keys:
+                self.local.set(key, _new_version(time.time()))
+
+    def bump_on_commit(self, label, pks):
+        """
+        Bump now, so this process stops serving the old representation at
+        once, and again on commit: a read racing the transaction may have
+        cached the old rows under the first bump.
+        """
+        pks = list(pks)
+        self.bump(label, pks)
+        transaction.on_commit(lambda: self.bump(label, pks))
+
+    def _key(self, label, pk=None):
+        return f'{self.key_prefix}{label}' if pk is None else f'{self.key_prefix}{label}:{pk}'
+
+
+def _new_version(bumped_at=0.0):
+    return uuid.uuid4().hex[:16], bumped_at
+
+
+resource_versions = ResourceVersions()
+
+# Response data of cacheable GETs, keyed by path, media type and version.
+response_cache = LRUCache(
+    maxsize=response_cache_settings().get('MAX_ENTRIES', 10000), ttl=response_cache_settings().get('TTL', 30)
+)
+
+
+@REGISTRY.register_collector
+def _response_cache_metrics():
+    stats = response_cache.stats()
+    yield 'api_response_cache_size', 'gauge', 'Responses held by the version-keyed response cache.', stats['size']
+    yield 'api_response_cache_evictions_total', 'counter', 'Cached responses evicted (LRU).', stats['evictions']
+
+
+def configure_response_cache():
+    options = response_cache_settings()
+    response_cache.maxsize = options.get('MAX_ENTRIES', 10000)
+    response_cache.ttl = options.get('TTL', 30)
+    response_cache.clear()
+    resource_versions.configure()
+
+
+class ConditionalGetMixin:
+    """
+    ``list`` and ``retrieve`` with an ETag validator and a response cache.
+
+    Both come from the ``ResourceVersions`` of the viewset's model, bumped
+    by the ``api.signals`` handlers and by the bulk writers that skip them.
+    A matching ``If-None-Match`` gets a 304; an unchanged resource is
+    answered from ``response_cache`` without querying or serializing.
+    There is no ``Last-Modified``: with its one-second precision, a write
+    in the same second as a response would still be answered with 304.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(request, None, super().list, args, kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            # ``05`` and ``5`` are the same instance, and must share its version.
+            pk = self.queryset.model._meta.pk.to_python(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValidationError:
+            return super().retrieve(request, *args, **kwargs)
+        return self._conditional(request, pk, super().retrieve, args, kwargs)
+
+    def _conditional(self, request, pk, handler, args, kwargs):
+        options = response_cache_settings()
+        if not options.get('ENABLED', True):
+            return handler(request, *args, **kwargs)
+        label = self.queryset.model._meta.label_lower
+        resource = label if pk is None else label + ':detail'
+        token, bumped_at = resource_versions.get(label, pk)
+        state = current_state()
+        if state is not None and state.replica is not None and (
+            time.time() - bumped_at < replica_settings().get('STICKY_SECONDS', 5)
+        ):
+            # A replica may not have the rows of a version this young yet, and
+            # its older copy would be served, and revalidated, under this ETag.
+            state.replica = None
+        # One version is served as JSON or as the browsable API.
+        etag = f'"{token}-{request.accepted_renderer.format}"'
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            conditional_responses.inc(resource, 'not_modified')
+            not_modified['ETag'] = etag
+            return not_modified
+
+        key = (request.get_full_path(), request.accepted_renderer.format, token)
+        data = response_cache.get(key)
+        if data is None:
+            conditional_responses.inc(resource, 'cache_miss')
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            response_cache.set(key, response.data, ttl=options.get('TTL', 30))
+        else:
+            conditional_responses.inc(resource, 'cache_hit')
+            response = Response(data)
+        response['ETag'] = etag
+        return response
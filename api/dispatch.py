@@ -0,0 +1,667 @@
+import math
+import threading
+import time
+
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+from django.utils import timezone
+
+from . import replicas
+from .assignment import linear_sum_assignment
+from .conditional import resource_versions
+from .eta import get_eta_engine
+from .events import driver_event, publish_on_commit, service_event
+from .geo import EARTH_RADIUS_KM, PointArray, bounding_box
+from .metrics import REGISTRY, phase
+from .models import Driver, Service, calculate_haversine_distance
+from .shards import ShardMap, get_shard_router, shard_settings
+from .spatial import GridIndex
+
+DRIVER_INDEX = getattr(settings, 'DRIVER_INDEX', {})
+
+available_drivers = GridIndex(cell_km=DRIVER_INDEX.get('CELL_KM', 1.0))
+
+_loaded_at = None
+_load_lock = threading.Lock()
+
+
+def reload_driver_index():
+    """Rebuild the available-driver index from the database."""
+    global _loaded_at
+    with _load_lock:
+        rows = Driver.objects.filter(is_available=True).values_list(
+            'pk', 'current_latitude', 'current_longitude'
+        )
+        available_drivers.load(rows.iterator(chunk_size=10000))
+        _loaded_at = time.monotonic()
+
+
+def get_driver_index():
+    """
+    Return the available-driver index, loading it on first use.
+
+    Saves made through the ORM keep the index current via signals; the full
+    reload every ``DRIVER_INDEX['MAX_AGE']`` seconds picks up writes that
+    bypass them (queryset ``update``/``bulk_create``, other processes).
+    """
+    max_age = DRIVER_INDEX.get('MAX_AGE', 60)
+    if _loaded_at is None or (max_age is not None and time.monotonic() - _loaded_at > max_age):
+        reload_driver_index()
+    return available_drivers
+
+
+def index_driver(driver):
+    if driver.is_available:
+        available_drivers.insert(driver.pk, driver.current_latitude, driver.current_longitude)
+    else:
+        available_drivers.remove(driver.pk)
+
+
+@REGISTRY.register_collector
+def _index_metrics():
+    yield 'api_driver_index_size', 'gauge', 'Available drivers in the in-process spatial index.', len(available_drivers)
+
+
+def dispatch_settings():
+    return getattr(settings, 'DISPATCH', {})
+
+
+def dispatch_service(latitude, longitude):
+    """
+    Assign the nearest available driver to a new ``Service``.
+
+    The driver is claimed and the service created in a single transaction,
+    so concurrent requests never share a driver. When no driver can be
+    claimed the service is stored as ``PENDING`` instead, and
+    ``release_driver`` hands it the next driver that frees up (see
+    ``recheck_pending`` for one freed while it was being stored).
+
+    With ``DISPATCH_SHARDS['WORKERS']`` set, the request is handled by the
+    ``ShardWorker`` owning the pickup's region instead. Its write is then
+    recorded here, for replica routing and for this process's event
+    subscribers, as if it had been made locally.
+    """
+    router = get_shard_router()
+    if router is None:
+        return create_service(latitude, longitude)
+    local = []
+
+    def fallback(latitude, longitude):
+        local.append(True)
+        return create_service(latitude, longitude)
+    service = router.dispatch(latitude, longitude, fallback=fallback)
+    if not local:
+        replicas.note_write()
+        publish_on_commit(lambda: [service_event(service)] + (
+            [driver_event(service.assigned_driver)] if service.assigned_driver is not None else []
+        ))
+    return service
+
+
+def create_service(latitude, longitude, nearest=None):
+    """``dispatch_service`` in this process; ``nearest`` overrides the ``DISPATCH['MODE']`` search."""
+    with transaction.atomic():
+        driver, distance = claim_nearest_available_driver(latitude, longitude, nearest)
+        if driver is None:
+            service = Service.objects.create(
+                customer_pickup_latitude=latitude,
+                customer_pickup_longitude=longitude,
+                status=Service.StatusChoices.PENDING
+            )
+            recheck_pending([service], nearest)
+            return service
+        return Service.objects.create(
+            customer_pickup_latitude=latitude,
+            customer_pickup_longitude=longitude,
+            assigned_driver=driver,
+            status=Service.StatusChoices.ASSIGNED,
+            pickup_distance_km=distance,
+            estimated_arrival_time=estimate_arrival(driver, latitude, longitude, distance)
+        )
+
+
+def dispatch_services(pickups):
+    """
+    Assign drivers to a batch of ``(latitude, longitude)`` pickups at once.
+
+    Drivers are matched to minimize the total pickup distance of the whole
+    batch rather than greedily request by request. Each pickup only competes
+    for its ``DISPATCH['BATCH_CANDIDATES']`` nearest drivers; with at least
+    as many candidates as pickups the restricted problem keeps the global
+    optimum. The candidate pool is locked in one query, services are
+    inserted with one ``bulk_create`` and drivers released from the pool
+    with one ``UPDATE``.
+
+    Returns a list aligned with ``pickups`` holding the new services;
+    pickups left without a driver are stored as ``PENDING``.
+    """
+    if not pickups:
+        return []
+    latitudes, longitudes = (list(values) for values in zip(*pickups))
+    k = min(len(pickups), dispatch_settings().get('BATCH_CANDIDATES', 32))
+    with transaction.atomic():
+        with phase('batch_candidates'):
+            drivers = _lock_candidates(latitudes, longitudes, k)
+        services = [
+            Service(customer_pickup_latitude=latitude, customer_pickup_longitude=longitude)
+            for latitude, longitude in zip(latitudes, longitudes)
+        ]
+        if not drivers:
+            Service.objects.bulk_create(services)
+            publish_on_commit(lambda: [service_event(service) for service in services])
+            recheck_pending(services)
+            return services
+
+        points = PointArray(
+            [driver.current_latitude for driver in drivers],
+            [driver.current_longitude for driver in drivers]
+        )
+        with phase('assignment'):
+            rows, cols = linear_sum_assignment(points.distance_matrix(latitudes, longitudes))
+
+        for row, col in zip(rows, cols):
+            driver = drivers[col]
+            driver.is_available = False
+            distance = _distance(driver, latitudes[row], longitudes[row])
+            services[row].assigned_driver = driver
+            services[row].status = Service.StatusChoices.ASSIGNED
+            services[row].pickup_distance_km = distance
+            services[row].estimated_arrival_time = estimate_arrival(
+                driver, latitudes[row], longitudes[row], distance
+            )
+        Service.objects.bulk_create(services)
+        claimed = [drivers[col].pk for col in cols]
+        Driver.objects.filter(pk__in=claimed).update(is_available=False)
+        # bulk_create and update bypass the signals that publish changes.
+        resource_versions.bump_on_commit('api.driver', claimed)
+        publish_on_commit(lambda: [service_event(service) for service in services] + [
+            driver_event(drivers[col]) for col in cols
+        ])
+        recheck_pending(services)
+    # ``update`` bypasses post_save, so keep the index in step by hand.
+    for pk in claimed:
+        available_drivers.remove(pk)
+    return services
+
+
+def _lock_candidates(latitudes, longitudes, k):
+    """
+    Lock the available drivers of the candidate pool.
+
+    In ``index`` mode, entries for drivers that are no longer available
+    are dropped and the pool is ranked again, so they cannot hide
+    available drivers further away. Drivers locked by concurrent
+    requests are left out.
+    """
+    while True:
+        pool = _batch_candidates(latitudes, longitudes, k)
+        drivers = list(_lockable_drivers().filter(pk__in=pool).order_by('pk'))
+        if dispatch_settings().get('MODE', 'index') != 'index' or len(drivers) == len(pool):
+            return drivers
+        indexed = len(available_drivers)
+        _drop_stale(available_drivers, pool - {driver.pk for driver in drivers})
+        if len(available_drivers) == indexed:
+            return drivers
+
+
+def _batch_candidates(latitudes, longitudes, k):
+    """Union of the ``k`` nearest available drivers of every pickup."""
+    mode = dispatch_settings().get('MODE', 'index')
+    pool = set()
+    if mode == 'scan':
+        rows = list(
+            Driver.objects.filter(is_available=True).order_by('pk').values_list(
+                'pk', 'current_latitude', 'current_longitude'
+            )
+        )
+        if rows:
+            pks, fleet_lats, fleet_lons = zip(*rows)
+            fleet = PointArray(fleet_lats, fleet_lons)
+            for latitude, longitude in zip(latitudes, longitudes):
+                positions, _ = fleet.top_k(latitude, longitude, k)
+                pool.update(pks[p] for p in positions)
+    elif mode == 'database':
+        for latitude, longitude in zip(latitudes, longitudes):
+            ranked = _ranked_in_database(Driver.objects.filter(is_available=True), latitude, longitude, k)
+            pool.update(driver.pk for driver in ranked)
+    else:
+        index = get_driver_index()
+        for latitude, longitude in zip(latitudes, longitudes):
+            pool.update(pk for pk, _ in index.nearest_k(latitude, longitude, k))
+    return pool
+
+
+def complete_service(service, status=Service.StatusChoices.COMPLETED):
+    """
+    Close an assigned service and release its driver in one transaction.
+
+    The driver goes straight to the next pending request when there is one
+    (see ``release_driver``). The service row is locked and its status
+    checked again first, so of two concurrent completions only one releases
+    the driver.
+
+    Returns the service, or ``None`` when it was no longer ``ASSIGNED``.
+    """
+    with transaction.atomic():
+        locked = Service.objects.select_for_update().filter(pk=service.pk, status=Service.StatusChoices.ASSIGNED)
+        if locked.values_list('pk', flat=True).first() is None:
+            return None
+        service.status = status
+        service.completion_time = timezone.now()
+        service.save(update_fields=['status', 'completion_time'])
+        release_driver(service.assigned_driver)
+    return service
+
+
+def release_driver(driver):
+    """
+    Hand ``driver`` the next pending service, or leave it available.
+
+    Must run inside ``transaction.atomic()`` by a caller that holds the
+    driver: it is assigned to a service being closed, or was just saved as
+    available. Pending services are locked with ``SKIP LOCKED``, so
+    concurrent releases take different requests. Which one is served first
+    is ``DISPATCH['PENDING_ORDER']``: ``oldest`` (default) or ``nearest``;
+    requests older than ``DISPATCH['PENDING_MAX_AGE']`` seconds are
+    cancelled instead (see ``expire_pending``).
+
+    A request stored as pending while a driver is released concurrently is
+    not visible to that release; ``recheck_pending`` looks for a driver
+    again once it is committed.
+
+    Returns the assigned service, or ``None`` when the driver stays
+    available.
+    """
+    with phase('match_pending'):
+        service = _next_pending(driver)
+    if service is None:
+        if not driver.is_available:
+            driver.is_available = True
+            driver.save(update_fields=['is_available'])
+        return None
+    latitude, longitude = service.customer_pickup_latitude, service.customer_pickup_longitude
+    service.assigned_driver = driver
+    service.status = Service.StatusChoices.ASSIGNED
+    service.pickup_distance_km = _distance(driver, latitude, longitude)
+    service.estimated_arrival_time = estimate_arrival(driver, latitude, longitude, service.pickup_distance_km)
+    service.save(update_fields=['assigned_driver', 'status', 'pickup_distance_km', 'estimated_arrival_time'])
+    if driver.is_available:
+        driver.is_available = False
+        driver.save(update_fields=['is_available'])
+    return service
+
+
+def recheck_pending(services, nearest=None):
+    """
+    Once the current transaction commits, look for a driver again for the
+    ``services`` it stored as ``PENDING``.
+
+    A driver released while they were being stored could not see them; it
+    is still available then. Expired requests are swept at the same time.
+    """
+    pending = [service for service in services if service.status == Service.StatusChoices.PENDING]
+    if pending:
+        transaction.on_commit(lambda: _recheck_pending(pending, nearest), robust=True)
+
+
+def _recheck_pending(services, nearest):
+    expire_pending()
+    for service in services:
+        with transaction.atomic():
+            locked = Service.objects.select_for_update(skip_locked=True).filter(
+                pk=service.pk, status=Service.StatusChoices.PENDING
+            )
+            if locked.values_list('pk', flat=True).first() is None:
+                continue
+            latitude, longitude = service.customer_pickup_latitude, service.customer_pickup_longitude
+            driver, distance = claim_nearest_available_driver(latitude, longitude, nearest)
+            if driver is None:
+                # Nobody is free: the other requests would not find anyone either.
+                return
+            service.assigned_driver = driver
+            service.status = Service.StatusChoices.ASSIGNED
+            service.pickup_distance_km = distance
+            service.estimated_arrival_time = estimate_arrival(driver, latitude, longitude, distance)
+            service.save(update_fields=['assigned_driver', 'status', 'pickup_distance_km', 'estimated_arrival_time'])
+
+
+def expire_pending():
+    """
+    Cancel the ``PENDING`` services older than ``DISPATCH['PENDING_MAX_AGE']``.
+
+    Pollers see them ``CANCELLED`` instead of pending forever. Rows locked
+    by a concurrent match are left to it. Returns how many were cancelled.
+    """
+    max_age = dispatch_settings().get('PENDING_MAX_AGE', 900)
+    if max_age is None:
+        return 0
+    now = timezone.now()
+    with transaction.atomic():
+        expired = list(Service.objects.select_for_update(skip_locked=True).filter(
+            status=Service.StatusChoices.PENDING, request_time__lt=now - timedelta(seconds=max_age)
+        ))
+        if not expired:
+            return 0
+        Service.objects.filter(pk__in=[service.pk for service in expired]).update(
+            status=Service.StatusChoices.CANCELLED, completion_time=now
+        )
+        for service in expired:
+            service.status = Service.StatusChoices.CANCELLED
+            service.completion_time = now
+        # ``update`` bypasses the signal that publishes changes.
+        publish_on_commit(lambda: [service_event(service) for service in expired])
+    return len(expired)
+
+
+def _next_pending(driver):
+    expire_pending()
+    options = dispatch_settings()
+    pending = Service.objects.select_for_update(skip_locked=True).filter(status=Service.StatusChoices.PENDING)
+    max_age = options.get('PENDING_MAX_AGE', 900)
+    if max_age is not None:
+        pending = pending.filter(request_time__gte=timezone.now() - timedelta(seconds=max_age))
+    order = options.get('PENDING_ORDER', 'oldest')
+    if order == 'nearest':
+        distance = haversine_expression(
+            driver.current_latitude, driver.current_longitude,
+            'customer_pickup_latitude', 'customer_pickup_longitude'
+        )
+        pending = pending.alias(distance=distance).order_by('distance', 'pk')
+    elif order == 'oldest':
+        pending = pending.order_by('request_time', 'pk')
+    else:
+        raise ImproperlyConfigured(f"DISPATCH['PENDING_ORDER'] must be 'oldest' or 'nearest', not {order!r}.")
+    return pending.first()
+
+
+def estimate_arrival(driver, latitude, longitude, distance_km):
+    """Arrival time of ``driver`` at the pickup, from the ``ETA['ENGINE']`` model."""
+    now = timezone.now()
+    return now + get_eta_engine().travel_time(
+        driver.current_latitude, driver.current_longitude, latitude, longitude, distance_km, now
+    )
+
+
+def claim_nearest_available_driver(latitude, longitude, nearest=None):
+    """
+    Lock the closest available driver and mark it unavailable.
+
+    Must run inside ``transaction.atomic()``. Candidates are locked with
+    ``SELECT ... FOR UPDATE SKIP LOCKED`` in distance order, so a driver
+    being claimed by a concurrent request is skipped in favour of the next
+    nearest one instead of serializing the requests.
+
+    The search strategy is picked by ``DISPATCH['MODE']``:
+
+    * ``index``: in-process spatial index (default).
+    * ``scan``: vectorized scan over the whole available fleet.
+    * ``database``: bounded search pushed into the database.
+
+    ``nearest(latitude, longitude)``, when given, replaces it; it must
+    return a driver locked like the strategies do, or ``None``.
+
+    Returns ``(driver, distance_km)``, or ``(None, None)`` when every
+    available driver is taken.
+    """
+    if nearest is None:
+        mode = dispatch_settings().get('MODE', 'index')
+        try:
+            nearest = _STRATEGIES[mode]
+        except KeyError:
+            raise ImproperlyConfigured(
+                f"DISPATCH['MODE'] must be one of {', '.join(_STRATEGIES)}, not {mode!r}."
+            )
+    with phase('nearest_driver'):
+        driver = nearest(latitude, longitude)
+    if driver is None:
+        return None, None
+    driver.is_available = False
+    driver.save(update_fields=['is_available'])
+    return driver, _distance(driver, latitude, longitude)
+
+
+def _lockable_drivers():
+    return Driver.objects.select_for_update(skip_locked=True).filter(is_available=True)
+
+
+def _lock_first(pks):
+    """Lock the first of ``pks`` (in order) that is available and not locked."""
+    rank = Case(*(When(pk=pk, then=Value(i)) for i, pk in enumerate(pks)))
+    return _lockable_drivers().filter(pk__in=pks).order_by(rank).first()
+
+
+def _claim_batch_size():
+    return dispatch_settings().get('CLAIM_BATCH', 8)
+
+
+def _nearest_in_index(latitude, longitude, index=None, max_km=None):
+    if index is None:
+        index = get_driver_index()
+    batch = _claim_batch_size()
+    tried = set()
+    while True:
+        pks = [pk for pk, _ in index.nearest_k(latitude, longitude, batch, exclude=tried, max_km=max_km)]
+        if not pks:
+            return None
+        driver = _lock_first(pks)
+        if driver is None:
+            # Everything in the batch is locked or stale.
+            _drop_stale(index, pks)
+            tried.update(pks)
+            continue
+        if index.position(driver.pk) != (driver.current_latitude, driver.current_longitude):
+            # Moved without the index noticing; fix it and rank again.
+            index.insert(driver.pk, driver.current_latitude, driver.current_longitude)
+            continue
+        skipped = pks[:pks.index(driver.pk)]
+        if skipped:
+            _drop_stale(index, skipped)
+        return driver
+
+
+def _drop_stale(index, pks):
+    """Remove the drivers in ``pks`` that are no longer available from the index."""
+    available = set(Driver.objects.filter(pk__in=pks, is_available=True).values_list('pk', flat=True))
+    for pk in pks:
+        if pk not in available:
+            index.remove(pk)
+
+
+def _nearest_by_scan(latitude, longitude):
+    rows = list(
+        Driver.objects.filter(is_available=True).order_by('pk').values_list(
+            'pk', 'current_latitude', 'current_longitude'
+        )
+    )
+    if not rows:
+        return None
+    pks, latitudes, longitudes = zip(*rows)
+    points = PointArray(latitudes, longitudes)
+    batch = _claim_batch_size()
+    start = 0
+    while start < len(pks):
+        positions, _ = points.top_k(latitude, longitude, start + batch)
+        driver = _lock_first([pks[p] for p in positions[start:]])
+        if driver is not None:
+            return driver
+        start += batch
+    return None
+
+
+def haversine_expression(latitude, longitude, lat_field='current_latitude', lon_field='current_longitude'):
+    """Great-circle distance in km from a fixed point, as a database expression."""
+    lat = math.radians(latitude)
+    dlat = Radians(F(lat_field)) - Value(lat)
+    dlon = Radians(F(lon_field)) - Value(math.radians(longitude))
+    a = (
+        Power(Sin(dlat / 2), 2)
+        + Cos(Radians(F(lat_field))) * Value(math.cos(lat)) * Power(Sin(dlon / 2), 2)
+    )
+    return Value(2.0 * EARTH_RADIUS_KM) * ASin(Sqrt(Least(a, Value(1.0))))
+
+
+def bounding_box_filter(latitude, longitude, radius_km, lat_field='current_latitude', lon_field='current_longitude'):
+    """``Q`` restricting rows to the bounding box of a circle, or ``None`` if it covers the globe."""
+    min_lat, max_lat, lon_ranges = bounding_box(latitude, longitude, radius_km)
+    query = Q(**{f'{lat_field}__gte': min_lat, f'{lat_field}__lte': max_lat})
+    if lon_ranges is None:
+        return None if (min_lat, max_lat) == (-90, 90) else query
+    lon_query = Q()
+    for min_lon, max_lon in lon_ranges:
+        lon_query |= Q(**{f'{lon_field}__gte': min_lon, f'{lon_field}__lte': max_lon})
+    return query & lon_query
+
+
+def _nearest_in_database(latitude, longitude):
+    ranked = _ranked_in_database(_lockable_drivers(), latitude, longitude, 1)
+    return ranked[0] if ranked else None
+
+
+def _ranked_in_database(queryset, latitude, longitude, k, max_km=None):
+    # The bounding box is served by the (is_available, current_latitude,
+    # current_longitude) index, so only drivers inside it are ranked. Hits
+    # are only final when k of them lie inside the search circle; otherwise
+    # a closer driver could sit just outside the box, so the radius grows
+    # (up to max_km, when given).
+    options = dispatch_settings()
+    radius = options.get('SEARCH_RADIUS_KM', 5.0)
+    growth = options.get('SEARCH_RADIUS_GROWTH', 2.0)
+    if max_km is not None:
+        radius = min(radius, max_km)
+    distance = haversine_expression(latitude, longitude)
+    while True:
+        box = bounding_box_filter(latitude, longitude, radius)
+        candidates = queryset.alias(distance=distance)
+        if box is not None:
+            candidates = candidates.filter(box, distance__lte=radius)
+        ranked = list(candidates.order_by('distance', 'pk')[:k])
+        if len(ranked) == k or box is None or (max_km is not None and radius >= max_km):
+            return ranked
+        radius = radius * growth if max_km is None else min(radius * growth, max_km)
+
+
+def nearby_drivers(latitude, longitude, k, radius_km, available=None):
+    """
+    The ``k`` closest drivers within ``radius_km`` as ``(driver, distance_km)``.
+
+    ``available`` restricts the search to available (``True``) or busy
+    (``False``) drivers. With ``None``, both are searched and merged.
+    Available drivers come from the spatial index in ``index`` mode. Every
+    other case uses the bounded database search over the
+    ``(is_available, current_latitude, current_longitude)`` index. Neither
+    path scans the table.
+    """
+    found = []
+    for flag in (True, False) if available is None else (available,):
+        if flag and dispatch_settings().get('MODE', 'index') == 'index':
+            found.extend(_nearby_in_index(latitude, longitude, k, radius_km))
+        else:
+            drivers = Driver.objects.filter(is_available=flag)
+            found.extend(
+                (driver, _distance(driver, latitude, longitude))
+                for driver in _ranked_in_database(drivers, latitude, longitude, k, max_km=radius_km)
+            )
+    found.sort(key=lambda item: (item[1], item[0].pk))
+    return found[:k]
+
+
+def _nearby_in_index(latitude, longitude, k, radius_km):
+    index = get_driver_index()
+    pks = [pk for pk, _ in index.nearest_k(latitude, longitude, k, max_km=radius_km)]
+    drivers = Driver.objects.filter(pk__in=pks, is_available=True).in_bulk()
+    if len(drivers) < len(pks):
+        _drop_stale(index, [pk for pk in pks if pk not in drivers])
+    # Rank on the stored positions, which may be newer than the index.
+    found = [(driver, _distance(driver, latitude, longitude)) for driver in drivers.values()]
+    return [(driver, distance) for driver, distance in found if distance <= radius_km]
+
+
+def _distance(driver, latitude, longitude):
+    return calculate_haversine_distance(
+        driver.current_latitude, driver.current_longitude,
+        latitude, longitude
+    )
+
+
+class ShardWorker:
+    """
+    Dispatches the requests of the regions (``ShardMap`` cells) one worker owns.
+
+    The worker keeps its own index of the available drivers in its cells
+    and their neighbours, so a search from an owned cell is exact within
+    ``ShardMap.reach_km`` without touching the rest of the fleet. Requests
+    without a driver that close fall back to the bounded database search,
+    which crosses into the neighbour shards and beyond. Claims still lock
+    the driver rows, so workers whose border areas overlap never share a
+    driver. The index is rebuilt every
+    ``DISPATCH_SHARDS['RELOAD_INTERVAL']`` seconds to pick up drivers freed
+    by other processes.
+    """
+
+    def __init__(self, shard_map, worker, reload_interval=10):
+        self.map = shard_map
+        self.worker = worker
+        self.reload_interval = reload_interval
+        self.index = GridIndex(cell_km=DRIVER_INDEX.get('CELL_KM', 1.0))
+        self._kept = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def owns(self, cell):
+        return self.map.owner(cell) == self.worker
+
+    def keeps(self, cell):
+        """Whether drivers in ``cell`` belong in this worker's index."""
+        kept = self._kept.get(cell)
+        if kept is None:
+            kept = self._kept[cell] = self.owns(cell) or any(map(self.owns, self.map.neighbors(cell)))
+        return kept
+
+    def reload(self):
+        with self._lock:
+            rows = list(Driver.objects.filter(is_available=True).values_list(
+                'pk', 'current_latitude', 'current_longitude'
+            ))
+            if rows:
+                pks, latitudes, longitudes = zip(*rows)
+                cells = self.map.cells(latitudes, longitudes)
+                unique = np.unique(cells)
+                kept = unique[[self.keeps(divmod(int(cell), self.map.cols)) for cell in unique]]
+                rows = [rows[i] for i in np.flatnonzero(np.isin(cells, kept))]
+            self.index.load(rows)
+            self._loaded_at = time.monotonic()
+
+    def dispatch(self, latitude, longitude):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.reload_interval:
+            self.reload()
+        service = create_service(latitude, longitude, nearest=self.nearest)
+        if service.assigned_driver_id is not None:
+            self.index.remove(service.assigned_driver_id)
+        return service
+
+    def nearest(self, latitude, longitude):
+        reach = self.map.reach_km(self.map.cell(latitude, longitude))
+        driver = _nearest_in_index(latitude, longitude, self.index, max_km=reach)
+        if driver is None:
+            driver = _nearest_in_database(latitude, longitude)
+        return driver
+
+
+def shard_worker(worker):
+    """The ``ShardWorker`` for position ``worker`` of ``DISPATCH_SHARDS['WORKERS']``."""
+    options = shard_settings()
+    shard_map = ShardMap(options.get('PRECISION', 4), len(options['WORKERS']))
+    return ShardWorker(shard_map, worker, options.get('RELOAD_INTERVAL', 10))
+
+
+_STRATEGIES = {
+    'index': _nearest_in_index,
+    'scan': _nearest_by_scan,
+    'database': _nearest_in_database,
+}
@@ -0,0 +1,199 @@
+import json
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .cache import LRUCache
+from .geo import haversine
+from .metrics import REGISTRY
+
+HOURS = 24
+
+# Grid file layout: MAGIC, a little-endian uint32 header length, the JSON
+# header, zero padding to a multiple of ALIGN bytes, then float32 speeds
+# in C order with shape (rows, cols, HOURS).
+MAGIC = b'ETAGRID1'
+ALIGN = 64
+
+
+def eta_settings():
+    return getattr(settings, 'ETA', {})
+
+
+class SpeedGrid:
+    """
+    Average speed (km/h) per spatial cell and hour of day.
+
+    Cells are ``cell_deg`` degrees squared, counted from ``(lat0, lon0)``.
+    The speeds are memory-mapped, so opening a grid reads only its header
+    and a lookup touches a single page. Points outside the grid get the
+    city-wide speed for the hour (``hourly``).
+    """
+
+    def __init__(self, lat0, lon0, cell_deg, speeds, hourly, **meta):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.cell_deg = cell_deg
+        self.speeds = speeds
+        self.rows, self.cols = speeds.shape[:2]
+        self.hourly = [float(speed) for speed in hourly]
+        self.meta = meta
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not an ETA grid file.')
+            (length,) = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(length))
+        offset = _data_offset(length)
+        shape = (header.pop('rows'), header.pop('cols'), HOURS)
+        speeds = np.memmap(path, dtype='<f4', mode='r', offset=offset, shape=shape)
+        return cls(speeds=speeds, **header)
+
+    def save(self, path):
+        """Write the grid next to ``path`` and move it into place atomically."""
+        header = json.dumps({
+            'lat0': self.lat0, 'lon0': self.lon0, 'cell_deg': self.cell_deg,
+            'rows': self.rows, 'cols': self.cols, 'hourly': self.hourly, **self.meta
+        }).encode()
+        offset = _data_offset(len(header))
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(MAGIC + struct.pack('<I', len(header)) + header)
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(np.ascontiguousarray(self.speeds, dtype='<f4').tobytes())
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def cell(self, latitude, longitude):
+        return (
+            math.floor((latitude - self.lat0) / self.cell_deg),
+            math.floor((longitude - self.lon0) / self.cell_deg)
+        )
+
+    def speed(self, cell, hour):
+        row, col = cell
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return float(self.speeds[row, col, hour])
+        return self.hourly[hour]
+
+
+def _data_offset(header_length):
+    return -(-(len(MAGIC) + 4 + header_length) // ALIGN) * ALIGN
+
+
+class ConstantSpeedETA:
+    """Straight-line distance at ``ETA['DEFAULT_SPEED_KPH']``."""
+
+    def __init__(self, options):
+        self.default_speed = options.get('DEFAULT_SPEED_KPH', 40.0)
+
+    def speed(self, from_lat, from_lon, to_lat, to_lon, when):
+        return self.default_speed
+
+    def travel_time(self, from_lat, from_lon, to_lat, to_lon, distance_km=None, when=None):
+        if distance_km is None:
+            distance_km = haversine(from_lat, from_lon, to_lat, to_lon)
+        when = when or timezone.now()
+        return timedelta(hours=distance_km / self.speed(from_lat, from_lon, to_lat, to_lon, when))
+
+
+class GridETA(ConstantSpeedETA):
+    """
+    Straight-line distance at the speed of a precomputed ``SpeedGrid``.
+
+    The trip speed is the mean of the origin and destination cell speeds
+    at the hour of departure. It is memoized in an LRU keyed on
+    ``(origin cell, destination cell, hour)``, so repeated dispatches in
+    the same area skip the grid entirely. The grid file
+    (``ETA['GRID_PATH']``, built by ``manage.py refresh_eta_grid``) is
+    re-opened when it changes, checked every ``ETA['RELOAD_INTERVAL']``
+    seconds. Without a grid file the default speed applies.
+    """
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.path = options.get('GRID_PATH')
+        self.reload_interval = options.get('RELOAD_INTERVAL', 60)
+        self.cache = LRUCache(maxsize=options.get('CACHE_SIZE', 100000))
+        self._grid = None
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def grid(self):
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at > self.reload_interval:
+            with self._lock:
+                self._refresh()
+                self._checked_at = now
+        return self._grid
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path) if self.path else None
+        except FileNotFoundError:
+            stat = None
+        version = stat and (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if version != self._version:
+            self._grid = SpeedGrid.open(self.path) if version else None
+            self._version = version
+            self.cache.clear()
+
+    def speed(self, from_lat, from_lon, to_lat, to_lon, when):
+        grid = self.grid()
+        if grid is None:
+            return self.default_speed
+        # The default (not the activated) time zone, like refresh_eta_grid;
+        # localtime() costs more than the rest of the lookup.
+        hour = when.astimezone(timezone.get_default_timezone()).hour
+        key = (grid.cell(from_lat, from_lon), grid.cell(to_lat, to_lon), hour)
+        speed = self.cache.get(key)
+        if speed is None:
+            speed = (grid.speed(key[0], hour) + grid.speed(key[1], hour)) / 2
+            self.cache.set(key, speed)
+        return speed
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_eta_engine():
+    """The ``ETA['ENGINE']`` instance shared by the process."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                options = eta_settings()
+                _engine = import_string(options.get('ENGINE', 'api.eta.GridETA'))(options)
+    return _engine
+
+
+def reset_eta_engine():
+    global _engine
+    _engine = None
+
+
+@REGISTRY.register_collector
+def _eta_cache_metrics():
+    cache = getattr(_engine, 'cache', None)
+    if cache is not None:
+        stats = cache.stats()
+        yield 'api_eta_cache_hits_total', 'counter', 'ETA speeds served from the memo cache.', stats['hits']
+        yield 'api_eta_cache_misses_total', 'counter', 'ETA speeds looked up in the grid.', stats['misses']
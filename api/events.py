@@ -0,0 +1,177 @@
+import asyncio
+import itertools
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+
+from .metrics import REGISTRY
+
+
+def events_settings():
+    return getattr(settings, 'EVENTS', {})
+
+
+class Subscription:
+    """
+    One subscriber's bounded event queue.
+
+    Events are pushed from any thread and drained from the subscriber's own
+    event loop. When the queue is full the oldest event is dropped and
+    counted in ``lost``, so a slow client costs at most ``maxsize`` events
+    of memory and learns that it has to resync.
+    """
+
+    def __init__(self, bus, predicate, maxsize, loop):
+        self.bus = bus
+        self.predicate = predicate
+        self.maxsize = maxsize
+        self.lost = 0
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+        self._loop = loop
+
+    def push(self, event):
+        if self.predicate is not None and not self.predicate(event):
+            return
+        with self._lock:
+            if len(self._events) >= self.maxsize:
+                self._events.popleft()
+                self.lost += 1
+            self._events.append(event)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # The subscriber's loop is gone.
+            self.close()
+
+    async def get(self, timeout):
+        """Wait up to ``timeout`` seconds for events; returns ``(events, lost)``."""
+        # Wake-ups scheduled by push() only run once this coroutine yields,
+        # so clearing before the check cannot miss one.
+        self._ready.clear()
+        if not self._events:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        with self._lock:
+            events, self._events = list(self._events), deque()
+            lost, self.lost = self.lost, 0
+        return events, lost
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """
+    In-process pub/sub of change events.
+
+    ``publish`` is cheap with no subscribers, so the event sources below
+    skip building payloads unless someone is listening. Each published
+    event gets an increasing ``seq``. Events only reach
+    subscribers of the same process.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.published = 0
+
+    def __bool__(self):
+        return bool(self._subscribers)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self, predicate=None, maxsize=1000):
+        """Subscribe from a running event loop; returns a ``Subscription``."""
+        subscription = Subscription(self, predicate, maxsize, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event):
+        if not self._subscribers:
+            return
+        event['seq'] = next(self._ids)
+        self.published += 1
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(event)
+
+
+event_bus = EventBus()
+
+
+@REGISTRY.register_collector
+def _event_metrics():
+    yield 'api_event_subscribers', 'gauge', 'Open event stream subscriptions.', len(event_bus)
+    yield 'api_events_published_total', 'counter', 'Change events published to subscribers.', event_bus.published
+
+
+def driver_event(driver, deleted=False):
+    return position_event(driver.pk, driver.current_latitude, driver.current_longitude, driver.is_available, deleted)
+
+
+def position_event(driver_id, latitude, longitude, is_available, deleted=False):
+    return {
+        'type': 'driver', 'id': driver_id, 'is_available': is_available,
+        'latitude': latitude, 'longitude': longitude, 'deleted': deleted,
+    }
+
+
+def service_event(service):
+    return {
+        'type': 'service', 'id': service.pk, 'status': service.status,
+        'assigned_driver': service.assigned_driver_id,
+        'latitude': service.customer_pickup_latitude, 'longitude': service.customer_pickup_longitude,
+    }
+
+
+def publish_on_commit(build):
+    """Publish the events returned by ``build()`` once the current transaction commits."""
+    if not event_bus:
+        return
+
+    def publish():
+        for event in build():
+            event_bus.publish(event)
+    transaction.on_commit(publish)
+
+
+def event_filter(types=None, bbox=None, drivers=None):
+    """
+    Predicate for ``EventBus.subscribe``.
+
+    ``bbox`` is ``(min_lat, min_lon, max_lat, max_lon)`` (``min_lon >
+    max_lon`` wraps the antimeridian) and is matched against driver
+    positions and service pickups. ``drivers`` matches driver events by id
+    and service events by assigned driver.
+    """
+    def matches(event):
+        if types is not None and event['type'] not in types:
+            return False
+        if drivers is not None:
+            driver = event['id'] if event['type'] == 'driver' else event['assigned_driver']
+            if driver not in drivers:
+                return False
+        if bbox is not None:
+            min_lat, min_lon, max_lat, max_lon = bbox
+            latitude, longitude = event['latitude'], event['longitude']
+            if not min_lat <= latitude <= max_lat:
+                return False
+            if min_lon <= max_lon:
+                return min_lon <= longitude <= max_lon
+            return longitude >= min_lon or longitude <= max_lon
+        return True
+    return matches
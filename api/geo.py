@@ -0,0 +1,145 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+
+_DEG_TO_RAD = math.pi / 180.0
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between two points given in degrees."""
+    lat1 *= _DEG_TO_RAD
+    lat2 *= _DEG_TO_RAD
+    dlat = lat2 - lat1
+    dlon = lon2 * _DEG_TO_RAD - lon1 * _DEG_TO_RAD
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * math.asin(math.sqrt(a)) * EARTH_RADIUS_KM
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    Return ``(min_lat, max_lat, lon_ranges)`` enclosing a circle of ``radius_km``.
+
+    ``lon_ranges`` is a list of ``(min_lon, max_lon)`` pairs (two when the box
+    wraps the antimeridian) or ``None`` when every longitude is covered, as
+    happens once the circle reaches a pole.
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angle)
+    min_lat, max_lat = latitude - dlat, latitude + dlat
+    if min_lat <= -90 or max_lat >= 90 or angle >= math.pi / 2:
+        return max(min_lat, -90.0), min(max_lat, 90.0), None
+    dlon = math.degrees(math.asin(math.sin(angle) / math.cos(latitude * _DEG_TO_RAD)))
+    min_lon, max_lon = longitude - dlon, longitude + dlon
+    if min_lon < -180:
+        return min_lat, max_lat, [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    if max_lon > 180:
+        return min_lat, max_lat, [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    return min_lat, max_lat, [(min_lon, max_lon)]
+
+
+def as_coordinates(values):
+    """Return ``values`` as a contiguous float64 array without copying when possible."""
+    return np.ascontiguousarray(values, dtype=np.float64)
+
+
+class PointArray:
+    """
+    Contiguous float64 coordinates with per-point trigonometry precomputed.
+
+    Build one from the driver (or address) coordinates once, then query it
+    from any number of origins; each query is a handful of vectorized NumPy
+    passes over the arrays instead of a Python call per point.
+    """
+
+    def __init__(self, latitudes, longitudes, ids=None):
+        self.latitudes = as_coordinates(latitudes)
+        self.longitudes = as_coordinates(longitudes)
+        if self.latitudes.shape != self.longitudes.shape or self.latitudes.ndim != 1:
+            raise ValueError("latitudes and longitudes must be 1-d arrays of the same length.")
+        self.ids = None if ids is None else np.asarray(ids)
+        self._lat_rad = np.radians(self.latitudes)
+        self._lon_rad = np.radians(self.longitudes)
+        self._cos_lat = np.cos(self._lat_rad)
+
+    def __len__(self):
+        return self.latitudes.shape[0]
+
+    def distances(self, latitude, longitude, out=None):
+        """Distances in km from one origin to every point."""
+        lat = latitude * _DEG_TO_RAD
+        lon = longitude * _DEG_TO_RAD
+        a = np.subtract(self._lat_rad, lat, out=out)
+        a *= 0.5
+        np.sin(a, out=a)
+        np.square(a, out=a)
+        b = self._lon_rad - lon
+        b *= 0.5
+        np.sin(b, out=b)
+        np.square(b, out=b)
+        b *= self._cos_lat
+        b *= math.cos(lat)
+        a += b
+        np.sqrt(a, out=a)
+        np.arcsin(a, out=a)
+        a *= 2 * EARTH_RADIUS_KM
+        return a
+
+    def distance_matrix(self, latitudes, longitudes):
+        """Distances in km, shape ``(len(origins), len(self))``."""
+        lat = np.radians(as_coordinates(latitudes))[:, np.newaxis]
+        lon = np.radians(as_coordinates(longitudes))[:, np.newaxis]
+        a = np.sin((self._lat_rad - lat) * 0.5) ** 2
+        a += np.cos(lat) * self._cos_lat * np.sin((self._lon_rad - lon) * 0.5) ** 2
+        np.sqrt(a, out=a)
+        np.arcsin(a, out=a)
+        a *= 2 * EARTH_RADIUS_KM
+        return a
+
+    def nearest(self, latitude, longitude):
+        """Return ``(position, distance_km)`` of the closest point, or ``None``."""
+        if not len(self):
+            return None
+        distances = self.distances(latitude, longitude)
+        position = int(np.argmin(distances))
+        return position, float(distances[position])
+
+    def top_k(self, latitude, longitude, k):
+        """
+        Return ``(positions, distances_km)`` of the ``k`` closest points.
+
+        Results are sorted by distance, ties by position, so the first entry
+        always agrees with ``nearest``.
+        """
+        distances = self.distances(latitude, longitude)
+        return _smallest(distances, k)
+
+    def nearest_many(self, latitudes, longitudes):
+        """Return ``(positions, distances_km)`` of the closest point per origin."""
+        matrix = self.distance_matrix(latitudes, longitudes)
+        positions = np.argmin(matrix, axis=1)
+        return positions, matrix[np.arange(matrix.shape[0]), positions]
+
+
+def _smallest(distances, k):
+    k = min(k, distances.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+    if k == 1:
+        positions = np.array([np.argmin(distances)])
+        return positions, distances[positions]
+    if k < distances.shape[0]:
+        # Keep every point tied with the k-th distance so ties resolve by position.
+        kth = distances[np.argpartition(distances, k - 1)[k - 1]]
+        candidates = np.flatnonzero(distances <= kth)
+    else:
+        candidates = np.arange(distances.shape[0])
+    order = np.lexsort((candidates, distances[candidates]))
+    positions = candidates[order[:k]]
+    return positions, distances[positions]
+
+
+def haversine_distances(latitude, longitude, latitudes, longitudes):
+    """One-shot distances in km from one origin to arrays of coordinates."""
+    return PointArray(latitudes, longitudes).distances(latitude, longitude)
@@ -0,0 +1,70 @@
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import REGISTRY, phase
+from .models import Address
+from .spatial import PackedGridIndex
+
+ADDRESS_INDEX = getattr(settings, 'ADDRESS_INDEX', {})
+
+address_index = PackedGridIndex(
+    cell_deg=ADDRESS_INDEX.get('CELL_DEG', 0.01),
+    start_km=ADDRESS_INDEX.get('SEARCH_RADIUS_KM', 0.5),
+    growth=ADDRESS_INDEX.get('SEARCH_RADIUS_GROWTH', 2.0),
+    compact_after=ADDRESS_INDEX.get('COMPACT_AFTER', 2000)
+)
+
+_loaded_at = None
+_load_lock = threading.Lock()
+
+
+def reload_address_index():
+    """Rebuild the address index from the database."""
+    global _loaded_at
+    with _load_lock:
+        rows = Address.objects.values_list('pk', 'latitude', 'longitude')
+        address_index.load(rows.iterator(chunk_size=10000))
+        _loaded_at = time.monotonic()
+
+
+def get_address_index():
+    """
+    Return the address index, loading it on first use.
+
+    Like the driver index: ORM saves and deletes keep it current through
+    signals, and a full reload every ``ADDRESS_INDEX['MAX_AGE']`` seconds
+    picks up writes that bypass them (``seed_data``, other processes).
+    """
+    max_age = ADDRESS_INDEX.get('MAX_AGE', 3600)
+    if _loaded_at is None or (max_age is not None and time.monotonic() - _loaded_at > max_age):
+        reload_address_index()
+    return address_index
+
+
+def index_address(address):
+    address_index.insert(address.pk, address.latitude, address.longitude)
+
+
+@REGISTRY.register_collector
+def _index_metrics():
+    yield 'api_address_index_size', 'gauge', 'Addresses in the in-process spatial index.', len(address_index)
+
+
+def nearby_addresses(latitude, longitude, k, radius_km):
+    """The ``k`` closest addresses within ``radius_km`` as ``(address, distance_km)``, closest first."""
+    with phase('address_search'):
+        found = get_address_index().nearest_k(latitude, longitude, k, max_km=radius_km)
+    addresses = Address.objects.in_bulk([pk for pk, _ in found])
+    for pk, _ in found:
+        if pk not in addresses:
+            # Deleted without the index noticing.
+            address_index.remove(pk)
+    return [(addresses[pk], distance) for pk, distance in found if pk in addresses]
+
+
+def reverse_geocode(latitude, longitude, radius_km):
+    """Snap a coordinate to the closest known address within ``radius_km``, or ``None``."""
+    found = nearby_addresses(latitude, longitude, 1, radius_km)
+    return found[0] if found else None
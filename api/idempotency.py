@@ -0,0 +1,277 @@
+import asyncio
+import functools
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import exceptions, status
+from rest_framework.response import Response
+
+from .cache import LRUCache
+from .metrics import REGISTRY, Counter
+from .models import IdempotencyRecord
+from .renderers import FastJSONRenderer
+
+HEADER = 'Idempotency-Key'
+# Response headers kept for replays.
+REPLAYED_HEADERS = ('Location', 'Preference-Applied')
+
+StoredResponse = namedtuple('StoredResponse', 'fingerprint status_code content headers')
+
+idempotent_requests = REGISTRY.register(Counter(
+    'api_idempotent_requests', 'Requests carrying an Idempotency-Key, by outcome.', ('outcome',)
+))
+
+
+def idempotency_settings():
+    return getattr(settings, 'IDEMPOTENCY', {})
+
+
+class IdempotencyKeyMismatch(exceptions.APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'La Idempotency-Key ya se usó con otra solicitud.'
+    default_code = 'idempotency_key_mismatch'
+
+
+class IdempotencyKeyInProgress(exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Otra solicitud con esta Idempotency-Key sigue en curso; reintenta más tarde.'
+    default_code = 'idempotency_key_in_progress'
+
+
+class IdempotencyStore:
+    """
+    Responses of requests made with an ``Idempotency-Key``.
+
+    Finished responses live in an in-process LRU for
+    ``IDEMPOTENCY['TTL']`` seconds. With ``IDEMPOTENCY['DATABASE']`` they
+    are also kept in ``IdempotencyRecord`` rows, so every worker process
+    sees them. A key is claimed before the request runs: duplicates that
+    arrive meanwhile wait for the first response (on an event in the same
+    process, by polling the row across processes) instead of running the
+    request again.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._purged_at = time.monotonic()
+        self.configure()
+
+    def configure(self):
+        options = idempotency_settings()
+        self.ttl = options.get('TTL', 86400)
+        self.use_database = options.get('DATABASE', False)
+        self.cache = LRUCache(maxsize=options.get('CACHE_SIZE', 10000), ttl=self.ttl)
+
+    def acquire(self, key, fingerprint, timeout=0.0):
+        """
+        Claim ``key``; returns the stored response of a finished duplicate, or ``None``.
+
+        Waits up to ``timeout`` seconds for a duplicate in flight, then
+        raises ``IdempotencyKeyInProgress``. A key stored for another
+        request raises ``IdempotencyKeyMismatch``. A claim must be ended
+        with ``complete`` or ``release``.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                stored = self.cache.get(key)
+                inflight = None if stored is not None else self._inflight.get(key)
+                if stored is None and inflight is None:
+                    self._inflight[key] = (fingerprint, threading.Event())
+            if stored is not None:
+                return _checked(stored, fingerprint)
+            if inflight is None:
+                break
+            if inflight[0] != fingerprint:
+                raise IdempotencyKeyMismatch()
+            if not inflight[1].wait(max(deadline - time.monotonic(), 0)):
+                raise IdempotencyKeyInProgress()
+        if not self.use_database:
+            return None
+        try:
+            stored = self._acquire_row(key, fingerprint, deadline)
+        except BaseException:
+            self._finish(key)
+            raise
+        if stored is not None:
+            self.cache.set(key, stored)
+            self._finish(key)
+        return stored
+
+    def _acquire_row(self, key, fingerprint, deadline):
+        poll = idempotency_settings().get('POLL_INTERVAL', 0.05)
+        lock_timeout = timedelta(seconds=idempotency_settings().get('LOCK_TIMEOUT', 60))
+        while True:
+            try:
+                with transaction.atomic():
+                    IdempotencyRecord.objects.create(
+                        key=key, fingerprint=fingerprint, expires_at=timezone.now() + lock_timeout
+                    )
+                return None
+            except IntegrityError:
+                pass
+            record = IdempotencyRecord.objects.filter(key=key).first()
+            if record is None or record.expires_at <= timezone.now():
+                # Expired, or the holder of a stale claim crashed.
+                IdempotencyRecord.objects.filter(key=key, expires_at__lte=timezone.now()).delete()
+                continue
+            if record.fingerprint != fingerprint:
+                raise IdempotencyKeyMismatch()
+            if record.status_code is not None:
+                return StoredResponse(
+                    record.fingerprint, record.status_code, bytes(record.content), record.headers
+                )
+            if time.monotonic() >= deadline:
+                raise IdempotencyKeyInProgress()
+            time.sleep(poll)
+
+    def complete(self, key, stored):
+        try:
+            self.cache.set(key, stored)
+            if self.use_database:
+                IdempotencyRecord.objects.filter(key=key).update(
+                    status_code=stored.status_code, content=stored.content, headers=stored.headers,
+                    expires_at=timezone.now() + timedelta(seconds=self.ttl)
+                )
+                self._purge()
+        finally:
+            self._finish(key)
+
+    def release(self, key):
+        """Give up a claim without storing a response, so a retry runs again."""
+        try:
+            if self.use_database:
+                IdempotencyRecord.objects.filter(key=key, status_code__isnull=True).delete()
+        finally:
+            self._finish(key)
+
+    def _finish(self, key):
+        with self._lock:
+            inflight = self._inflight.pop(key, None)
+        if inflight is not None:
+            inflight[1].set()
+
+    def _purge(self):
+        if time.monotonic() - self._purged_at > idempotency_settings().get('PURGE_INTERVAL', 300):
+            self._purged_at = time.monotonic()
+            IdempotencyRecord.objects.filter(expires_at__lt=timezone.now()).delete()
+
+
+def _checked(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        raise IdempotencyKeyMismatch()
+    return stored
+
+
+idempotency_store = IdempotencyStore()
+
+
+@REGISTRY.register_collector
+def _idempotency_metrics():
+    yield 'api_idempotency_cache_size', 'gauge', 'Responses held for Idempotency-Key replays.', len(
+        idempotency_store.cache
+    )
+
+
+def idempotent(method):
+    """
+    Make a view's ``post`` replay the first response for a repeated ``Idempotency-Key``.
+
+    Keys are scoped to the user and the path, and bound to the request
+    body. Responses under 500 are stored; on a server error or exception
+    the key is released so the client can retry. Works on DRF ``APIView``
+    and ``AsyncAPIView`` handlers; async ones wait for duplicates on the
+    event loop.
+    """
+    if iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def wrapper(self, request, *args, **kwargs):
+            claim = _claim(request)
+            if claim is None:
+                return await method(self, request, *args, **kwargs)
+            key, fingerprint = claim
+            deadline = time.monotonic() + idempotency_settings().get('WAIT', 10)
+            poll = idempotency_settings().get('POLL_INTERVAL', 0.05)
+            while True:
+                try:
+                    stored = await sync_to_async(idempotency_store.acquire)(key, fingerprint)
+                    break
+                except IdempotencyKeyInProgress:
+                    if time.monotonic() >= deadline:
+                        raise
+                    await asyncio.sleep(poll)
+            if stored is not None:
+                return _replay(stored)
+            return await sync_to_async(_stored_or_released)(
+                key, fingerprint, await _run_async(method, key, self, request, *args, **kwargs)
+            )
+    else:
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            claim = _claim(request)
+            if claim is None:
+                return method(self, request, *args, **kwargs)
+            key, fingerprint = claim
+            stored = idempotency_store.acquire(key, fingerprint, idempotency_settings().get('WAIT', 10))
+            if stored is not None:
+                return _replay(stored)
+            try:
+                response = method(self, request, *args, **kwargs)
+            except BaseException:
+                idempotency_store.release(key)
+                raise
+            return _stored_or_released(key, fingerprint, response)
+    return wrapper
+
+
+async def _run_async(method, key, *args, **kwargs):
+    try:
+        return await method(*args, **kwargs)
+    except BaseException:
+        await sync_to_async(idempotency_store.release)(key)
+        raise
+
+
+def _claim(request):
+    """``(key, fingerprint)`` for a request with an ``Idempotency-Key``, else ``None``."""
+    value = request.headers.get(HEADER)
+    if value is None:
+        return None
+    if not value or len(value) > idempotency_settings().get('MAX_KEY_LENGTH', 255):
+        raise exceptions.ValidationError({HEADER: 'Debe tener entre 1 y 255 caracteres.'})
+    scope = f'{getattr(request.user, "pk", None)}:{request.method}:{request.path}:{value}'
+    key = hashlib.sha256(scope.encode()).hexdigest()
+    return key, hashlib.sha256(request.body).hexdigest()
+
+
+def _stored_or_released(key, fingerprint, response):
+    if response.status_code >= 500:
+        idempotency_store.release(key)
+        idempotent_requests.inc('released')
+        return response
+    if isinstance(response, Response):
+        content = FastJSONRenderer().render(response.data)
+    else:
+        content = response.content
+    headers = {name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)}
+    idempotency_store.complete(key, StoredResponse(fingerprint, response.status_code, content, headers))
+    idempotent_requests.inc('stored')
+    return response
+
+
+def _replay(stored):
+    idempotent_requests.inc('replayed')
+    response = HttpResponse(stored.content, status=stored.status_code, content_type='application/json')
+    for name, value in stored.headers.items():
+        response[name] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
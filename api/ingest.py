@@ -0,0 +1,200 @@
+import logging
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .conditional import resource_versions
+from .dispatch import available_drivers
+from .events import position_event, publish_on_commit
+from .metrics import REGISTRY, Counter
+from .models import Driver
+
+logger = logging.getLogger(__name__)
+
+# Driver ids are bigint primary keys.
+MAX_DRIVER_ID = 2 ** 63 - 1
+
+pings_dropped = REGISTRY.register(Counter(
+    'api_location_pings_dropped', 'Buffered location pings lost because their flush failed.'
+))
+
+
+def ingest_settings():
+    return getattr(settings, 'LOCATION_INGEST', {})
+
+
+def parse_ping(item):
+    """
+    Return ``(driver_id, latitude, longitude, timestamp)`` or ``None`` if invalid.
+
+    Pings are either objects with ``driver_id``, ``latitude``, ``longitude``
+    and ``timestamp`` keys or ``[driver_id, latitude, longitude, timestamp]``
+    arrays. Timestamps are epoch seconds or ISO 8601 strings.
+    """
+    try:
+        if isinstance(item, dict):
+            driver_id, latitude, longitude, timestamp = (
+                item['driver_id'], item['latitude'], item['longitude'], item['timestamp']
+            )
+        else:
+            driver_id, latitude, longitude, timestamp = item
+        if isinstance(driver_id, bool) or not isinstance(driver_id, int) or not 1 <= driver_id <= MAX_DRIVER_ID:
+            return None
+        latitude, longitude = float(latitude), float(longitude)
+        if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+            timestamp = datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+        else:
+            timestamp = parse_datetime(timestamp)
+    except (KeyError, TypeError, ValueError, OverflowError, OSError):
+        return None
+    if timestamp is None or not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
+        return None
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, dt_timezone.utc)
+    max_skew = ingest_settings().get('MAX_CLOCK_SKEW', 60)
+    if timestamp > timezone.now() + timedelta(seconds=max_skew):
+        return None
+    return driver_id, latitude, longitude, timestamp
+
+
+class LocationBuffer:
+    """
+    Coalesces driver location pings between flushes.
+
+    Only the newest ping per driver survives until the next flush, and a
+    flush writes them all with a single statement that skips any ping older
+    than the position already stored. Flushes happen every
+    ``LOCATION_INGEST['FLUSH_INTERVAL']`` seconds from a timer thread, or
+    inline as soon as ``MAX_PENDING`` drivers are waiting (or when the
+    interval is 0). A flush that fails is logged and its pings counted in
+    ``api_location_pings_dropped_total``.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, pings):
+        """Buffer parsed pings; returns ``(accepted, stale)`` counts."""
+        accepted = stale = 0
+        with self._lock:
+            pending = self._pending
+            for ping in pings:
+                current = pending.get(ping[0])
+                if current is not None and current[3] >= ping[3]:
+                    stale += 1
+                    continue
+                pending[ping[0]] = ping
+                accepted += 1
+            size = len(pending)
+        options = ingest_settings()
+        interval = options.get('FLUSH_INTERVAL', 1.0)
+        if not interval or size >= options.get('MAX_PENDING', 10000):
+            self.flush()
+        elif size:
+            self._schedule(interval)
+        return accepted, stale
+
+    def _schedule(self, interval):
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(interval, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    def flush(self):
+        """Write the buffered pings; returns the number of drivers updated."""
+        with self._flush_lock:
+            with self._lock:
+                pings, self._pending = list(self._pending.values()), {}
+            if not pings:
+                return 0
+            try:
+                with transaction.atomic():
+                    updated = write_locations(pings)
+                    publish_on_commit(lambda: [position_event(*row) for row in updated])
+                    if updated:
+                        resource_versions.bump_on_commit('api.driver', [row[0] for row in updated])
+            except Exception:
+                # Often in the timer thread, where nobody would see it.
+                pings_dropped.inc(amount=len(pings))
+                logger.exception('Dropped %d buffered location pings: the flush failed.', len(pings))
+                return 0
+            # Raw updates bypass post_save, so refresh the index here.
+            for driver_id, latitude, longitude, is_available in updated:
+                if is_available:
+                    available_drivers.insert(driver_id, latitude, longitude)
+            return len(updated)
+
+
+def write_locations(pings):
+    """
+    Store ``(driver_id, latitude, longitude, timestamp)`` pings in one write.
+
+    Pings older than the driver's stored ``location_updated_at`` are
+    ignored. Returns ``(driver_id, latitude, longitude, is_available)`` for
+    every driver that moved.
+    """
+    if connection.vendor == 'postgresql':
+        return _update_from_values(pings)
+    return _bulk_update(pings)
+
+
+def _update_from_values(pings):
+    qn = connection.ops.quote_name
+    meta = Driver._meta
+    column = {name: qn(meta.get_field(name).column) for name in (
+        'id', 'current_latitude', 'current_longitude', 'location_updated_at', 'is_available'
+    )}
+    values = ', '.join(['(%s::bigint, %s::double precision, %s::double precision, %s::timestamptz)'] * len(pings))
+    sql = (
+        f"UPDATE {qn(meta.db_table)} AS d SET "
+        f"{column['current_latitude']} = v.lat, {column['current_longitude']} = v.lon, "
+        f"{column['location_updated_at']} = v.ts "
+        f"FROM (VALUES {values}) AS v (id, lat, lon, ts) "
+        f"WHERE d.{column['id']} = v.id "
+        f"AND (d.{column['location_updated_at']} IS NULL OR d.{column['location_updated_at']} < v.ts) "
+        f"RETURNING d.{column['id']}, v.lat, v.lon, d.{column['is_available']}"
+    )
+    params = [value for ping in pings for value in ping]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _bulk_update(pings):
+    by_id = {ping[0]: ping for ping in pings}
+    drivers = []
+    for driver in Driver.objects.filter(pk__in=by_id).only('pk', 'location_updated_at', 'is_available'):
+        _, latitude, longitude, timestamp = by_id[driver.pk]
+        if driver.location_updated_at is not None and driver.location_updated_at >= timestamp:
+            continue
+        driver.current_latitude, driver.current_longitude = latitude, longitude
+        driver.location_updated_at = timestamp
+        drivers.append(driver)
+    Driver.objects.bulk_update(drivers, ['current_latitude', 'current_longitude', 'location_updated_at'])
+    return [
+        (driver.pk, driver.current_latitude, driver.current_longitude, driver.is_available)
+        for driver in drivers
+    ]
+
+
+location_buffer = LocationBuffer()
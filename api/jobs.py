@@ -0,0 +1,145 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.utils import timezone
+
+from .dispatch import dispatch_services
+from .metrics import REGISTRY, Counter
+from .models import DispatchJob
+
+jobs_finished = REGISTRY.register(Counter(
+    'api_dispatch_jobs', 'Queued service requests processed, by outcome.', ('status',)
+))
+
+
+def job_settings():
+    return getattr(settings, 'DISPATCH_JOBS', {})
+
+
+def enqueue_dispatch(latitude, longitude):
+    """Queue a service request for the dispatch workers; returns its ``DispatchJob``."""
+    job = DispatchJob.objects.create(pickup_latitude=latitude, pickup_longitude=longitude)
+    job_pool.notify()
+    return job
+
+
+def drain_jobs(batch_size=None):
+    """
+    Dispatch the oldest queued jobs as one batch; returns how many were handled.
+
+    Jobs are claimed with ``SKIP LOCKED``, so any number of workers (threads
+    or processes) can drain the queue side by side. The batch goes through
+    ``dispatch_services`` and the jobs are marked done in the same
+    transaction as the services they created. A batch that fails is marked
+    ``FAILED`` with the error instead of being retried forever.
+    """
+    if batch_size is None:
+        batch_size = job_settings().get('BATCH_SIZE', 50)
+    with transaction.atomic():
+        jobs = list(
+            DispatchJob.objects.select_for_update(skip_locked=True)
+            .filter(status=DispatchJob.StatusChoices.QUEUED)
+            .order_by('created_at')[:batch_size]
+        )
+        if not jobs:
+            return 0
+        try:
+            with transaction.atomic():
+                services = dispatch_services([(job.pickup_latitude, job.pickup_longitude) for job in jobs])
+        except Exception as exc:
+            for job in jobs:
+                job.status = DispatchJob.StatusChoices.FAILED
+                job.error = f'{type(exc).__name__}: {exc}'
+        else:
+            for job, service in zip(jobs, services):
+                job.status = DispatchJob.StatusChoices.DONE
+                job.service = service
+        now = timezone.now()
+        for job in jobs:
+            job.finished_at = now
+        DispatchJob.objects.bulk_update(jobs, ['status', 'service', 'error', 'finished_at'])
+    jobs_finished.inc(jobs[0].status, amount=len(jobs))
+    return len(jobs)
+
+
+def purge_jobs():
+    """Delete jobs finished more than ``DISPATCH_JOBS['RETENTION']`` seconds ago."""
+    cutoff = timezone.now() - timedelta(seconds=job_settings().get('RETENTION', 86400))
+    return DispatchJob.objects.filter(finished_at__lt=cutoff).delete()[0]
+
+
+class DispatchJobPool:
+    """
+    Threads draining the job queue in micro-batches.
+
+    Started lazily by the first ``enqueue_dispatch`` of a process with
+    ``DISPATCH_JOBS['THREADS']`` threads, or by ``manage.py
+    run_dispatch_jobs``. A thread wakes on each enqueue of its own process,
+    or every ``POLL_INTERVAL`` seconds for jobs queued elsewhere. It then
+    waits ``BATCH_WAIT`` seconds so a burst lands in one batch, and drains
+    until the queue is empty.
+    """
+
+    def __init__(self):
+        self._threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._threads)
+
+    def start(self, threads=None):
+        if threads is None:
+            threads = job_settings().get('THREADS', 2)
+        with self._lock:
+            self._stop.clear()
+            while len(self._threads) < threads:
+                thread = threading.Thread(
+                    target=self._run, name=f'dispatch-jobs-{len(self._threads)}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        return self._threads
+
+    def notify(self):
+        if len(self._threads) < job_settings().get('THREADS', 2):
+            self.start()
+        self._wake.set()
+
+    def stop(self):
+        with self._lock:
+            self._stop.set()
+            self._wake.set()
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join()
+
+    def _run(self):
+        options = job_settings()
+        purged_at = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                self._wake.wait(options.get('POLL_INTERVAL', 1.0))
+                self._wake.clear()
+                if self._stop.is_set():
+                    break
+                time.sleep(options.get('BATCH_WAIT', 0.01))
+                try:
+                    while drain_jobs():
+                        pass
+                    if time.monotonic() - purged_at > options.get('PURGE_INTERVAL', 300):
+                        purge_jobs()
+                        purged_at = time.monotonic()
+                except Exception:
+                    # Lost database connection and the like: retry on the next round.
+                    close_old_connections()
+                    time.sleep(options.get('POLL_INTERVAL', 1.0))
+        finally:
+            connections.close_all()
+
+
+job_pool = DispatchJobPool()
@@ -0,0 +1,338 @@
+import http.client
+import json
+import logging
+import platform
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+)
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.dispatch import reload_driver_index
+from api.models import Driver, Service
+
+# Synthetic workload: operation -> (weight, method, path, body factory).
+# "{service}" and "{driver}" are resolved at replay time from the services
+# dispatched and the drivers seeded/created during the same run.
+OPERATIONS = {
+    'dispatch': (50, 'POST', '/api/services/request/', lambda rng, lat, lon: {
+        'latitude': lat + rng.gauss(0, 0.05), 'longitude': lon + rng.gauss(0, 0.05)
+    }),
+    'complete': (30, 'PATCH', '/api/services/{service}/complete/', lambda rng, lat, lon: {'status': 'COMPLETED'}),
+    'driver_get': (8, 'GET', '/api/drivers/{driver}/', None),
+    'driver_update': (6, 'PATCH', '/api/drivers/{driver}/', lambda rng, lat, lon: {
+        'current_latitude': lat + rng.gauss(0, 0.05), 'current_longitude': lon + rng.gauss(0, 0.05)
+    }),
+    'driver_list': (3, 'GET', '/api/drivers/?page_size=100', None),
+    'driver_create': (2, 'POST', '/api/drivers/', lambda rng, lat, lon: {
+        'name': f'Bench {rng.randrange(10 ** 6)}', 'is_available': True,
+        'current_latitude': lat + rng.gauss(0, 0.05), 'current_longitude': lon + rng.gauss(0, 0.05)
+    }),
+    'driver_delete': (1, 'DELETE', '/api/drivers/{driver}/', None),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Record, replay and compare JSONL request traces (dispatch, complete, driver CRUD). '
+        'Replays run in-process against a throwaway test database, or over HTTP with --url.'
+    )
+
+    def add_arguments(self, parser):
+        actions = parser.add_subparsers(dest='action', required=True)
+
+        record = actions.add_parser('record', help='Write a synthetic trace.')
+        record.add_argument('trace')
+        record.add_argument('--requests', type=int, default=2000)
+        record.add_argument('--mix', default='', help='name=weight,... overriding the default operation weights.')
+        record.add_argument('--center', default='4.65,-74.08')
+        record.add_argument('--seed', type=int, default=0)
+
+        replay = actions.add_parser('replay', help='Replay a trace and report per-endpoint statistics.')
+        replay.add_argument('trace')
+        replay.add_argument('--fleet', default='1000', help='Comma separated fleet sizes (in-process only).')
+        replay.add_argument('--url', help='Replay over HTTP against this base url instead of in-process.')
+        replay.add_argument('--token', help='API token for --url.')
+        replay.add_argument('--concurrency', type=int, default=1, help='HTTP connections (with --url).')
+        replay.add_argument('--center', default='4.65,-74.08')
+        replay.add_argument('--seed', type=int, default=0)
+        replay.add_argument('--json', help='Write machine-readable results to this file.')
+
+        compare = actions.add_parser('compare', help='Compare two --json results; fails on regressions.')
+        compare.add_argument('baseline')
+        compare.add_argument('candidate')
+        compare.add_argument('--threshold', type=float, default=1.2, help='Allowed p95 latency ratio.')
+        compare.add_argument('--min-count', type=int, default=30, help='Ignore latency of rarer endpoints.')
+
+    def handle(self, *args, **options):
+        getattr(self, '_' + options['action'])(options)
+
+    def _record(self, options):
+        weights = {name: operation[0] for name, operation in OPERATIONS.items()}
+        for item in filter(None, options['mix'].split(',')):
+            name, _, weight = item.partition('=')
+            if name not in OPERATIONS:
+                raise CommandError(f"Unknown operation '{name}'; choose from {', '.join(OPERATIONS)}.")
+            weights[name] = float(weight)
+        rng = random.Random(options['seed'])
+        lat, lon = _parse_center(options['center'])
+        names = list(weights)
+        with open(options['trace'], 'w') as trace:
+            for name in rng.choices(names, [weights[name] for name in names], k=options['requests']):
+                _, method, path, body = OPERATIONS[name]
+                entry = {'name': name, 'method': method, 'path': path}
+                if body is not None:
+                    entry['body'] = body(rng, lat, lon)
+                trace.write(json.dumps(entry) + '\n')
+        self.stdout.write(f"Wrote {options['requests']} requests to {options['trace']}")
+
+    def _replay(self, options):
+        with open(options['trace']) as trace:
+            entries = [json.loads(line) for line in trace if line.strip()]
+        if options['url']:
+            if not options['token']:
+                raise CommandError('--token is required with --url.')
+            runs = [self._replay_http(entries, options)]
+        else:
+            setup_test_environment()
+            # Expected 4xx responses (no driver, completed service) are not news.
+            logging.getLogger('django.request').setLevel(logging.ERROR)
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                runs = [
+                    self._replay_in_process(entries, int(fleet), options)
+                    for fleet in options['fleet'].split(',')
+                ]
+            finally:
+                teardown_databases(old_config, verbosity=0)
+                teardown_test_environment()
+        for run in runs:
+            self._print_run(run)
+        if options['json']:
+            with open(options['json'], 'w') as output:
+                json.dump({'trace': options['trace'], 'environment': _environment(options), 'runs': runs}, output, indent=2)
+
+    def _replay_in_process(self, entries, fleet, options):
+        Service.objects.all().delete()
+        Driver.objects.all().delete()
+        rng = random.Random(options['seed'])
+        lat, lon = _parse_center(options['center'])
+        Driver.objects.bulk_create(
+            Driver(
+                name=f'Fleet {i}',
+                current_latitude=lat + rng.gauss(0, 0.05), current_longitude=lon + rng.gauss(0, 0.05)
+            )
+            for i in range(fleet)
+        )
+        reload_driver_index()
+        user, _ = User.objects.get_or_create(username='bench')
+        token, _ = Token.objects.get_or_create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        def send(method, path, body):
+            connection.queries_log.clear()  # bounded deque: keep the count exact
+            with CaptureQueriesContext(connection) as queries:
+                response = client.generic(
+                    method, path, json.dumps(body) if body is not None else '', content_type='application/json'
+                )
+            return response.status_code, response.content, len(queries)
+
+        state = _ReplayState(Driver.objects.values_list('pk', flat=True), options['seed'])
+        return _replay(entries, send, state, 1, fleet=fleet, target='in-process')
+
+    def _replay_http(self, entries, options):
+        parts = urlsplit(options['url'])
+        if parts.scheme != 'http' or not parts.hostname:
+            raise CommandError(f"Only http:// urls are supported: {options['url']}")
+        local = threading.local()
+        headers = {
+            'Authorization': f"Token {options['token']}",
+            'Content-Type': 'application/json', 'Accept': 'application/json',
+        }
+
+        def send(method, path, body):
+            if getattr(local, 'connection', None) is None:
+                local.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+            try:
+                local.connection.request(
+                    method, parts.path.rstrip('/') + path, json.dumps(body) if body is not None else None, headers
+                )
+                response = local.connection.getresponse()
+                content = response.read()
+            except (OSError, http.client.HTTPException):
+                local.connection.close()
+                local.connection = None
+                return 'error', b'', None
+            if response.will_close:
+                local.connection.close()
+                local.connection = None
+            return response.status, content, None
+
+        state = _ReplayState([], options['seed'])
+        return _replay(entries, send, state, options['concurrency'], fleet=None, target=options['url'])
+
+    def _print_run(self, run):
+        fleet = f", fleet {run['fleet']}" if run['fleet'] is not None else ''
+        self.stdout.write(
+            f"\n{run['target']}{fleet}: {run['requests']} requests in {run['seconds']:.2f}s "
+            f"({run['throughput']:.1f} req/s), {run['skipped']} skipped"
+        )
+        self.stdout.write(
+            f"{'endpoint':<15} {'count':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}  statuses"
+        )
+        for name, stats in sorted(run['endpoints'].items()):
+            queries = f"{stats['queries']:.1f}" if stats['queries'] is not None else '-'
+            self.stdout.write(
+                f"{name:<15} {stats['count']:>6} {stats['throughput']:>9.1f} {stats['p50_ms']:>8.2f} "
+                f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} {queries:>8}  "
+                + ' '.join(f"{code}:{count}" for code, count in sorted(stats['statuses'].items()))
+            )
+
+    def _compare(self, options):
+        with open(options['baseline']) as baseline, open(options['candidate']) as candidate:
+            baseline, candidate = json.load(baseline), json.load(candidate)
+        regressions = []
+        self.stdout.write(f"{'run':<22} {'endpoint':<15} {'p95 base':>9} {'p95 new':>9} {'ratio':>6} {'queries':>10}")
+        for old_run, new_run in zip(baseline['runs'], candidate['runs']):
+            label = f"fleet {old_run['fleet']}" if old_run['fleet'] is not None else old_run['target']
+            for name, old in sorted(old_run['endpoints'].items()):
+                new = new_run['endpoints'].get(name)
+                if new is None or not old['p95_ms']:
+                    continue
+                ratio = new['p95_ms'] / old['p95_ms']
+                queries = f"{old['queries'] or 0:.1f}->{new['queries'] or 0:.1f}"
+                flag = ''
+                noisy = min(old['count'], new['count']) < options['min_count']
+                if (ratio > options['threshold'] and not noisy) or (new['queries'] or 0) > (old['queries'] or 0):
+                    regressions.append(f"{label} {name}")
+                    flag = '  REGRESSION'
+                self.stdout.write(
+                    f"{label:<22} {name:<15} {old['p95_ms']:>9.2f} {new['p95_ms']:>9.2f} {ratio:>6.2f} {queries:>10}{flag}"
+                )
+        if regressions:
+            raise CommandError(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+
+
+class _ReplayState:
+    """Ids the trace placeholders resolve to, shared by the replay threads."""
+
+    def __init__(self, drivers, seed):
+        self.services = deque()
+        self.drivers = list(drivers)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def resolve(self, entry):
+        path = entry['path']
+        with self.lock:
+            if '{service}' in path:
+                if not self.services:
+                    return None
+                path = path.replace('{service}', str(self.services.popleft()))
+            if '{driver}' in path:
+                if not self.drivers:
+                    return None
+                index = self.rng.randrange(len(self.drivers))
+                driver = self.drivers.pop(index) if entry['method'] == 'DELETE' else self.drivers[index]
+                path = path.replace('{driver}', str(driver))
+        return path
+
+    def learn(self, entry, status, content):
+        if status != 201 or entry['method'] != 'POST':
+            return
+        created = json.loads(content)
+        with self.lock:
+            if '/services/' in entry['path']:
+                self.services.append(created['id'])
+            elif '/drivers/' in entry['path']:
+                self.drivers.append(created['id'])
+
+
+def _replay(entries, send, state, concurrency, **metadata):
+    samples = defaultdict(list)
+    pending = deque(entries)
+    skipped = [0]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                entry = pending.popleft()
+            path = state.resolve(entry)
+            if path is None:
+                with lock:
+                    skipped[0] += 1
+                continue
+            start = time.perf_counter()
+            status, content, queries = send(entry['method'], path, entry.get('body'))
+            elapsed = time.perf_counter() - start
+            state.learn(entry, status, content)
+            with lock:
+                samples[entry.get('name') or f"{entry['method']} {entry['path']}"].append((elapsed, status, queries))
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(worker) for _ in range(concurrency)]:
+                future.result()
+    else:
+        worker()
+    seconds = time.perf_counter() - start
+    requests = sum(len(values) for values in samples.values())
+    return dict(
+        metadata, requests=requests, skipped=skipped[0], seconds=seconds,
+        throughput=requests / seconds if seconds else 0.0,
+        endpoints={name: _summarize(values) for name, values in samples.items()}
+    )
+
+
+def _summarize(values):
+    latencies = sorted(elapsed for elapsed, _, _ in values)
+    queries = [count for _, _, count in values if count is not None]
+    busy = sum(latencies)
+    return {
+        'count': len(values),
+        'throughput': len(values) / busy if busy else 0.0,
+        'p50_ms': _percentile(latencies, 50) * 1e3,
+        'p95_ms': _percentile(latencies, 95) * 1e3,
+        'p99_ms': _percentile(latencies, 99) * 1e3,
+        'queries': sum(queries) / len(queries) if queries else None,
+        'statuses': dict(Counter(str(status) for _, status, _ in values)),
+    }
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(percent / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def _parse_center(value):
+    lat, lon = (float(part) for part in value.split(','))
+    return lat, lon
+
+
+def _environment(options):
+    return {
+        'timestamp': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'database': connection.vendor if not options['url'] else None,
+        'dispatch_mode': getattr(settings, 'DISPATCH', {}).get('MODE'),
+        'concurrency': options['concurrency'],
+    }
@@ -0,0 +1,68 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+from api.dispatch import dispatch_service, reload_driver_index
+from api.models import Driver, Service
+
+
+class Command(BaseCommand):
+    help = 'Throughput benchmark of concurrent driver claiming, run against a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--threads', default='1,4,16', help='Comma separated thread counts.')
+        parser.add_argument('--modes', default='index,database', help='Comma separated DISPATCH modes.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            self.stdout.write(f"{'mode':>10} {'threads':>8} {'req/s':>10} {'assigned':>9} {'double':>7}")
+            for mode in options['modes'].split(','):
+                for threads in (int(t) for t in options['threads'].split(',')):
+                    with override_settings(DISPATCH={'MODE': mode}):
+                        self._run(mode, threads, options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def _run(self, mode, threads, options):
+        rng = random.Random(options['seed'])
+        Service.objects.all().delete()
+        Driver.objects.all().delete()
+        Driver.objects.bulk_create(
+            Driver(
+                name=f"Bench {i}",
+                current_latitude=4.65 + rng.gauss(0, 0.05),
+                current_longitude=-74.08 + rng.gauss(0, 0.05)
+            )
+            for i in range(options['drivers'])
+        )
+        reload_driver_index()
+        pickups = [
+            (4.65 + rng.gauss(0, 0.05), -74.08 + rng.gauss(0, 0.05))
+            for _ in range(options['requests'])
+        ]
+
+        def worker(chunk):
+            try:
+                return sum(dispatch_service(*pickup).assigned_driver_id is not None for pickup in chunk)
+            finally:
+                connection.close()
+
+        chunks = [pickups[i::threads] for i in range(threads)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            assigned = sum(pool.map(worker, chunks))
+        elapsed = time.perf_counter() - start
+
+        drivers = list(Service.objects.filter(assigned_driver__isnull=False).values_list('assigned_driver', flat=True))
+        double = len(drivers) - len(set(drivers))
+        self.stdout.write(
+            f"{mode:>10} {threads:>8} {len(pickups) / elapsed:>10.1f} {assigned:>9} {double:>7}"
+        )
@@ -0,0 +1,50 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.geo import PointArray
+from api.models import calculate_haversine_distance
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark of the scalar vs. vectorized haversine distance'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1000,100000,1000000',
+            help='Comma separated point counts to benchmark.'
+        )
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per size; the best one is kept.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        origin = (rng.uniform(-90, 90), rng.uniform(-180, 180))
+
+        self.stdout.write(f"{'points':>10} {'scalar ms':>12} {'batch ms':>10} {'argmin ms':>10} {'speedup':>8}")
+        for size in (int(s) for s in options['sizes'].split(',')):
+            latitudes = [rng.uniform(-90, 90) for _ in range(size)]
+            longitudes = [rng.uniform(-180, 180) for _ in range(size)]
+            points = PointArray(latitudes, longitudes)
+
+            scalar = self._best(options['repeat'], lambda: min(
+                calculate_haversine_distance(lat, lon, *origin)
+                for lat, lon in zip(latitudes, longitudes)
+            ))
+            batch = self._best(options['repeat'], lambda: points.distances(*origin))
+            nearest = self._best(options['repeat'], lambda: points.nearest(*origin))
+
+            self.stdout.write(
+                f"{size:>10} {scalar * 1e3:>12.3f} {batch * 1e3:>10.3f} "
+                f"{nearest * 1e3:>10.3f} {scalar / nearest:>7.1f}x"
+            )
+
+    @staticmethod
+    def _best(repeat, func):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        return best
@@ -0,0 +1,78 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api.fast_serializers import service_serializer
+from api.models import Driver, Service
+from api.renderers import FastJSONRenderer
+from api.serializers import ServiceSerializer
+
+
+class Command(BaseCommand):
+    help = 'Benchmark DRF vs. precompiled serialization of services (no database needed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per variant; the best one is kept.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        services = []
+        for pk in range(1, options['objects'] + 1):
+            driver = Driver(
+                pk=pk, name=f"Driver {pk}", is_available=False,
+                current_latitude=rng.uniform(-90, 90), current_longitude=rng.uniform(-180, 180)
+            )
+            services.append(Service(
+                pk=pk, assigned_driver=driver, status=Service.StatusChoices.ASSIGNED,
+                customer_pickup_latitude=rng.uniform(-90, 90),
+                customer_pickup_longitude=rng.uniform(-180, 180),
+                request_time=now, estimated_arrival_time=now + timedelta(minutes=rng.uniform(1, 60))
+            ))
+        rows = [self._values_row(service) for service in services]
+
+        drf_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+        variants = [
+            ('drf serializer + JSONRenderer',
+             lambda: drf_renderer.render(ServiceSerializer(services, many=True).data)),
+            ('compiled instances + FastJSONRenderer',
+             lambda: fast_renderer.render(service_serializer.many(services))),
+            ('compiled .values() rows + FastJSONRenderer',
+             lambda: fast_renderer.render(service_serializer.from_values(rows))),
+        ]
+
+        expected = variants[0][1]()
+        baseline = None
+        self.stdout.write(f"{len(services)} services")
+        for name, func in variants:
+            if func() != expected:
+                self.stderr.write(self.style.ERROR(f"{name}: output differs from DRF"))
+            elapsed = self._best(options['repeat'], func)
+            baseline = baseline or elapsed
+            self.stdout.write(f"{name:<45} {elapsed * 1e3:>9.1f} ms {baseline / elapsed:>6.1f}x")
+
+    @staticmethod
+    def _values_row(service):
+        driver = service.assigned_driver
+        row = {'pk': service.pk, 'assigned_driver': driver.pk}
+        for field in Service._meta.concrete_fields:
+            if field.name != 'assigned_driver':
+                row[field.attname] = getattr(service, field.attname)
+        for field in Driver._meta.concrete_fields:
+            row[f'assigned_driver__{field.attname}'] = getattr(driver, field.attname)
+        return row
+
+    @staticmethod
+    def _best(repeat, func):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        return best
@@ -0,0 +1,123 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import setup_databases, teardown_databases
+
+from api.dispatch import ShardWorker
+from api.models import Driver, Service
+from api.shards import ShardMap, ShardRouter, serve
+
+AUTHKEY = b'bench'
+
+# Pickups and drivers are scattered around these (lat, lon) city centres.
+CITIES = [
+    (4.65, -74.08), (6.24, -75.58), (3.44, -76.52), (10.96, -74.80),
+    (7.12, -73.12), (10.39, -75.51), (4.81, -75.69), (7.89, -72.50),
+    (5.07, -75.52), (2.44, -76.61), (11.24, -74.20), (4.14, -73.63),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Throughput of region-sharded dispatch with 1..N local worker processes, '
+        'run against a throwaway test database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=20000)
+        parser.add_argument('--requests', type=int, default=4000)
+        parser.add_argument('--workers', default='1,2,4', help='Comma separated worker process counts.')
+        parser.add_argument(
+            '--threads', type=int, default=16,
+            help='Concurrent requests; each worker opens a database connection per thread.'
+        )
+        parser.add_argument('--precision', type=int, default=4, help='Geohash characters per shard.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError('Needs the fork start method.')
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            rng = random.Random(options['seed'])
+            Driver.objects.bulk_create(
+                Driver(name=f"Bench {i}", current_latitude=latitude, current_longitude=longitude)
+                for i, (latitude, longitude) in enumerate(_scatter(rng, options['drivers']))
+            )
+            pickups = _scatter(rng, options['requests'])
+            self.stdout.write(f"{'workers':>8} {'req/s':>10} {'assigned':>9} {'double':>7}  requests per worker")
+            for workers in (int(w) for w in options['workers'].split(',')):
+                self._run(workers, pickups, options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def _run(self, workers, pickups, options):
+        Service.objects.all().delete()
+        Driver.objects.update(is_available=True)
+        shard_map = ShardMap(options['precision'], workers)
+        with tempfile.TemporaryDirectory() as directory:
+            addresses = [os.path.join(directory, f'worker-{n}.sock') for n in range(workers)]
+            # Forked children must not share the parent's database connections.
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            processes = []
+            for n, address in enumerate(addresses):
+                ready = context.Event()
+                process = context.Process(target=_worker, args=(shard_map, n, address, ready), daemon=True)
+                process.start()
+                processes.append((process, ready))
+            try:
+                for process, ready in processes:
+                    if not ready.wait(60):
+                        raise CommandError('A worker failed to start.')
+                router = ShardRouter(addresses, options['precision'], AUTHKEY)
+                counts = Counter(router.worker_for(*pickup) for pickup in pickups)
+
+                def client(chunk):
+                    return sum(
+                        router.dispatch(*pickup, fallback=_unreachable).assigned_driver_id is not None
+                        for pickup in chunk
+                    )
+
+                threads = options['threads']
+                chunks = [pickups[i::threads] for i in range(threads)]
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=threads) as pool:
+                    assigned = sum(pool.map(client, chunks))
+                elapsed = time.perf_counter() - start
+            finally:
+                for process, _ in processes:
+                    process.terminate()
+                    process.join()
+
+        drivers = list(Service.objects.filter(assigned_driver__isnull=False).values_list('assigned_driver', flat=True))
+        double = len(drivers) - len(set(drivers))
+        self.stdout.write(
+            f"{workers:>8} {len(pickups) / elapsed:>10.1f} {assigned:>9} {double:>7}  "
+            + ' '.join(str(counts[n]) for n in range(workers))
+        )
+
+
+def _scatter(rng, count):
+    points = []
+    for _ in range(count):
+        latitude, longitude = rng.choice(CITIES)
+        points.append((latitude + rng.gauss(0, 0.05), longitude + rng.gauss(0, 0.05)))
+    return points
+
+
+def _worker(shard_map, n, address, ready):
+    worker = ShardWorker(shard_map, n, reload_interval=3600)
+    worker.reload()
+    serve(worker, address, AUTHKEY, ready=lambda address: ready.set())
+
+
+def _unreachable(latitude, longitude):
+    raise CommandError('A worker went away.')
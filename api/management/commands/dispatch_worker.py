@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.dispatch import shard_worker
+from api.shards import parse_address, serve, shard_authkey, shard_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves region-sharded dispatch for the regions owned by DISPATCH_SHARDS['WORKERS'][worker]; "
+        'run one per configured worker.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('worker', type=int, help="Position in DISPATCH_SHARDS['WORKERS'].")
+        parser.add_argument('--bind', default=None, help='Listen address (default: the configured one).')
+
+    def handle(self, *args, **options):
+        workers = shard_settings().get('WORKERS') or []
+        if not 0 <= options['worker'] < len(workers):
+            raise CommandError(f"DISPATCH_SHARDS['WORKERS'] has {len(workers)} entries.")
+        address = parse_address(options['bind'] or workers[options['worker']])
+        worker = shard_worker(options['worker'])
+        worker.reload()
+        self.stdout.write(self.style.SUCCESS(
+            f"Worker {options['worker']}/{len(workers)} serving {len(worker.index)} drivers on {address}."
+        ))
+        serve(worker, address, shard_authkey())
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.schema import generate_schema, schema_settings, write_schema
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates the OpenAPI documents (JSON and YAML) into OPENAPI_SCHEMA['DIRECTORY'], "
+        'where the API processes load them instead of introspecting the views. Run on deploy.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help="Directory (default: OPENAPI_SCHEMA['DIRECTORY']).")
+
+    def handle(self, *args, **options):
+        output = options['output'] or schema_settings().get('DIRECTORY')
+        if not output:
+            raise CommandError("Pass --output or set OPENAPI_SCHEMA['DIRECTORY'].")
+        start = time.perf_counter()
+        documents = generate_schema()
+        write_schema(documents, output)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote the OpenAPI schema ({len(documents[".json"])} bytes of JSON) to {output} '
+            f'in {time.perf_counter() - start:.1f}s.'
+        ))
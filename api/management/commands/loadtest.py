@@ -0,0 +1,115 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Closed-loop HTTP load test of the service request endpoint, e.g. comparing a WSGI and an ASGI '
+        'deployment: loadtest --token <token> wsgi=http://localhost:8000/api/services/request/ '
+        'asgi=http://localhost:8001/api/async/services/request/'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', help='label=url pairs (or bare urls).')
+        parser.add_argument('--token', required=True)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=100, help='Connections kept busy in parallel.')
+        parser.add_argument('--center', default='4.65,-74.08', help='Pickups are scattered around lat,lon.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        center = tuple(float(value) for value in options['center'].split(','))
+        self.stdout.write(f"{'target':>10} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}  statuses")
+        for target in options['targets']:
+            label, _, url = target.rpartition('=')
+            parts = urlsplit(url)
+            if parts.scheme != 'http' or not parts.hostname:
+                raise CommandError(f"Only http:// urls are supported: {url}")
+            rng = random.Random(options['seed'])
+            bodies = [
+                json.dumps({
+                    'latitude': center[0] + rng.gauss(0, 0.05), 'longitude': center[1] + rng.gauss(0, 0.05)
+                }).encode()
+                for _ in range(options['requests'])
+            ]
+            elapsed, latencies, statuses = asyncio.run(
+                self._run(parts, options['token'], bodies, options['concurrency'])
+            )
+            latencies.sort()
+            self.stdout.write(
+                f"{label or parts.netloc:>10} {len(bodies) / elapsed:>9.1f} "
+                f"{_percentile(latencies, 50) * 1e3:>8.1f} {_percentile(latencies, 99) * 1e3:>8.1f}  "
+                + ' '.join(f"{code}:{count}" for code, count in sorted(statuses.items()))
+            )
+
+    async def _run(self, parts, token, bodies, concurrency):
+        queue = list(reversed(bodies))
+        latencies, statuses = [], Counter()
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        head = (
+            f"POST {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nAuthorization: Token {token}\r\n"
+            "Content-Type: application/json\r\nAccept: application/json\r\n"
+        ).encode()
+
+        async def worker():
+            connection = None
+            while queue:
+                body = queue.pop()
+                start = time.perf_counter()
+                try:
+                    if connection is None:
+                        connection = await asyncio.open_connection(parts.hostname, parts.port or 80)
+                    code, keep_alive = await _post(*connection, head, body)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    code, keep_alive = 'error', False
+                latencies.append(time.perf_counter() - start)
+                statuses[code] += 1
+                if not keep_alive and connection is not None:
+                    connection[1].close()
+                    connection = None
+            if connection is not None:
+                connection[1].close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(bodies)))))
+        return time.perf_counter() - start, latencies, statuses
+
+
+async def _post(reader, writer, head, body):
+    """Send one request on a keep-alive connection; returns ``(status, keep_alive)``."""
+    writer.write(head + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    status_line = await reader.readuntil(b'\r\n')
+    code = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readuntil(b'\r\n')
+        if line == b'\r\n':
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    else:
+        await reader.read()
+        return code, False
+    return code, headers.get('connection') != 'close' and not status_line.startswith(b'HTTP/1.0')
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(percent / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
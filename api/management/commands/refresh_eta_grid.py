@@ -0,0 +1,111 @@
+import math
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, DurationField, F, FloatField, Max, Min, Sum, Value
+from django.db.models.functions import ExtractHour, Floor
+from django.utils import timezone
+
+from api.eta import HOURS, SpeedGrid, eta_settings
+from api.models import Service
+
+MAX_GRID_BYTES = 512 * 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the ETA speed grid (km/h per pickup cell and hour of day) from completed services: '
+        'pickup distance over request_time -> completion_time. Services record no arrival time, so the '
+        'duration also spans the wait for a driver and the trip itself; cells and hours whose speed falls '
+        'below --min-speed are treated as having no data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help="Grid file (default: ETA['GRID_PATH']).")
+        parser.add_argument('--cell-deg', type=float, default=0.05, help='Cell size in degrees (~5.5 km).')
+        parser.add_argument('--days', type=int, default=90, help='Only services requested in the last N days.')
+        parser.add_argument(
+            '--min-samples', type=int, default=5,
+            help='Cells (per hour) with fewer services use the city-wide speed of that hour.'
+        )
+        parser.add_argument(
+            '--min-speed', type=float, default=10.0,
+            help='Slower cells (per hour) use the city-wide speed of that hour, slower hours the default speed.'
+        )
+        parser.add_argument('--max-speed', type=float, default=120.0)
+
+    def handle(self, *args, **options):
+        output = options['output'] or eta_settings().get('GRID_PATH')
+        if not output:
+            raise CommandError("Pass --output or set ETA['GRID_PATH'].")
+        cell = options['cell_deg']
+        if cell <= 0:
+            raise CommandError('--cell-deg must be positive.')
+
+        start = time.perf_counter()
+        services = Service.objects.filter(
+            status=Service.StatusChoices.COMPLETED,
+            pickup_distance_km__isnull=False,
+            completion_time__gt=F('request_time'),
+            request_time__gte=timezone.now() - timedelta(days=options['days'])
+        )
+        bounds = services.aggregate(
+            min_lat=Min('customer_pickup_latitude'), max_lat=Max('customer_pickup_latitude'),
+            min_lon=Min('customer_pickup_longitude'), max_lon=Max('customer_pickup_longitude')
+        )
+        if bounds['min_lat'] is None:
+            raise CommandError('No completed services with a recorded pickup distance.')
+        lat0 = math.floor(bounds['min_lat'] / cell) * cell
+        lon0 = math.floor(bounds['min_lon'] / cell) * cell
+        rows = math.floor((bounds['max_lat'] - lat0) / cell) + 1
+        cols = math.floor((bounds['max_lon'] - lon0) / cell) + 1
+        if rows * cols * HOURS * 4 > MAX_GRID_BYTES:
+            raise CommandError(f'A {rows}x{cols} grid is too large; use a larger --cell-deg.')
+
+        # One GROUP BY in the database: distance, duration and count per
+        # (row, col, hour). Speeds are ratios of sums, so long trips weigh more.
+        # Biased low: nothing records when the driver reached the pickup, so
+        # the duration is request -> completion. On top of the drive to the
+        # pickup it holds the time queued as PENDING and the whole trip,
+        # which the distance does not cover. Speeds below --min-speed are
+        # mostly that and are replaced below rather than clipped up.
+        groups = services.annotate(
+            row=Floor((F('customer_pickup_latitude') - Value(lat0)) / Value(cell), output_field=FloatField()),
+            col=Floor((F('customer_pickup_longitude') - Value(lon0)) / Value(cell), output_field=FloatField()),
+            hour=ExtractHour('request_time', tzinfo=timezone.get_default_timezone())
+        ).values('row', 'col', 'hour').annotate(
+            distance=Sum('pickup_distance_km'),
+            duration=Sum(F('completion_time') - F('request_time'), output_field=DurationField()),
+            samples=Count('pk')
+        ).order_by()
+
+        distance = np.zeros((rows, cols, HOURS))
+        hours = np.zeros((rows, cols, HOURS))
+        samples = np.zeros((rows, cols, HOURS), dtype=np.int64)
+        for group in groups.iterator(chunk_size=10000):
+            # Clamp float rounding at the upper edges.
+            index = (min(int(group['row']), rows - 1), min(int(group['col']), cols - 1), group['hour'])
+            distance[index] += group['distance']
+            hours[index] += group['duration'].total_seconds() / 3600
+            samples[index] += group['samples']
+
+        default = eta_settings().get('DEFAULT_SPEED_KPH', 40.0)
+
+        def observed(distance, hours, samples, fallback):
+            speed = distance / np.maximum(hours, 1e-9)
+            known = (samples >= options['min_samples']) & (speed >= options['min_speed'])
+            return np.where(known, np.minimum(speed, options['max_speed']), fallback), known
+
+        hourly, _ = observed(distance.sum(axis=(0, 1)), hours.sum(axis=(0, 1)), samples.sum(axis=(0, 1)), default)
+        speeds, known = observed(distance, hours, samples, hourly)
+
+        SpeedGrid(
+            lat0, lon0, cell, speeds.astype(np.float32), hourly,
+            built_at=timezone.now().isoformat(), services=int(samples.sum())
+        ).save(output)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote a {rows}x{cols}x{HOURS} grid to {output} from {int(samples.sum())} services '
+            f'({int(known.sum())} cell-hours with data) in {time.perf_counter() - start:.1f}s.'
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.jobs import job_pool, job_settings
+
+
+class Command(BaseCommand):
+    help = 'Runs a pool of dispatch workers draining queued service requests (DISPATCH_JOBS) until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=None, help="Default: DISPATCH_JOBS['THREADS'].")
+
+    def handle(self, *args, **options):
+        threads = options['threads'] or job_settings().get('THREADS', 2)
+        started = job_pool.start(threads)
+        self.stdout.write(self.style.SUCCESS(f'Draining dispatch jobs with {len(started)} threads.'))
+        try:
+            for thread in started:
+                thread.join()
+        except KeyboardInterrupt:
+            job_pool.stop()
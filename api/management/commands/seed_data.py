@@ -1,46 +1,278 @@
-import random
-from django.core.management.base import BaseCommand
+import io
+import math
+import multiprocessing
+import time
+from datetime import timezone as dt_timezone
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.utils import timezone
 from faker import Faker
-from api.models import Address, Driver
+
+from api.models import Address, DispatchJob, Driver, Service
+
+# (city, state, latitude, longitude, weight, spread in km): points are drawn
+# around these centers instead of uniformly over the globe.
+CITIES = [
+    ('Bogotá', 'DC', 4.6510, -74.0817, 0.35, 8.0),
+    ('Medellín', 'ANT', 6.2442, -75.5812, 0.18, 6.0),
+    ('Cali', 'VAC', 3.4516, -76.5320, 0.14, 6.0),
+    ('Barranquilla', 'ATL', 10.9685, -74.7813, 0.09, 5.0),
+    ('Cartagena', 'BOL', 10.3910, -75.4794, 0.07, 4.0),
+    ('Bucaramanga', 'SAN', 7.1193, -73.1227, 0.06, 4.0),
+    ('Pereira', 'RIS', 4.8133, -75.6961, 0.04, 3.0),
+    ('Santa Marta', 'MAG', 11.2408, -74.1990, 0.04, 3.0),
+    ('Manizales', 'CAL', 5.0703, -75.5138, 0.03, 3.0),
+]
+KM_PER_DEGREE = 111.195
+# Travel speed (km/h) by hour of day (UTC), slower at the (UTC-5) rush hours.
+HOURLY_SPEED_KPH = np.array([
+    18, 26, 32, 34, 36, 36, 36, 36, 36, 34, 32, 26, 18, 15, 18, 24, 26, 26, 26, 26, 24, 22, 16, 15
+], dtype=float)
+
+# Columns written per model, in generation order.
+COLUMNS = {
+    Address: ('street_address', 'city', 'state', 'postal_code', 'latitude', 'longitude'),
+    Driver: ('name', 'current_latitude', 'current_longitude', 'is_available', 'location_updated_at'),
+    Service: (
+        'customer_pickup_latitude', 'customer_pickup_longitude', 'assigned_driver_id', 'status',
+        'request_time', 'estimated_arrival_time', 'completion_time', 'pickup_distance_km'
+    ),
+}
+
+# Name/street pools are built once (in the parent, before forking): calling
+# Faker per row would dominate the run time at millions of rows. _context
+# holds shared inputs (e.g. driver ids) that forked workers inherit instead
+# of receiving them pickled with every chunk.
+_pools = {}
+_context = {}
+
+
+def _build_pools(seed):
+    Faker.seed(seed)
+    fake = Faker('es_CO')
+    _pools['first_names'] = np.array([fake.first_name() for _ in range(500)], dtype=object)
+    _pools['last_names'] = np.array([fake.last_name() for _ in range(500)], dtype=object)
+    _pools['streets'] = np.array([fake.street_name() for _ in range(500)], dtype=object)
+
+
+def _points(rng, count):
+    cities = rng.choice(len(CITIES), size=count, p=_city_weights())
+    centers = np.array([(lat, lon, spread) for _, _, lat, lon, _, spread in CITIES])[cities]
+    offsets = rng.standard_normal((count, 2)) * centers[:, 2:3] / KM_PER_DEGREE
+    latitudes = np.clip(centers[:, 0] + offsets[:, 0], -90.0, 90.0)
+    longitudes = centers[:, 1] + offsets[:, 1] / np.cos(np.radians(latitudes))
+    return cities, latitudes, np.clip(longitudes, -180.0, 180.0)
+
+
+def _city_weights():
+    weights = np.array([city[4] for city in CITIES])
+    return weights / weights.sum()
+
+
+def _address_columns(rng, count, context):
+    cities, latitudes, longitudes = _points(rng, count)
+    streets = _pools['streets'][rng.integers(len(_pools['streets']), size=count)]
+    numbers = rng.integers(1, 200, size=(count, 2))
+    street_addresses = [
+        f"{street} # {first}-{second}" for street, (first, second) in zip(streets, numbers.tolist())
+    ]
+    names = np.array([city[0] for city in CITIES], dtype=object)
+    states = np.array([city[1] for city in CITIES], dtype=object)
+    postal_codes = rng.integers(100000, 999999, size=count).astype(str).astype(object)
+    return [np.array(street_addresses, dtype=object), names[cities], states[cities], postal_codes, latitudes, longitudes]
+
+
+def _driver_columns(rng, count, context):
+    _, latitudes, longitudes = _points(rng, count)
+    first = _pools['first_names'][rng.integers(len(_pools['first_names']), size=count)]
+    last = _pools['last_names'][rng.integers(len(_pools['last_names']), size=count)]
+    names = np.array([f"{a} {b}" for a, b in zip(first, last)], dtype=object)
+    available = rng.random(count) < 0.75
+    return [names, latitudes, longitudes, available, np.full(count, np.datetime64('NaT'), dtype='datetime64[us]')]
+
+
+def _service_columns(rng, count, context):
+    """Historical services: completed or cancelled, with a few still pending."""
+    _, latitudes, longitudes = _points(rng, count)
+    choices = np.array([
+        Service.StatusChoices.COMPLETED, Service.StatusChoices.CANCELLED, Service.StatusChoices.PENDING
+    ], dtype=object)
+    status = rng.choice(3, size=count, p=[0.85, 0.10, 0.05])
+    pending, completed = status == 2, status == 0
+    drivers = context['driver_ids']
+    if isinstance(drivers, tuple):
+        driver_ids = rng.integers(drivers[0], drivers[1] + 1, size=count)
+    elif len(drivers):
+        driver_ids = drivers[rng.integers(len(drivers), size=count)]
+    else:
+        driver_ids = np.zeros(count, dtype=np.int64)
+    driver_ids[pending] = 0
+
+    now = np.datetime64(context['now'].replace(tzinfo=None), 'us')
+    second = np.timedelta64(1_000_000, 'us')
+    requested = now - (rng.uniform(0, 30 * 24 * 3600, size=count) * second).astype('timedelta64[us]')
+    # Pickup trips at the speed of their hour, +-20%, then up to 10 minutes
+    # until the service is completed.
+    distances = rng.gamma(2.0, 1.5, size=count)
+    hours = (requested.astype('datetime64[h]').astype(np.int64) % 24)
+    speeds = HOURLY_SPEED_KPH[hours] * rng.uniform(0.8, 1.2, size=count)
+    eta = requested + (distances / speeds * 3600 * second).astype('timedelta64[us]')
+    done = eta + (rng.uniform(0, 10 * 60, size=count) * second).astype('timedelta64[us]')
+    eta[pending] = np.datetime64('NaT')
+    done[~completed] = np.datetime64('NaT')
+    distances[pending] = np.nan
+    return [latitudes, longitudes, driver_ids, choices[status], requested, eta, done, distances]
+
+
+# Generators return one array per COLUMNS entry: floats (NaN meaning NULL), booleans, int64
+# foreign keys (0 meaning NULL), UTC datetime64[us] (NaT meaning NULL) or
+# object arrays of strings.
+GENERATORS = {Address: _address_columns, Driver: _driver_columns, Service: _service_columns}
+LABELS = {Address: 'addresses', Driver: 'drivers', Service: 'services'}
+
+
+def _insert_chunk(task):
+    """Generate and insert one chunk; runs in the command or in a worker process."""
+    model, index, count, seed, method = task
+    rng = np.random.default_rng([seed, index])
+    columns = GENERATORS[model](rng, count, _context)
+    with transaction.atomic():
+        if method == 'copy':
+            _copy_columns(model, columns)
+        else:
+            names = COLUMNS[model]
+            model.objects.bulk_create(
+                [model(**dict(zip(names, row))) for row in zip(*map(_python_values, columns))], batch_size=count
+            )
+    return count
+
+
+def _csv_values(values):
+    if values.dtype.kind == 'f':
+        return [repr(value) if value == value else '' for value in values.tolist()]
+    if values.dtype.kind == 'b':
+        return ['t' if value else 'f' for value in values.tolist()]
+    if values.dtype.kind == 'i':
+        return [str(value) if value else '' for value in values.tolist()]
+    if values.dtype.kind == 'M':
+        return [
+            '' if value == 'NaT' else value for value in np.datetime_as_string(values, timezone='UTC').tolist()
+        ]
+    return ['"' + value.replace('"', '""') + '"' for value in values.tolist()]
+
+
+def _python_values(values):
+    if values.dtype.kind == 'f':
+        return [value if value == value else None for value in values.tolist()]
+    if values.dtype.kind == 'i':
+        return [value or None for value in values.tolist()]
+    if values.dtype.kind == 'M':
+        return [value and value.replace(tzinfo=dt_timezone.utc) for value in values.tolist()]
+    return values.tolist()
+
+
+def _copy_columns(model, columns):
+    buffer = io.StringIO()
+    buffer.writelines(','.join(row) + '\n' for row in zip(*map(_csv_values, columns)))
+    buffer.seek(0)
+    qn = connection.ops.quote_name
+    names = ', '.join(qn(model._meta.get_field(name).column) for name in COLUMNS[model])
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {qn(model._meta.db_table)} ({names}) FROM STDIN WITH (FORMAT csv)", buffer)
+
 
 class Command(BaseCommand):
-    help = 'Seeds the database with fake addresses and drivers'
+    help = 'Seeds the database with fake addresses, drivers and (optionally) services clustered around cities'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--addresses', type=int, default=25)
+        parser.add_argument('--drivers', type=int, default=25)
+        parser.add_argument('--services', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=20000, help='Rows generated and written per batch.')
+        parser.add_argument('--workers', type=int, default=1, help='Processes generating chunks in parallel.')
+        parser.add_argument(
+            '--method', choices=('auto', 'copy', 'bulk'), default='auto',
+            help="'copy' streams CSV through Postgres COPY; 'bulk' uses bulk_create. 'auto' picks copy on Postgres."
+        )
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--no-clear', action='store_true', help='Keep existing rows.')
 
     def handle(self, *args, **options):
-        fake = Faker()
-        
-        self.stdout.write('Clearing existing Address and Driver data...')
-        Address.objects.all().delete()
-        Driver.objects.all().delete()
-
-        addresses = []
-        address_count = 25 
-        self.stdout.write(f'Seeding {address_count} addresses...')
-        for _ in range(address_count):
-            address = Address(
-                street_address=fake.street_address(),
-                city=fake.city(),
-                state=fake.state_abbr(),
-                postal_code=fake.postcode(),
-                latitude=fake.latitude(),
-                longitude=fake.longitude()
-            )
-            addresses.append(address)
-        Address.objects.bulk_create(addresses)
-        self.stdout.write(self.style.SUCCESS(f'Successfully seeded {address_count} addresses.'))
-
-        drivers = []
-        driver_count = 25
-        self.stdout.write(f'Seeding {driver_count} drivers...')
-        for _ in range(driver_count):
-            driver = Driver(
-                name=fake.name(),
-                current_latitude=fake.latitude(),
-                current_longitude=fake.longitude(),
-                is_available=random.choice([True, True, True, False]) 
-            )
-            drivers.append(driver)
-        Driver.objects.bulk_create(drivers)
-        self.stdout.write(self.style.SUCCESS(f'Successfully seeded {driver_count} drivers.'))
+        method = options['method']
+        if method == 'auto':
+            method = 'copy' if connection.vendor == 'postgresql' else 'bulk'
+        if method == 'copy' and connection.vendor != 'postgresql':
+            raise CommandError('COPY requires PostgreSQL; use --method bulk.')
+        if options['workers'] > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError('--workers needs the fork start method.')
+        seed = options['seed'] if options['seed'] is not None else int(time.time())
+        _build_pools(seed)
+
+        if not options['no_clear']:
+            self.stdout.write('Clearing existing Address, Driver and Service data...')
+            self._clear()
+
+        _context['now'] = timezone.now()
+        # Keep the generated (historical) request times with bulk_create.
+        request_time = Service._meta.get_field('request_time')
+        request_time.auto_now_add = False
+        try:
+            for model, count in ((Address, options['addresses']), (Driver, options['drivers']), (Service, options['services'])):
+                if not count:
+                    continue
+                if model is Service:
+                    _context['driver_ids'] = self._driver_ids()
+                name = LABELS[model]
+                self.stdout.write(f'Seeding {count} {name}...')
+                start = time.perf_counter()
+                self._seed(model, count, seed, method, options)
+                self.stdout.write(self.style.SUCCESS(
+                    f'Successfully seeded {count} {name} in {time.perf_counter() - start:.1f}s.'
+                ))
+        finally:
+            request_time.auto_now_add = True
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for model in COLUMNS:
+                    cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+        self.stdout.write(self.style.SUCCESS('Database seeding complete.'))
+
+    def _seed(self, model, count, seed, method, options):
+        chunk_size = options['chunk_size']
+        tasks = [
+            (model, index, min(chunk_size, count - index * chunk_size), seed, method)
+            for index in range(math.ceil(count / chunk_size))
+        ]
+        if options['workers'] <= 1:
+            for task in tasks:
+                _insert_chunk(task)
+            return
+        # Children must not share the parent's database connection.
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(options['workers']) as pool:
+            for _ in pool.imap_unordered(_insert_chunk, tasks):
+                pass
+
+    def _clear(self):
+        models = (DispatchJob, Service, Driver, Address)
+        tables = [model._meta.db_table for model in models]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('TRUNCATE ' + ', '.join(connection.ops.quote_name(table) for table in tables))
+        else:
+            for model in models:
+                model.objects.all()._raw_delete(model.objects.db)
 
-        self.stdout.write(self.style.SUCCESS('Database seeding complete.')) 
\ No newline at end of file
+    def _driver_ids(self):
+        """The pk range when contiguous (fresh tables), else every pk."""
+        bounds = Driver.objects.order_by().values_list('pk', flat=True)
+        count = bounds.count()
+        if not count:
+            return np.empty(0, dtype=np.int64)
+        low, high = bounds.order_by('pk').first(), bounds.order_by('-pk').first()
+        if high - low + 1 == count:
+            return (low, high)
+        return np.fromiter(bounds.iterator(chunk_size=100000), dtype=np.int64, count=count)
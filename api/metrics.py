@@ -0,0 +1,209 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def metrics_settings():
+    return getattr(settings, 'METRICS', {})
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram per label set, rendered in the Prometheus
+    text format. ``observe`` is a bisect plus three increments under a lock.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def samples(self):
+        for labels, (counts, total, count) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                yield '_bucket', labels + (_format_bound(bound),), self.labelnames + ('le',), cumulative
+            yield '_sum', labels, self.labelnames, total
+            yield '_count', labels, self.labelnames, count
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield '_total', labels, self.labelnames, value
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """``collector()`` yields ``(name, kind, documentation, value)`` gauges/counters at scrape time."""
+        self._collectors.append(collector)
+        return collector
+
+    def clear(self):
+        for metric in self._metrics:
+            metric.clear()
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, labelnames, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{_format_labels(labelnames, labels)} {_format_value(value)}')
+        for collector in self._collectors:
+            for name, kind, documentation, value in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+request_seconds = REGISTRY.register(Histogram(
+    'api_request_seconds', 'Wall time per request, by view.', ('view', 'method')
+))
+responses = REGISTRY.register(Counter('api_responses', 'Responses by view and status code.', ('view', 'status')))
+db_queries = REGISTRY.register(Histogram(
+    'api_db_queries', 'Database queries per request, by view.', ('view',), buckets=COUNT_BUCKETS
+))
+db_seconds = REGISTRY.register(Histogram('api_db_seconds', 'Database time per request, by view.', ('view',)))
+phase_seconds = REGISTRY.register(Histogram(
+    'api_phase_seconds', 'Time spent in instrumented phases (search, serialize, ...), by view.', ('view', 'phase')
+))
+
+
+class RequestStats:
+    __slots__ = ('request', 'queries', 'db_time')
+
+    def __init__(self, request=None):
+        self.request = request
+        self.queries = 0
+        self.db_time = 0.0
+
+    @property
+    def view(self):
+        """The URL pattern's view name once the request is resolved, else ``''``."""
+        match = getattr(self.request, 'resolver_match', None)
+        return match.view_name if match is not None else ''
+
+
+# Set by MetricsMiddleware for the duration of a request; None elsewhere
+# (management commands, tests without the middleware), where the hooks
+# below do nothing.
+current_request = ContextVar('current_request', default=None)
+
+
+class phase:
+    """
+    Time a block as ``api_phase_seconds{phase=name}`` of the current request.
+
+    A plain class rather than ``@contextmanager``: it wraps hot paths and
+    the generator machinery would cost more than the measurement.
+    """
+    __slots__ = ('name', 'stats', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.stats = current_request.get()
+        if self.stats is not None:
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.stats is not None:
+            phase_seconds.observe(time.perf_counter() - self.start, self.stats.view, self.name)
+
+
+def record_query(execute, sql, params, many, context):
+    """``connection.execute_wrapper`` hook counting and timing queries per request."""
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+def install_query_recorder(connection, **kwargs):
+    """``connection_created`` receiver: instrument every new connection once."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
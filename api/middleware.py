@@ -0,0 +1,279 @@
+import cProfile
+import json
+import math
+import os
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+from . import metrics, replicas
+from .admission import (
+    ConcurrencyLimiter, SharedTokenBuckets, TokenBuckets, admission_decisions, admission_settings, client_key,
+    queue_time, rate_limit_key
+)
+from .metrics import RequestStats, current_request, metrics_settings
+
+
+class TraceRecorderMiddleware:
+    """
+    Appends every API request to ``BENCH_TRACE_FILE`` as a JSONL trace line
+    (``name``, ``method``, ``path``, ``body``) that ``manage.py bench replay``
+    can play back. Disabled unless the setting is set.
+    """
+
+    def __init__(self, get_response):
+        self.path = getattr(settings, 'BENCH_TRACE_FILE', None)
+        if not self.path:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        body = None
+        if request.body and request.content_type == 'application/json':
+            try:
+                body = json.loads(request.body)
+            except ValueError:
+                pass
+        response = self.get_response(request)
+        if request.path.startswith('/api/') and request.resolver_match is not None:
+            entry = {'name': request.resolver_match.url_name, 'method': request.method, 'path': request.get_full_path()}
+            if body is not None:
+                entry['body'] = body
+            line = json.dumps(entry) + '\n'
+            with self._lock, open(self.path, 'a') as trace:
+                trace.write(line)
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Records per-view wall time, response codes and database queries/time
+    into the histograms of ``api.metrics`` (served at ``/api/metrics/``).
+
+    With ``METRICS['PROFILE_DIR']`` set, a request carrying the
+    ``X-Profile`` header is run under cProfile (one at a time, sampled at
+    ``PROFILE_SAMPLE_RATE``) and the stats are dumped to that directory.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        options = metrics_settings()
+        if not options.get('ENABLED', True):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.profile_dir = options.get('PROFILE_DIR')
+        self.profile_rate = options.get('PROFILE_SAMPLE_RATE', 1.0)
+        self._profile_lock = threading.Lock()
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats(request)
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            if self.profile_dir and 'HTTP_X_PROFILE' in request.META:
+                response = self._profiled(request, stats)
+            else:
+                response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self._record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        # Queries run in sync_to_async threads; the copied context still
+        # carries ``stats`` there, so they are counted as well.
+        stats = RequestStats(request)
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self._record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def _record(request, response, stats, elapsed):
+        view = stats.view or 'unmatched'
+        metrics.request_seconds.observe(elapsed, view, request.method)
+        metrics.responses.inc(view, response.status_code)
+        metrics.db_queries.observe(stats.queries, view)
+        metrics.db_seconds.observe(stats.db_time, view)
+
+    def _profiled(self, request, stats):
+        if random.random() >= self.profile_rate or not self._profile_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            response = profiler.runcall(self.get_response, request)
+            name = f"{stats.view or 'unmatched'}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident()}.prof"
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, name))
+            response['X-Profile-Dump'] = name
+            return response
+        finally:
+            self._profile_lock.release()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Tracks each request for ``api.replicas.ReplicaRouter``.
+
+    Views opt in to replica reads with ``ReplicaReadMixin``. A request that
+    writes marks its client (token, else address) so its reads stay on the
+    primary for ``DATABASE_REPLICAS['STICKY_SECONDS']``. Not used without
+    ``DATABASE_REPLICAS['ALIASES']``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replicas.replica_settings().get('ALIASES'):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = replicas.enter(client_key(request))
+        try:
+            return self.get_response(request)
+        finally:
+            replicas.leave(token)
+
+    async def __acall__(self, request):
+        token = replicas.enter(client_key(request))
+        try:
+            return await self.get_response(request)
+        finally:
+            replicas.leave(token)
+
+
+class AdmissionControlMiddleware:
+    """
+    Sheds load on the views in ``ADMISSION['VIEWS']`` before it piles up.
+
+    In order, a request to a guarded view is:
+
+    * rate limited per client with a token bucket of ``RATE`` requests/s
+      and ``BURST`` (429), by user once its token is known valid and by
+      address until then. Buckets are in memory, or in the
+      ``SHARED`` cache alias so every process shares them;
+    * shed when it already queued in front of Django (``X-Request-Start``)
+      for more than ``MAX_QUEUE_TIME`` seconds (503);
+    * made to wait for one of ``MAX_CONCURRENCY`` in-flight slots per
+      process, and shed if none frees up within what is left of
+      ``MAX_QUEUE_TIME`` (503).
+
+    Rejections are answered at once with ``Retry-After``, and every
+    decision is counted in ``api_admission_total``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        options = admission_settings()
+        if not options.get('ENABLED', True) or not options.get('VIEWS'):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.views = frozenset(options['VIEWS'])
+        rate = options.get('RATE')
+        if not rate:
+            self.buckets = None
+        elif options.get('SHARED'):
+            self.buckets = SharedTokenBuckets(rate, options.get('BURST', rate), options['SHARED'])
+        else:
+            self.buckets = TokenBuckets(rate, options.get('BURST', rate), options.get('MAX_CLIENTS', 100000))
+        concurrency = options.get('MAX_CONCURRENCY')
+        self.slots = ConcurrencyLimiter(concurrency) if concurrency else None
+        self.max_queue_time = options.get('MAX_QUEUE_TIME', 1.0)
+        self.retry_after = options.get('RETRY_AFTER', 1)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        view = self._guarded_view(request)
+        if view is None:
+            return self.get_response(request)
+        rejection, budget = self._admit(request, view)
+        if rejection is not None:
+            return rejection
+        if self.slots is None:
+            return self._served(view, self.get_response(request))
+        if not self.slots.acquire(budget):
+            return self._shed(view, 'concurrency')
+        try:
+            return self._served(view, self.get_response(request))
+        finally:
+            self.slots.release()
+
+    async def __acall__(self, request):
+        view = self._guarded_view(request)
+        if view is None:
+            return await self.get_response(request)
+        rejection, budget = self._admit(request, view)
+        if rejection is not None:
+            return rejection
+        if self.slots is None:
+            return self._served(view, await self.get_response(request))
+        if not await self.slots.aacquire(budget):
+            return self._shed(view, 'concurrency')
+        try:
+            return self._served(view, await self.get_response(request))
+        finally:
+            self.slots.release()
+
+    def _guarded_view(self, request):
+        try:
+            name = resolve(request.path_info).url_name
+        except Resolver404:
+            return None
+        return name if name in self.views else None
+
+    def _admit(self, request, view):
+        """``(rejection, seconds left to wait for a slot)``."""
+        if self.buckets is not None:
+            wait = self.buckets.take(rate_limit_key(request))
+            if wait > 0:
+                admission_decisions.inc(view, 'rate_limited')
+                return self._reject(
+                    429, "Demasiadas solicitudes; reintenta más tarde.", wait
+                ), 0
+        budget = self.max_queue_time - queue_time(request)
+        if budget <= 0:
+            return self._shed(view, 'queue_time'), 0
+        return None, budget
+
+    def _shed(self, view, reason):
+        admission_decisions.inc(view, 'shed_' + reason)
+        return self._reject(503, "Servicio saturado; reintenta en unos segundos.", self.retry_after)
+
+    @staticmethod
+    def _served(view, response):
+        admission_decisions.inc(view, 'served')
+        return response
+
+    @staticmethod
+    def _reject(status_code, message, retry_after):
+        response = JsonResponse({"message": message}, status=status_code)
+        response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
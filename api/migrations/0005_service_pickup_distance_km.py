@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_service_status_requested_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='pickup_distance_km',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -1,5 +1,8 @@
+import uuid
+
 from django.db import models
-import math
+
+from .geo import haversine
 
 class Address(models.Model):
     street_address = models.CharField(max_length=255)
@@ -17,6 +20,15 @@ class Driver(models.Model):
     current_latitude = models.FloatField()
     current_longitude = models.FloatField()
     is_available = models.BooleanField(default=True)
+    location_updated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['is_available', 'current_latitude', 'current_longitude'],
+                name='driver_available_position_idx'
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"{self.name}"
@@ -47,19 +59,60 @@ class Service(models.Model):
     request_time = models.DateTimeField(auto_now_add=True)
     estimated_arrival_time = models.DateTimeField(null=True, blank=True)
     completion_time = models.DateTimeField(null=True, blank=True)
+    # Straight-line driver-to-pickup distance at assignment; feeds the ETA grid.
+    pickup_distance_km = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Pending queue, served oldest first.
+            models.Index(fields=['status', 'request_time'], name='service_status_requested_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"Service {self.pk} - {self.status}"
 
+class DispatchJob(models.Model):
+    """A service request queued for the background dispatch workers."""
+    class StatusChoices(models.TextChoices):
+        QUEUED = 'QUEUED', 'Queued'
+        DONE = 'DONE', 'Done'
+        FAILED = 'FAILED', 'Failed'
 
-def calculate_haversine_distance(lat1, lon1, lat2, lon2):
-    lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    pickup_latitude = models.FloatField()
+    pickup_longitude = models.FloatField()
+    status = models.CharField(max_length=10, choices=StatusChoices.choices, default=StatusChoices.QUEUED)
+    service = models.ForeignKey(Service, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
 
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = math.sin(dlat / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    r = 6371
-    return c * r
+    class Meta:
+        indexes = [
+            # Queue drained oldest first.
+            models.Index(fields=['status', 'created_at'], name='dispatchjob_status_created_idx'),
+        ]
 
+    def __str__(self) -> str:
+        return f"DispatchJob {self.pk} - {self.status}"
 
+class IdempotencyRecord(models.Model):
+    """
+    Stored response of a request made with an ``Idempotency-Key``.
+
+    ``status_code`` is null while the first request is still running;
+    ``expires_at`` then bounds how long a crashed worker can hold the key.
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content = models.BinaryField(default=bytes)
+    headers = models.JSONField(default=dict)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self) -> str:
+        return f"IdempotencyRecord {self.key} - {self.status_code}"
+
+
+def calculate_haversine_distance(lat1, lon1, lat2, lon2):
+    return haversine(lat1, lon1, lat2, lon2)
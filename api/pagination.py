@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on the primary key.
+
+    Each page is a ``WHERE pk > <last seen> ORDER BY pk LIMIT n`` query, so
+    deep pages cost the same as the first one, unlike OFFSET pagination.
+    """
+    ordering = 'pk'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
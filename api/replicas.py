@@ -0,0 +1,154 @@
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+from .cache import LRUCache
+from .metrics import REGISTRY, Counter
+
+replica_reads = REGISTRY.register(Counter(
+    'api_replica_reads', 'Reads in replica-eligible views, by the database that served them.', ('database',)
+))
+
+
+def replica_settings():
+    return getattr(settings, 'DATABASE_REPLICAS', {})
+
+
+class RoutingState:
+    """Where the current request may read from; set up by ``ReplicaRoutingMiddleware``."""
+
+    def __init__(self, client, sticky):
+        self.client = client
+        # A recent write by this client: replicas may not have it yet.
+        self.sticky = sticky
+        self.replica = None
+        self.wrote = False
+
+
+_state = contextvars.ContextVar('replica_routing', default=None)
+
+
+def current_state():
+    return _state.get()
+
+
+class StickyClients:
+    """
+    Clients that wrote in the last ``STICKY_SECONDS`` (the replication lag
+    budget), whose reads stay on the primary.
+
+    Kept in an in-process LRU and, with ``DATABASE_REPLICAS['SHARED']``
+    naming a Django cache alias, in that cache too, so the next request
+    sees the write on whichever process it lands.
+    """
+    key_prefix = 'replica-sticky:'
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self):
+        options = replica_settings()
+        self.ttl = options.get('STICKY_SECONDS', 5)
+        self.local = LRUCache(maxsize=options.get('CACHE_SIZE', 100000), ttl=self.ttl)
+        self.shared_alias = options.get('SHARED')
+
+    def mark(self, client):
+        self.local.set(client, True)
+        if self.shared_alias:
+            caches[self.shared_alias].set(self.key_prefix + client, True, timeout=self.ttl)
+
+    def __contains__(self, client):
+        if self.local.get(client) is not None:
+            return True
+        return bool(self.shared_alias and caches[self.shared_alias].get(self.key_prefix + client))
+
+
+sticky_clients = StickyClients()
+
+
+def enter(client):
+    """Start routing a request from ``client``; returns the token for ``leave``."""
+    return _state.set(RoutingState(client, client in sticky_clients))
+
+
+def leave(token):
+    state = _state.get()
+    _state.reset(token)
+    if state is not None and state.wrote:
+        sticky_clients.mark(state.client)
+
+
+def note_write():
+    """
+    Record a write this request made through another process (a shard
+    worker), which the router did not see: the client's reads stay on the
+    primary as after any other write.
+    """
+    state = _state.get()
+    if state is not None:
+        state.wrote = True
+
+
+def allow_replica_reads():
+    """
+    Let the rest of the current request read from a replica.
+
+    The replica is picked once, so every query of the request sees the
+    same snapshot. No-op without replicas, outside a routed request, or for
+    a client that wrote recently.
+    """
+    state = _state.get()
+    aliases = replica_settings().get('ALIASES')
+    if state is not None and aliases and not state.sticky and state.replica is None:
+        state.replica = random.choice(aliases)
+
+
+class ReplicaRouter:
+    """
+    Sends reads of replica-eligible requests to ``DATABASE_REPLICAS['ALIASES']``.
+
+    Everything else uses the primary: writes, reads outside such requests,
+    every read after the request itself wrote, and reads inside a
+    transaction on the primary, which must see its uncommitted writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.replica is None:
+            return DEFAULT_DB_ALIAS
+        if state.wrote or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            database = DEFAULT_DB_ALIAS
+        else:
+            database = state.replica
+        replica_reads.inc(database)
+        return database
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        # Explicitly, or instances read from a replica would be saved there.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the primary's data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replica_settings().get('ALIASES', ()):
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """Serves the safe methods (GET, HEAD, OPTIONS) of a view from a replica."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # After authentication, so the token lookup still sees fresh tokens.
+        if request.method in SAFE_METHODS:
+            allow_replica_reads()
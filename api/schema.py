@@ -0,0 +1,150 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import condition
+
+FORMATS = {
+    '.json': ('openapi.json', 'application/json'),
+    '.yaml': ('openapi.yaml', 'application/yaml'),
+}
+
+SCHEMA_INFO = {
+    'title': 'Delivery Service API',
+    'default_version': 'v1',
+    'description': 'API for managing and assigning delivery services.',
+    'terms_of_service': 'https://www.google.com/policies/terms/',
+    'contact': {'email': 'contact@example.com'},
+    'license': {'name': 'BSD License'},
+}
+
+
+def schema_settings():
+    return getattr(settings, 'OPENAPI_SCHEMA', {})
+
+
+def schema_info():
+    from drf_yasg import openapi
+
+    options = dict(SCHEMA_INFO)
+    options['contact'] = openapi.Contact(**options['contact'])
+    options['license'] = openapi.License(**options['license'])
+    return openapi.Info(**options)
+
+
+def generate_schema():
+    """Introspect every view and serializer; returns ``{format: bytes}`` for each of ``FORMATS``."""
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    schema = OpenAPISchemaGenerator(schema_info(), url=schema_settings().get('URL')).get_schema(
+        request=None, public=True
+    )
+    return {'.json': OpenAPICodecJson([]).encode(schema), '.yaml': OpenAPICodecYaml([]).encode(schema)}
+
+
+def write_schema(documents, directory):
+    """Write ``documents`` into ``directory``, each file moved into place atomically."""
+    os.makedirs(directory, exist_ok=True)
+    for format, content in documents.items():
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp, os.path.join(directory, FORMATS[format][0]))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+class SchemaCache:
+    """
+    The OpenAPI documents, built once per process and served from memory.
+
+    They are read from ``OPENAPI_SCHEMA['DIRECTORY']`` when ``manage.py
+    generate_schema`` wrote them there at deploy time, else generated on the
+    first request. Nothing invalidates them short of a restart: the schema
+    only changes with the code.
+    """
+
+    def __init__(self):
+        self._documents = None
+        self._lock = threading.Lock()
+
+    def get(self, format):
+        """``(content, etag)`` of the document in ``format`` (``'.json'`` or ``'.yaml'``)."""
+        if self._documents is None:
+            with self._lock:
+                if self._documents is None:
+                    self._documents = {
+                        format: (content, '"%s"' % hashlib.sha256(content).hexdigest()[:32])
+                        for format, content in (self._read() or generate_schema()).items()
+                    }
+        return self._documents[format]
+
+    def clear(self):
+        self._documents = None
+
+    def _read(self):
+        directory = schema_settings().get('DIRECTORY')
+        if not directory:
+            return None
+        try:
+            documents = {}
+            for format, (name, _) in FORMATS.items():
+                with open(os.path.join(directory, name), 'rb') as f:
+                    documents[format] = f.read()
+            return documents
+        except FileNotFoundError:
+            return None
+
+
+schema_cache = SchemaCache()
+
+
+@condition(etag_func=lambda request, format: schema_cache.get(format)[1])
+def schema_document(request, format):
+    """The OpenAPI document as JSON or YAML, answering ``If-None-Match`` with 304."""
+    content, _ = schema_cache.get(format)
+    response = HttpResponse(content, content_type=FORMATS[format][1])
+    # Clients may keep it but must revalidate, so a deploy shows up at once.
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def schema_ui(renderer):
+    """
+    Swagger UI or ReDoc page for the cached document.
+
+    drf_yasg is imported on the first visit rather than at URLconf load. The
+    pages load the document from ``schema-json`` (see ``SWAGGER_SETTINGS``
+    and ``REDOC_SETTINGS``); a ``?format=openapi`` request is answered from
+    the cache as well.
+    """
+    views = []
+    lock = threading.Lock()
+
+    def view(request, *args, **kwargs):
+        if request.GET.get('format') == 'openapi':
+            return schema_document(request, '.json')
+        if not views:
+            with lock:
+                if not views:
+                    views.append(_ui_view(renderer))
+        return views[0](request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    return view
+
+
+def _ui_view(renderer):
+    from drf_yasg.views import get_schema_view
+    from rest_framework import permissions
+
+    # The pages only show the title and version; their own schema has no paths.
+    return get_schema_view(
+        schema_info(), public=True, permission_classes=(permissions.AllowAny,), patterns=[]
+    ).with_ui(renderer, cache_timeout=0)
@@ -1,3 +1,6 @@
+import math
+
+from django.conf import settings
 from rest_framework import serializers
 from .models import Address, Driver, Service
 
@@ -10,6 +13,7 @@ class DriverSerializer(serializers.ModelSerializer):
     class Meta:
         model = Driver
         fields = '__all__'
+        read_only_fields = ('location_updated_at',)
 
 class ServiceSerializer(serializers.ModelSerializer):
     assigned_driver = DriverSerializer(read_only=True)
@@ -51,6 +55,36 @@ class ServiceRequestSerializer(serializers.Serializer):
             
         return data
 
+class NearbyQuerySerializer(serializers.Serializer):
+    """Query parameters of the address lookups (``?lat=&lon=&k=&radius_km=``)."""
+    limits_setting = 'ADDRESS_INDEX'
+
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lon = serializers.FloatField(min_value=-180, max_value=180)
+    k = serializers.IntegerField(min_value=1, default=10)
+    radius_km = serializers.FloatField(min_value=0, required=False)
+
+    def validate(self, data):
+        # FloatField accepts 'nan', which no min/max bound rejects.
+        errors = {
+            name: "Debe ser un número finito." for name in ('lat', 'lon', 'radius_km')
+            if name in data and not math.isfinite(data[name])
+        }
+        if errors:
+            raise serializers.ValidationError(errors)
+        options = getattr(settings, self.limits_setting, {})
+        if data['k'] > options.get('MAX_K', 100):
+            raise serializers.ValidationError({"k": f"Máximo {options.get('MAX_K', 100)} resultados."})
+        if data.get('radius_km', 0) > options.get('MAX_RADIUS_KM', 50.0):
+            raise serializers.ValidationError({"radius_km": f"Máximo {options.get('MAX_RADIUS_KM', 50.0)} km."})
+        return data
+
+class DriverNearbyQuerySerializer(NearbyQuerySerializer):
+    """``drivers/nearby/`` adds ``?available=true|false`` (both when omitted)."""
+    limits_setting = 'DRIVER_NEARBY'
+
+    available = serializers.BooleanField(required=False, allow_null=True, default=None)
+
 class ServiceUpdateSerializer(serializers.ModelSerializer):
     """Serializer specifically for updating service status (e.g., completing)."""
     class Meta:
@@ -0,0 +1,228 @@
+import math
+import threading
+import zlib
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from django.conf import settings
+from django.db import connections
+
+from .geo import EARTH_RADIUS_KM
+from .metrics import REGISTRY, Counter
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+shard_calls = REGISTRY.register(Counter(
+    'api_shard_dispatches', 'Single dispatches by shard worker and outcome.', ('worker', 'outcome')
+))
+
+
+def shard_settings():
+    return getattr(settings, 'DISPATCH_SHARDS', {})
+
+
+def parse_address(address):
+    """``'host:port'`` to a ``(host, port)`` tuple; anything else is a Unix socket path."""
+    host, sep, port = address.rpartition(':')
+    return (host, int(port)) if sep and port.isdigit() else address
+
+
+class ShardMap:
+    """
+    Geohash cells of ``precision`` characters, each owned by one worker.
+
+    Cells are handled as integer ``(row, col)`` pairs, the latitude and
+    longitude halves of the geohash bits, so neighbours and bulk lookups are
+    plain arithmetic; ``geohash`` names them. A cell's owner is a stable
+    hash of its geohash, so every process agrees on it without
+    coordination.
+    """
+
+    def __init__(self, precision, workers):
+        bits = 5 * precision
+        self.precision = precision
+        self.workers = workers
+        self.lat_bits, self.lon_bits = bits // 2, bits - bits // 2
+        self.rows, self.cols = 1 << self.lat_bits, 1 << self.lon_bits
+        self.cell_lat, self.cell_lon = 180 / self.rows, 360 / self.cols
+
+    def cell(self, latitude, longitude):
+        return (
+            min(int((latitude + 90) / self.cell_lat), self.rows - 1),
+            min(int((longitude + 180) / self.cell_lon), self.cols - 1)
+        )
+
+    def cells(self, latitudes, longitudes):
+        """Vectorized ``cell``, as flat ``row * cols + col`` ids."""
+        rows = np.minimum(((np.asarray(latitudes) + 90) / self.cell_lat).astype(np.int64), self.rows - 1)
+        cols = np.minimum(((np.asarray(longitudes) + 180) / self.cell_lon).astype(np.int64), self.cols - 1)
+        return rows * self.cols + cols
+
+    def geohash(self, cell):
+        row, col = cell
+        value = 0
+        for i in range(self.lat_bits + self.lon_bits):
+            # Geohash bits alternate longitude, latitude, starting with longitude.
+            if i % 2 == 0:
+                bit = col >> (self.lon_bits - 1 - i // 2) & 1
+            else:
+                bit = row >> (self.lat_bits - 1 - i // 2) & 1
+            value = value << 1 | bit
+        return ''.join(
+            GEOHASH_ALPHABET[value >> 5 * (self.precision - 1 - i) & 31] for i in range(self.precision)
+        )
+
+    def owner(self, cell):
+        return zlib.crc32(self.geohash(cell).encode()) % self.workers
+
+    def neighbors(self, cell):
+        """The up to 8 cells around ``cell``; longitude wraps, latitude stops at the poles."""
+        row, col = cell
+        return [
+            (row + dr, (col + dc) % self.cols)
+            for dr in (-1, 0, 1) for dc in (-1, 0, 1)
+            if (dr or dc) and 0 <= row + dr < self.rows
+        ]
+
+    def reach_km(self, cell):
+        """
+        Distance from any point of ``cell`` that stays inside its ring of neighbours.
+
+        A cell is at most as wide as its poleward neighbour edge, so that
+        edge bounds the longitude side.
+        """
+        row = cell[0]
+        edge = max(abs(-90 + (row - 1) * self.cell_lat), abs(-90 + (row + 2) * self.cell_lat))
+        width = self.cell_lon * KM_PER_DEGREE * math.cos(math.radians(min(edge, 90)))
+        return min(self.cell_lat * KM_PER_DEGREE, width)
+
+
+class ShardRouter:
+    """
+    Sends each single dispatch to the worker process owning the pickup's cell.
+
+    Every thread keeps one connection per worker. A request whose worker
+    cannot be reached is dispatched locally instead (the database locks keep
+    that safe); one whose reply is lost raises, since the worker may have
+    assigned a driver already.
+    """
+
+    def __init__(self, addresses, precision=4, authkey=None):
+        self.addresses = [parse_address(address) if isinstance(address, str) else address for address in addresses]
+        self.map = ShardMap(precision, len(self.addresses))
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def worker_for(self, latitude, longitude):
+        return self.map.owner(self.map.cell(latitude, longitude))
+
+    def dispatch(self, latitude, longitude, fallback):
+        worker = self.worker_for(latitude, longitude)
+        try:
+            connection = self._send(worker, ('dispatch', latitude, longitude))
+        except OSError:
+            shard_calls.inc(str(worker), 'fallback')
+            return fallback(latitude, longitude)
+        try:
+            outcome, result = connection.recv()
+        except (OSError, EOFError):
+            self._drop(worker)
+            shard_calls.inc(str(worker), 'lost')
+            raise
+        shard_calls.inc(str(worker), outcome)
+        if outcome == 'error':
+            raise result
+        return result
+
+    def _send(self, worker, message):
+        connections = self._connections()
+        connection = connections.get(worker)
+        if connection is not None:
+            try:
+                connection.send(message)
+                return connection
+            except OSError:
+                # The worker restarted since this connection was opened.
+                self._drop(worker)
+        connection = connections[worker] = Client(self.addresses[worker], authkey=self.authkey)
+        connection.send(message)
+        return connection
+
+    def _connections(self):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        return connections
+
+    def _drop(self, worker):
+        connection = self._connections().pop(worker, None)
+        if connection is not None:
+            connection.close()
+
+
+def serve(worker, address, authkey, ready=None):
+    """
+    Answer ``ShardRouter`` requests with ``worker`` (a ``ShardWorker``) until killed.
+
+    Each router connection gets its own thread and database connection.
+    ``ready(address)`` is called once the listener is bound, with the
+    actual address (for port 0).
+    """
+    with Listener(address, authkey=authkey) as listener:
+        if ready is not None:
+            ready(listener.address)
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, OSError):
+                continue
+            threading.Thread(target=_serve_connection, args=(worker, connection), daemon=True).start()
+
+
+def _serve_connection(worker, connection):
+    try:
+        while True:
+            try:
+                command, *args = connection.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if command != 'dispatch':
+                    raise ValueError(f'Unknown shard command {command!r}.')
+                reply = ('ok', worker.dispatch(*args))
+            except Exception as exc:
+                reply = ('error', exc)
+            connection.send(reply)
+    finally:
+        connection.close()
+        connections.close_all()
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_shard_router():
+    """The process-wide ``ShardRouter``, or ``None`` without ``DISPATCH_SHARDS['WORKERS']``."""
+    global _router
+    options = shard_settings()
+    if not options.get('WORKERS'):
+        return None
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ShardRouter(options['WORKERS'], options.get('PRECISION', 4), shard_authkey())
+    return _router
+
+
+def reset_shard_router():
+    global _router
+    _router = None
+
+
+def shard_authkey():
+    """``DISPATCH_SHARDS['AUTHKEY']`` (default ``SECRET_KEY``) as bytes."""
+    authkey = shard_settings().get('AUTHKEY') or settings.SECRET_KEY
+    return authkey.encode() if isinstance(authkey, str) else authkey
@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .conditional import configure_response_cache, resource_versions
+from .dispatch import available_drivers, index_driver
+from .eta import reset_eta_engine
+from .events import driver_event, publish_on_commit, service_event
+from .geocode import address_index, index_address
+from .idempotency import idempotency_store
+from .models import Address, Driver, Service
+from .replicas import sticky_clients
+from .schema import schema_cache
+from .shards import reset_shard_router
+
+
+@receiver(post_save, sender=Driver)
+def driver_saved(sender, instance, **kwargs):
+    # After commit: a concurrent dispatch would skip the still-locked row and
+    # drop it from the index as stale, and a rollback would leave it wrong.
+    transaction.on_commit(lambda: index_driver(instance))
+    resource_versions.bump_on_commit('api.driver', [instance.pk])
+    publish_on_commit(lambda: [driver_event(instance)])
+
+
+@receiver(post_delete, sender=Driver)
+def driver_deleted(sender, instance, **kwargs):
+    pk = instance.pk  # None once the delete returns
+    transaction.on_commit(lambda: available_drivers.remove(pk))
+    resource_versions.bump_on_commit('api.driver', [instance.pk])
+    publish_on_commit(lambda: [driver_event(instance, deleted=True)])
+
+
+@receiver(post_save, sender=Service)
+def service_saved(sender, instance, **kwargs):
+    publish_on_commit(lambda: [service_event(instance)])
+
+
+@receiver(post_save, sender=Address)
+def address_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: index_address(instance))
+    resource_versions.bump_on_commit('api.address', [instance.pk])
+
+
+@receiver(post_delete, sender=Address)
+def address_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: address_index.remove(pk))
+    resource_versions.bump_on_commit('api.address', [instance.pk])
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_changed(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, **kwargs):
+    # Deactivation, password or permission changes: re-read on next request.
+    # On commit, so a concurrent request cannot re-cache the old row and a
+    # rolled-back change leaves the caches alone.
+    pk = instance.pk
+    transaction.on_commit(lambda: token_cache.invalidate_user(pk))
+
+
+@receiver(setting_changed)
+def token_cache_setting_changed(setting, **kwargs):
+    if setting == 'TOKEN_CACHE':
+        token_cache.configure()
+
+
+@receiver(setting_changed)
+def eta_setting_changed(setting, **kwargs):
+    if setting == 'ETA':
+        reset_eta_engine()
+
+
+@receiver(setting_changed)
+def shard_setting_changed(setting, **kwargs):
+    if setting == 'DISPATCH_SHARDS':
+        reset_shard_router()
+
+
+@receiver(setting_changed)
+def idempotency_setting_changed(setting, **kwargs):
+    if setting == 'IDEMPOTENCY':
+        idempotency_store.configure()
+
+
+@receiver(setting_changed)
+def schema_setting_changed(setting, **kwargs):
+    if setting == 'OPENAPI_SCHEMA':
+        schema_cache.clear()
+
+
+@receiver(setting_changed)
+def replica_setting_changed(setting, **kwargs):
+    if setting == 'DATABASE_REPLICAS':
+        sticky_clients.configure()
+
+
+@receiver(setting_changed)
+def response_cache_setting_changed(setting, **kwargs):
+    if setting == 'RESPONSE_CACHE':
+        configure_response_cache()
@@ -0,0 +1,308 @@
+import heapq
+import math
+import threading
+from itertools import chain
+
+import numpy as np
+
+from .geo import EARTH_RADIUS_KM, bounding_box, haversine, haversine_distances
+
+# Shell offsets are shared by every index; shell ``r`` holds the cell offsets
+# at Chebyshev distance exactly ``r`` from the origin cell.
+_SHELLS = []
+
+
+def _shell(r):
+    while len(_SHELLS) <= r:
+        n = len(_SHELLS)
+        span = range(-n, n + 1)
+        _SHELLS.append(tuple(
+            (dx, dy, dz)
+            for dx in span for dy in span for dz in span
+            if max(abs(dx), abs(dy), abs(dz)) == n
+        ))
+    return _SHELLS[r]
+
+
+def _shell_size(r):
+    return 24 * r * r + 2 if r else 1
+
+
+def to_unit_vector(latitude, longitude):
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    cos_lat = math.cos(lat)
+    return cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat)
+
+
+def chord_to_km(chord):
+    """Great-circle distance in km for a chord length on the unit sphere."""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+class GridIndex:
+    """
+    Bucket grid of points keyed by primary key.
+
+    Points are placed on the unit sphere and bucketed into cubes of
+    ``cell_km`` side, so there is no special casing for the poles or the
+    antimeridian. A nearest query probes cube shells outwards from the query
+    cell and stops as soon as no unvisited cell can hold a closer point.
+    Candidates are ranked with the scalar ``haversine`` and ties
+    broken on primary key, which is exactly what a linear scan ordered by
+    primary key returns.
+    """
+
+    def __init__(self, cell_km=1.0):
+        self.cell = cell_km / EARTH_RADIUS_KM
+        self._points = {}
+        self._buckets = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, pk):
+        return pk in self._points
+
+    def _key(self, vector):
+        cell = self.cell
+        return (
+            math.floor(vector[0] / cell),
+            math.floor(vector[1] / cell),
+            math.floor(vector[2] / cell),
+        )
+
+    def position(self, pk):
+        entry = self._points.get(pk)
+        return None if entry is None else entry[:2]
+
+    def insert(self, pk, latitude, longitude):
+        key = self._key(to_unit_vector(latitude, longitude))
+        with self._lock:
+            self._discard(pk)
+            self._points[pk] = (latitude, longitude, key)
+            self._buckets.setdefault(key, {})[pk] = (latitude, longitude)
+
+    def remove(self, pk):
+        with self._lock:
+            self._discard(pk)
+
+    def _discard(self, pk):
+        entry = self._points.pop(pk, None)
+        if entry is None:
+            return
+        bucket = self._buckets[entry[2]]
+        del bucket[pk]
+        if not bucket:
+            del self._buckets[entry[2]]
+
+    def clear(self):
+        with self._lock:
+            self._points.clear()
+            self._buckets.clear()
+
+    def items(self):
+        """Snapshot of ``(pk, latitude, longitude)`` for every point."""
+        with self._lock:
+            return [(pk, lat, lon) for pk, (lat, lon, _) in self._points.items()]
+
+    def load(self, rows):
+        """Replace the whole index with ``(pk, latitude, longitude)`` rows."""
+        points, buckets = {}, {}
+        for pk, latitude, longitude in rows:
+            key = self._key(to_unit_vector(latitude, longitude))
+            points[pk] = (latitude, longitude, key)
+            buckets.setdefault(key, {})[pk] = (latitude, longitude)
+        with self._lock:
+            self._points, self._buckets = points, buckets
+
+    def nearest(self, latitude, longitude):
+        """Return ``(pk, distance_km)`` of the closest point, or ``None``."""
+        found = self.nearest_k(latitude, longitude, 1)
+        return found[0] if found else None
+
+    def nearest_k(self, latitude, longitude, k, exclude=(), max_km=None):
+        """Return up to ``k`` ``(pk, distance_km)`` pairs within ``max_km``, closest first."""
+        vector = to_unit_vector(latitude, longitude)
+        cell = self.cell
+        center = self._key(vector)
+        # Distance from the query to the closest face of its own cell.
+        margin = min(
+            min(v - c * cell, (c + 1) * cell - v)
+            for v, c in zip(vector, center)
+        )
+        # Max-heap (negated) of the best k (distance, pk) pairs seen so far.
+        best = []
+        with self._lock:
+            buckets = self._buckets
+            cx, cy, cz = center
+            r = 0
+            while buckets:
+                if _shell_size(r) > len(buckets):
+                    for (x, y, z), bucket in buckets.items():
+                        if max(abs(x - cx), abs(y - cy), abs(z - cz)) >= r:
+                            self._consider(best, k, bucket, latitude, longitude, exclude, max_km)
+                    break
+                for dx, dy, dz in _shell(r):
+                    bucket = buckets.get((cx + dx, cy + dy, cz + dz))
+                    if bucket:
+                        self._consider(best, k, bucket, latitude, longitude, exclude, max_km)
+                # Every unvisited cell is at least this far away.
+                reach = chord_to_km(r * cell + margin)
+                if len(best) == k and -best[0][0] < reach - 1e-9:
+                    break
+                if max_km is not None and reach > max_km:
+                    break
+                r += 1
+        return [(-pk, -distance) for distance, pk in sorted(best, reverse=True)]
+
+    @staticmethod
+    def _consider(best, k, bucket, latitude, longitude, exclude, max_km=None):
+        for pk, (lat, lon) in bucket.items():
+            if pk in exclude:
+                continue
+            distance = haversine(lat, lon, latitude, longitude)
+            if max_km is not None and distance > max_km:
+                continue
+            item = (-distance, -pk)
+            if len(best) < k:
+                heapq.heappush(best, item)
+            elif item > best[0]:
+                heapq.heapreplace(best, item)
+
+
+class PackedGridIndex:
+    """
+    Read-mostly index for millions of points, held in flat NumPy arrays.
+
+    Points are sorted by a ``cell_deg`` latitude/longitude cell, so the
+    points of one cell row within a longitude range form a contiguous slice
+    found with ``searchsorted``. A query ranks the points in the bounding
+    box of a search circle, growing the radius from ``start_km`` by
+    ``growth`` until ``k`` of them lie inside it: the in-memory twin of the
+    database dispatch search. It costs about 32 bytes per point, against a
+    few hundred for ``GridIndex``.
+
+    Writes land in a small ``GridIndex`` overlay, and the primary keys they
+    replace or delete are masked out of the arrays. The overlay is folded
+    into the arrays once it holds ``compact_after`` changes.
+    """
+
+    def __init__(self, cell_deg=0.01, start_km=0.5, growth=2.0, compact_after=10000):
+        self.cell_deg = cell_deg
+        self.cols = math.ceil(360 / cell_deg) + 1
+        self.start_km = start_km
+        self.growth = growth
+        self.compact_after = compact_after
+        self._overlay = GridIndex()
+        self._masked = set()
+        self._masked_array = None
+        self._lock = threading.RLock()
+        self._build(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+
+    def __len__(self):
+        with self._lock:
+            masked = self._masked_pks()
+            in_arrays = np.count_nonzero(np.isin(masked, self._pks)) if masked.size else 0
+            return self._pks.shape[0] - in_arrays + len(self._overlay)
+
+    def _cell_keys(self, latitudes, longitudes):
+        rows = np.floor((latitudes + 90.0) / self.cell_deg).astype(np.int64)
+        return rows * self.cols + np.floor((longitudes + 180.0) / self.cell_deg).astype(np.int64)
+
+    def _build(self, pks, latitudes, longitudes):
+        keys = self._cell_keys(latitudes, longitudes)
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self._pks = pks[order]
+        self._latitudes = latitudes[order]
+        self._longitudes = longitudes[order]
+
+    def load(self, rows):
+        """Replace the whole index with ``(pk, latitude, longitude)`` rows."""
+        flat = np.fromiter(chain.from_iterable(rows), dtype=np.float64).reshape(-1, 3)
+        with self._lock:
+            self._build(flat[:, 0].astype(np.int64), flat[:, 1].copy(), flat[:, 2].copy())
+            self._overlay.clear()
+            self._masked.clear()
+            self._masked_array = None
+
+    def insert(self, pk, latitude, longitude):
+        with self._lock:
+            self._mask(pk)
+            self._overlay.insert(pk, latitude, longitude)
+
+    def remove(self, pk):
+        with self._lock:
+            self._mask(pk)
+            self._overlay.remove(pk)
+
+    def _mask(self, pk):
+        if pk not in self._masked:
+            self._masked.add(pk)
+            self._masked_array = None
+            if len(self._masked) >= self.compact_after:
+                self.compact()
+
+    def _masked_pks(self):
+        if self._masked_array is None:
+            self._masked_array = np.fromiter(self._masked, dtype=np.int64, count=len(self._masked))
+        return self._masked_array
+
+    def compact(self):
+        """Fold the overlay into the arrays."""
+        with self._lock:
+            masked = self._masked_pks()
+            keep = ~np.isin(self._pks, masked) if masked.size else slice(None)
+            extra = np.array(self._overlay.items(), dtype=np.float64).reshape(-1, 3)
+            self._build(
+                np.concatenate([self._pks[keep], extra[:, 0].astype(np.int64)]),
+                np.concatenate([self._latitudes[keep], extra[:, 1]]),
+                np.concatenate([self._longitudes[keep], extra[:, 2]])
+            )
+            self._overlay.clear()
+            self._masked.clear()
+            self._masked_array = None
+
+    def nearest_k(self, latitude, longitude, k, max_km=None):
+        """Return up to ``k`` ``(pk, distance_km)`` pairs within ``max_km``, closest first."""
+        limit = math.pi * EARTH_RADIUS_KM if max_km is None else max_km
+        radius = min(self.start_km, limit)
+        with self._lock:
+            # The overlay's own k nearest are all it can contribute.
+            overlay = self._overlay.nearest_k(latitude, longitude, k) if len(self._overlay) else []
+            while True:
+                pks, distances = self._within(latitude, longitude, radius, overlay)
+                if pks.shape[0] >= k or radius >= limit:
+                    order = np.lexsort((pks, distances))[:k]
+                    return list(zip(pks[order].tolist(), distances[order].tolist()))
+                radius = min(radius * self.growth, limit)
+
+    def _within(self, latitude, longitude, radius, overlay):
+        min_lat, max_lat, lon_ranges = bounding_box(latitude, longitude, radius)
+        first, last = np.floor((np.array([min_lat, max_lat]) + 90.0) / self.cell_deg).astype(np.int64)
+        rows = np.arange(first, last + 1) * self.cols
+        starts, ends = [], []
+        for min_lon, max_lon in lon_ranges or [(-180.0, 180.0)]:
+            low, high = np.floor((np.array([min_lon, max_lon]) + 180.0) / self.cell_deg).astype(np.int64)
+            starts.append(rows + low)
+            ends.append(rows + high + 1)
+        starts = np.searchsorted(self._keys, np.concatenate(starts))
+        lengths = np.searchsorted(self._keys, np.concatenate(ends)) - starts
+        # Concatenated aranges of the [start, end) slices, without a Python loop.
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+        pks = self._pks[positions]
+        if self._masked:
+            keep = ~np.isin(pks, self._masked_pks())
+            positions, pks = positions[keep], pks[keep]
+        distances = haversine_distances(latitude, longitude, self._latitudes[positions], self._longitudes[positions])
+        inside = distances <= radius
+        pks, distances = pks[inside], distances[inside]
+        if overlay:
+            extra = [(pk, distance) for pk, distance in overlay if distance <= radius]
+            if extra:
+                extra_pks, extra_distances = zip(*extra)
+                pks = np.concatenate([pks, np.array(extra_pks, dtype=np.int64)])
+                distances = np.concatenate([distances, extra_distances])
+        return pks, distances
@@ -1,15 +1,63 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import permutations
+from unittest import mock, skipUnless
+
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import F
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.http import http_date
+from datetime import timedelta
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APITestCase
 from faker import Faker
 import math
+import numpy as np
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 
-from .models import Driver, Service, Address, calculate_haversine_distance
-from .serializers import ServiceSerializer 
+from .admission import SharedTokenBuckets, TokenBuckets
+from .assignment import linear_sum_assignment
+from .management.commands import seed_data
+from .authentication import token_cache
+from .cache import LRUCache
+from .conditional import response_cache
+from .eta import SpeedGrid, get_eta_engine
+from .events import event_bus, event_filter, position_event
+from .geocode import get_address_index, reload_address_index
+from .dispatch import (
+    ShardWorker, claim_nearest_available_driver, complete_service, dispatch_service, dispatch_services, get_driver_index,
+    reload_driver_index
+)
+from .geo import PointArray, haversine, haversine_distances
+from .idempotency import IdempotencyKeyInProgress, StoredResponse, idempotency_store
+from .ingest import location_buffer, parse_ping
+from .jobs import drain_jobs, enqueue_dispatch, job_pool, purge_jobs
+from .metrics import REGISTRY, Histogram
+from .replicas import ReplicaRouter, allow_replica_reads, current_state, replica_reads, sticky_clients
+from . import replicas
+from .schema import generate_schema, schema_cache
+from .middleware import AdmissionControlMiddleware
+from .models import Driver, DispatchJob, IdempotencyRecord, Service, Address, calculate_haversine_distance
+from .fast_serializers import driver_serializer, service_serializer
+from .renderers import FastJSONRenderer
+from .serializers import DriverSerializer, ServiceSerializer 
+from .shards import ShardMap, ShardRouter, serve
+from .views import completion_errors, nearby_driver_cache
+from .spatial import GridIndex, PackedGridIndex
 
 
 
@@ -57,6 +105,545 @@ class ModelTests(TestCase):
         self.assertAlmostEqual(calculated_distance, expected_distance_km, delta=0.5)
 
 
+class GeoTests(TestCase):
+
+    def setUp(self):
+        fake = Faker()
+        Faker.seed(42)
+        self.latitudes = [float(fake.latitude()) for _ in range(300)]
+        self.longitudes = [float(fake.longitude()) for _ in range(300)]
+        self.points = PointArray(self.latitudes, self.longitudes)
+
+    def scalar(self, latitude, longitude):
+        return [
+            calculate_haversine_distance(lat, lon, latitude, longitude)
+            for lat, lon in zip(self.latitudes, self.longitudes)
+        ]
+
+    def test_batch_matches_scalar(self):
+        distances = self.points.distances(40.7128, -74.0060)
+        expected = self.scalar(40.7128, -74.0060)
+        for got, want in zip(distances, expected):
+            self.assertAlmostEqual(got, want, places=6)
+        self.assertAlmostEqual(
+            haversine_distances(40.7128, -74.0060, [40.7580], [-73.9855])[0],
+            calculate_haversine_distance(40.7128, -74.0060, 40.7580, -73.9855),
+            places=9
+        )
+
+    def test_distance_matrix(self):
+        matrix = self.points.distance_matrix([0.0, 45.0], [0.0, 90.0])
+        self.assertEqual(matrix.shape, (2, 300))
+        for got, want in zip(matrix[1], self.scalar(45.0, 90.0)):
+            self.assertAlmostEqual(got, want, places=6)
+
+    def test_nearest_and_top_k(self):
+        expected = self.scalar(10.0, 10.0)
+        ranked = sorted(range(300), key=lambda i: (expected[i], i))
+
+        position, distance = self.points.nearest(10.0, 10.0)
+        self.assertEqual(position, ranked[0])
+        self.assertAlmostEqual(distance, expected[ranked[0]], places=6)
+
+        positions, distances = self.points.top_k(10.0, 10.0, 5)
+        self.assertEqual(list(positions), ranked[:5])
+        self.assertEqual(list(distances), sorted(distances))
+
+        positions, _ = self.points.nearest_many([10.0, -20.0], [10.0, 30.0])
+        self.assertEqual(positions[0], ranked[0])
+
+    def test_empty_points(self):
+        points = PointArray([], [])
+        self.assertIsNone(points.nearest(0.0, 0.0))
+        self.assertEqual(len(points.top_k(0.0, 0.0, 3)[0]), 0)
+
+
+class AssignmentTests(TestCase):
+
+    def brute_force(self, cost):
+        rows, cols = len(cost), len(cost[0])
+        if rows <= cols:
+            return min(sum(cost[i][p[i]] for i in range(rows)) for p in permutations(range(cols), rows))
+        return min(sum(cost[p[j]][j] for j in range(cols)) for p in permutations(range(rows), cols))
+
+    def test_matches_brute_force(self):
+        fake = Faker()
+        Faker.seed(3)
+        for rows, cols in [(1, 1), (3, 3), (2, 5), (5, 2), (4, 4), (5, 6)]:
+            cost = [[fake.pyfloat(min_value=0, max_value=100) for _ in range(cols)] for _ in range(rows)]
+            assigned_rows, assigned_cols = linear_sum_assignment(cost)
+            self.assertEqual(len(assigned_rows), min(rows, cols))
+            self.assertEqual(len(set(assigned_cols)), min(rows, cols))
+            total = sum(cost[r][c] for r, c in zip(assigned_rows, assigned_cols))
+            self.assertAlmostEqual(total, self.brute_force(cost))
+
+    def test_empty_matrix(self):
+        rows, cols = linear_sum_assignment([[]])
+        self.assertEqual(len(rows), 0)
+
+
+class GridIndexTests(TestCase):
+
+    def setUp(self):
+        self.fake = Faker()
+        Faker.seed(1234)
+        self.points = {
+            pk: (float(self.fake.latitude()), float(self.fake.longitude()))
+            for pk in range(1, 501)
+        }
+        self.index = GridIndex(cell_km=50)
+        self.index.load((pk, lat, lon) for pk, (lat, lon) in self.points.items())
+
+    def linear_scan(self, latitude, longitude):
+        return min(
+            (calculate_haversine_distance(lat, lon, latitude, longitude), pk)
+            for pk, (lat, lon) in self.points.items()
+        )
+
+    def test_nearest_matches_linear_scan(self):
+        for _ in range(200):
+            latitude, longitude = float(self.fake.latitude()), float(self.fake.longitude())
+            distance, pk = self.linear_scan(latitude, longitude)
+            self.assertEqual(self.index.nearest(latitude, longitude), (pk, distance))
+
+    def test_clustered_points_match_linear_scan(self):
+        # Flota concentrada en una ciudad, consultas cerca del centro
+        self.points = {
+            pk: (4.65 + self.fake.pyfloat(min_value=-0.2, max_value=0.2),
+                 -74.08 + self.fake.pyfloat(min_value=-0.2, max_value=0.2))
+            for pk in range(1, 2001)
+        }
+        self.index = GridIndex(cell_km=1)
+        self.index.load((pk, lat, lon) for pk, (lat, lon) in self.points.items())
+        for _ in range(200):
+            latitude = 4.65 + self.fake.pyfloat(min_value=-0.3, max_value=0.3)
+            longitude = -74.08 + self.fake.pyfloat(min_value=-0.3, max_value=0.3)
+            distance, pk = self.linear_scan(latitude, longitude)
+            self.assertEqual(self.index.nearest(latitude, longitude), (pk, distance))
+
+    def test_insert_and_remove(self):
+        self.index.insert(9999, 10.0, 10.0)
+        self.assertEqual(self.index.nearest(10.0, 10.0), (9999, 0.0))
+        self.index.insert(9999, -10.0, -10.0)
+        self.assertEqual(self.index.position(9999), (-10.0, -10.0))
+        self.index.remove(9999)
+        self.assertNotIn(9999, self.index)
+        self.assertEqual(len(self.index), 500)
+
+    def test_nearest_k_within_max_km(self):
+        for _ in range(50):
+            latitude, longitude = float(self.fake.latitude()), float(self.fake.longitude())
+            ranked = sorted(
+                (calculate_haversine_distance(lat, lon, latitude, longitude), pk)
+                for pk, (lat, lon) in self.points.items()
+            )
+            expected = [pk for distance, pk in ranked if distance <= 1500][:5]
+            found = self.index.nearest_k(latitude, longitude, 5, max_km=1500)
+            self.assertEqual([pk for pk, _ in found], expected)
+
+    def test_empty_index(self):
+        self.assertIsNone(GridIndex().nearest(0.0, 0.0))
+
+
+class PackedGridIndexTests(TestCase):
+
+    def setUp(self):
+        self.fake = Faker()
+        Faker.seed(4321)
+        self.points = {
+            pk: (4.65 + self.fake.pyfloat(min_value=-0.2, max_value=0.2),
+                 -74.08 + self.fake.pyfloat(min_value=-0.2, max_value=0.2))
+            for pk in range(1, 2001)
+        }
+        # Few points per compaction so the tests cover both paths.
+        self.index = PackedGridIndex(cell_deg=0.02, start_km=0.5, compact_after=50)
+        self.index.load((pk, lat, lon) for pk, (lat, lon) in self.points.items())
+
+    def linear_scan(self, latitude, longitude, k, max_km):
+        ranked = sorted(
+            (haversine(lat, lon, latitude, longitude), pk) for pk, (lat, lon) in self.points.items()
+        )
+        return [pk for distance, pk in ranked if distance <= max_km][:k]
+
+    def assert_matches_linear_scan(self):
+        for _ in range(100):
+            latitude = 4.65 + self.fake.pyfloat(min_value=-0.3, max_value=0.3)
+            longitude = -74.08 + self.fake.pyfloat(min_value=-0.3, max_value=0.3)
+            for k, max_km in ((1, None), (10, 3.0), (5, 0.2)):
+                found = self.index.nearest_k(latitude, longitude, k, max_km=max_km)
+                self.assertEqual(
+                    [pk for pk, _ in found], self.linear_scan(latitude, longitude, k, max_km or math.inf)
+                )
+
+    def test_matches_linear_scan(self):
+        self.assert_matches_linear_scan()
+
+    def test_edits_before_and_after_compaction(self):
+        for pk in range(1, 2001, 97):
+            del self.points[pk]
+            self.index.remove(pk)
+        for pk in list(range(2, 2001, 89)) + [5000, 5001]:
+            self.points[pk] = (4.65 + self.fake.pyfloat(min_value=-0.2, max_value=0.2), -74.08)
+            self.index.insert(pk, *self.points[pk])
+        self.assertEqual(len(self.index), len(self.points))
+        self.assert_matches_linear_scan()
+        self.index.compact()
+        self.assertEqual(len(self.index), len(self.points))
+        self.assert_matches_linear_scan()
+
+    def test_empty_index(self):
+        self.assertEqual(PackedGridIndex().nearest_k(0.0, 0.0, 3), [])
+
+
+class DriverIndexTests(TestCase):
+
+    def test_driver_saves_update_index(self):
+        index = get_driver_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            driver = Driver.objects.create(name="Indexed", current_latitude=1.0, current_longitude=1.0)
+        self.assertIn(driver.pk, index)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            driver.is_available = False
+            driver.save()
+        self.assertNotIn(driver.pk, index)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            driver.is_available = True
+            driver.save()
+            # Only once committed: until then concurrent dispatches cannot lock it.
+            self.assertNotIn(driver.pk, index)
+        self.assertIn(driver.pk, index)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            driver.delete()
+        self.assertNotIn(driver.pk, index)
+
+    def test_rolled_back_saves_leave_the_index_alone(self):
+        index = get_driver_index()
+        driver = Driver.objects.create(name="Busy", current_latitude=1.0, current_longitude=1.0, is_available=False)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            driver.is_available = True
+            driver.save()
+            raise RuntimeError
+        self.assertNotIn(driver.pk, index)
+
+    @override_settings(DISPATCH={'MODE': 'index'})
+    def test_stale_entries_are_skipped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            near = Driver.objects.create(name="Near", current_latitude=1.0, current_longitude=1.0)
+            far = Driver.objects.create(name="Far", current_latitude=5.0, current_longitude=5.0)
+        get_driver_index()
+        # Una actualización masiva no dispara señales
+        Driver.objects.filter(pk=near.pk).update(is_available=False)
+
+        with transaction.atomic():
+            driver, distance = claim_nearest_available_driver(1.0, 1.0)
+        self.assertEqual(driver, far)
+        self.assertNotIn(near.pk, get_driver_index())
+
+    @override_settings(DISPATCH={'MODE': 'index'})
+    def test_stale_entries_are_replaced_in_batches(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            near = Driver.objects.create(name="Near", current_latitude=1.0, current_longitude=1.0)
+            far = Driver.objects.create(name="Far", current_latitude=5.0, current_longitude=5.0)
+        get_driver_index()
+        Driver.objects.filter(pk=near.pk).update(is_available=False)
+
+        # With one pickup the pool only holds its nearest indexed driver.
+        [service] = dispatch_services([(1.0, 1.0)])
+        self.assertEqual(service.status, Service.StatusChoices.ASSIGNED)
+        self.assertEqual(service.assigned_driver, far)
+        self.assertNotIn(near.pk, get_driver_index())
+
+
+class ShardTests(TestCase):
+
+    def test_shard_map(self):
+        shard_map = ShardMap(precision=5, workers=3)
+        self.assertEqual(shard_map.geohash(shard_map.cell(57.64911, 10.40744)), 'u4pru')
+        self.assertEqual(shard_map.geohash(shard_map.cell(-90.0, -180.0)), '00000')
+        self.assertEqual(shard_map.geohash(shard_map.cell(90.0, 180.0)), 'zzzzz')
+        cell = shard_map.cell(0.0, 179.99)
+        self.assertIn(shard_map.cell(0.0, -179.99), shard_map.neighbors(cell))
+        self.assertEqual(len(shard_map.neighbors(shard_map.cell(90.0, 0.0))), 5)
+        self.assertEqual(
+            shard_map.cells([57.64911, 0.0], [10.40744, 179.99]).tolist(),
+            [row * shard_map.cols + col for row, col in (shard_map.cell(57.64911, 10.40744), cell)]
+        )
+        owners = [shard_map.owner(shard_map.cell(latitude, 0.0)) for latitude in range(-80, 81, 10)]
+        self.assertEqual(owners, [ShardMap(5, 3).owner(shard_map.cell(latitude, 0.0)) for latitude in range(-80, 81, 10)])
+        self.assertEqual(set(owners), {0, 1, 2})
+        # Cells of precision 5 are about 4.9 km tall and 4.9 km wide at the equator.
+        self.assertAlmostEqual(shard_map.reach_km(cell), 4.89, places=2)
+        self.assertLess(shard_map.reach_km(shard_map.cell(60.0, 0.0)), 2.5)
+
+    def test_worker_keeps_its_region_and_falls_back(self):
+        shard_map = ShardMap(precision=4, workers=2)
+        here = shard_map.cell(4.6, -74.1)
+        worker = ShardWorker(shard_map, shard_map.owner(here))
+        near = Driver.objects.create(name="Near", current_latitude=4.61, current_longitude=-74.1)
+        far = Driver.objects.create(name="Far", current_latitude=40.0, current_longitude=-3.7)
+        worker.reload()
+        self.assertIn(near.pk, worker.index)
+        self.assertEqual(far.pk in worker.index, worker.keeps(shard_map.cell(40.0, -3.7)))
+
+        service = worker.dispatch(4.6, -74.1)
+        self.assertEqual(service.assigned_driver, near)
+        self.assertNotIn(near.pk, worker.index)
+        # No driver within the neighbour cells: the database search finds the far one.
+        self.assertEqual(worker.dispatch(4.6, -74.1).assigned_driver, far)
+        self.assertEqual(worker.dispatch(4.6, -74.1).status, Service.StatusChoices.PENDING)
+
+    def test_router(self):
+        class EchoWorker:
+            def dispatch(self, latitude, longitude):
+                if latitude > 90:
+                    raise ValueError('latitude')
+                return latitude, longitude, threading.current_thread().name
+
+        router = ShardRouter([self.serve(EchoWorker())], precision=4, authkey=b'key')
+        first = router.dispatch(1.0, 2.0, fallback=None)
+        self.assertEqual(first[:2], (1.0, 2.0))
+        self.assertEqual(router.dispatch(3.0, 4.0, fallback=None)[2], first[2])
+        with self.assertRaisesMessage(ValueError, 'latitude'):
+            router.dispatch(91.0, 0.0, fallback=None)
+
+        unreachable = ShardRouter(['/nonexistent/worker.sock'], authkey=b'key')
+        self.assertEqual(unreachable.dispatch(1.0, 2.0, fallback=lambda *pickup: pickup), (1.0, 2.0))
+
+    def serve(self, worker):
+        bound = []
+        ready = threading.Event()
+
+        def on_ready(address):
+            bound.append(address)
+            ready.set()
+        threading.Thread(target=serve, args=(worker, ('127.0.0.1', 0), b'key', on_ready), daemon=True).start()
+        self.assertTrue(ready.wait(5))
+        return bound[0]
+
+    def test_worker_writes_are_recorded_here(self):
+        driver = Driver(pk=7, name="Remote", current_latitude=1.0, current_longitude=1.0, is_available=False)
+        stored = Service(
+            pk=11, customer_pickup_latitude=1.0, customer_pickup_longitude=1.0,
+            assigned_driver=driver, status=Service.StatusChoices.ASSIGNED
+        )
+
+        class StoredWorker:
+            def dispatch(self, latitude, longitude):
+                return stored
+
+        host, port = self.serve(StoredWorker())
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def subscribe():
+            return event_bus.subscribe()
+        subscription = loop.run_until_complete(subscribe())
+        self.addCleanup(subscription.close)
+
+        with override_settings(DISPATCH_SHARDS={'WORKERS': [f'{host}:{port}'], 'AUTHKEY': 'key'}):
+            token = replicas.enter('remote-client')
+            try:
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.assertEqual(dispatch_service(1.0, 1.0).pk, stored.pk)
+            finally:
+                replicas.leave(token)
+        # The worker's own event bus has no subscribers, and the router saw no write.
+        self.assertIn('remote-client', sticky_clients)
+        events, _ = loop.run_until_complete(subscription.get(0))
+        self.assertEqual([(event['type'], event['id']) for event in events], [('service', 11), ('driver', 7)])
+
+    def test_unreachable_workers_dispatch_locally(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            driver = Driver.objects.create(name="Local", current_latitude=1.0, current_longitude=1.0)
+        with override_settings(DISPATCH_SHARDS={'WORKERS': ['/nonexistent/worker.sock']}):
+            self.assertEqual(dispatch_service(1.0, 1.0).assigned_driver, driver)
+
+
+class DispatchModeTests(TestCase):
+
+    def setUp(self):
+        fake = Faker()
+        Faker.seed(7)
+        Driver.objects.bulk_create(
+            Driver(
+                name=fake.name(),
+                current_latitude=float(fake.latitude()),
+                current_longitude=float(fake.longitude()),
+                is_available=fake.pybool()
+            )
+            for _ in range(200)
+        )
+        # Conductores a ambos lados del antimeridiano
+        Driver.objects.create(name="East", current_latitude=0.0, current_longitude=179.9)
+        Driver.objects.create(name="West", current_latitude=0.0, current_longitude=-179.95)
+        self.queries = [(float(fake.latitude()), float(fake.longitude())) for _ in range(25)]
+        self.queries += [(0.0, 179.99), (0.0, -179.99), (89.9, 0.0)]
+
+    def linear_scan(self, latitude, longitude):
+        return min(
+            (calculate_haversine_distance(d.current_latitude, d.current_longitude, latitude, longitude), d.pk)
+            for d in Driver.objects.filter(is_available=True)
+        )
+
+    def assert_mode_matches_scan(self, mode):
+        with override_settings(DISPATCH={'MODE': mode, 'SEARCH_RADIUS_KM': 1.0}):
+            get_driver_index().load(
+                Driver.objects.filter(is_available=True).values_list('pk', 'current_latitude', 'current_longitude')
+            )
+            for latitude, longitude in self.queries:
+                distance, pk = self.linear_scan(latitude, longitude)
+                with transaction.atomic():
+                    driver, found_distance = claim_nearest_available_driver(latitude, longitude)
+                self.assertEqual(driver.pk, pk)
+                self.assertEqual(found_distance, distance)
+                self.assertFalse(Driver.objects.get(pk=pk).is_available)
+
+    def test_index_mode(self):
+        self.assert_mode_matches_scan('index')
+
+    def test_scan_mode(self):
+        self.assert_mode_matches_scan('scan')
+
+    def test_database_mode(self):
+        self.assert_mode_matches_scan('database')
+
+    @override_settings(DISPATCH={'MODE': 'database'})
+    def test_database_mode_without_drivers(self):
+        Driver.objects.update(is_available=False)
+        with transaction.atomic():
+            self.assertEqual(claim_nearest_available_driver(10.0, 10.0), (None, None))
+
+    @override_settings(DISPATCH={'MODE': 'nearest'})
+    def test_unknown_mode(self):
+        with self.assertRaises(ImproperlyConfigured):
+            claim_nearest_available_driver(10.0, 10.0)
+
+
+class FastSerializerTests(TestCase):
+
+    def setUp(self):
+        self.driver = Driver.objects.create(
+            name="Zoë \u2028 Driver", current_latitude=4.6097100, current_longitude=-74.08175,
+            location_updated_at=timezone.now()
+        )
+        self.assigned = Service.objects.create(
+            customer_pickup_latitude=4.61, customer_pickup_longitude=-74.1,
+            assigned_driver=self.driver, status=Service.StatusChoices.ASSIGNED,
+            estimated_arrival_time=timezone.now() + timedelta(minutes=7)
+        )
+        self.pending = Service.objects.create(customer_pickup_latitude=1e-7, customer_pickup_longitude=180.0)
+
+    def assert_same_bytes(self, drf_data, fast_data):
+        self.assertEqual(JSONRenderer().render(drf_data), FastJSONRenderer().render(fast_data))
+
+    def test_instances_match_drf(self):
+        for service in (self.assigned, self.pending, Service.objects.get(pk=self.assigned.pk)):
+            self.assert_same_bytes(ServiceSerializer(service).data, service_serializer.to_representation(service))
+        self.assert_same_bytes(DriverSerializer(self.driver).data, driver_serializer.to_representation(self.driver))
+
+    def test_values_match_drf(self):
+        services = Service.objects.select_related('assigned_driver').order_by('pk')
+        self.assert_same_bytes(
+            ServiceSerializer(services, many=True).data,
+            service_serializer.from_values(service_serializer.values(services))
+        )
+
+    def test_list_endpoint_unchanged(self):
+        user = User.objects.create_user(username='fast', password='fast')
+        client = APIClient()
+        client.force_authenticate(user)
+        with override_settings(FAST_SERIALIZATION=False):
+            expected = client.get(reverse('service-list'), HTTP_ACCEPT='application/json').content
+        self.assertEqual(client.get(reverse('service-list'), HTTP_ACCEPT='application/json').content, expected)
+
+
+class SeedDataTests(TestCase):
+
+    def test_seeds_clustered_rows(self):
+        Driver.objects.create(name="Old", current_latitude=0.0, current_longitude=0.0)
+        call_command('seed_data', addresses=30, drivers=200, services=300, chunk_size=64, seed=7, stdout=io.StringIO())
+
+        self.assertEqual((Address.objects.count(), Driver.objects.count(), Service.objects.count()), (30, 200, 300))
+        self.assertFalse(Driver.objects.filter(name="Old").exists())
+        # Every driver lies within ~100 km of one of the seeded cities.
+        cities = [(city[2], city[3]) for city in seed_data.CITIES]
+        for driver in Driver.objects.all():
+            nearest = min(haversine(driver.current_latitude, driver.current_longitude, lat, lon) for lat, lon in cities)
+            self.assertLess(nearest, 100)
+        completed = Service.objects.filter(status=Service.StatusChoices.COMPLETED)
+        self.assertFalse(completed.filter(assigned_driver__isnull=True).exists())
+        self.assertFalse(completed.filter(completion_time__lte=F('request_time')).exists())
+        self.assertFalse(completed.filter(pickup_distance_km__isnull=True).exists())
+        self.assertFalse(Service.objects.filter(status=Service.StatusChoices.PENDING, assigned_driver__isnull=False).exists())
+
+
+class ETATests(TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'grid.bin')
+        self.addCleanup(lambda: os.path.exists(self.path) and os.unlink(self.path))
+
+    def _completed(self, latitude, longitude, distance_km, requested, minutes):
+        service = Service.objects.create(
+            customer_pickup_latitude=latitude, customer_pickup_longitude=longitude,
+            status=Service.StatusChoices.COMPLETED, pickup_distance_km=distance_km,
+            completion_time=requested + timedelta(minutes=minutes)
+        )
+        Service.objects.filter(pk=service.pk).update(request_time=requested)
+
+    def test_grid_file_round_trip(self):
+        speeds = np.arange(2 * 3 * 24, dtype=np.float32).reshape(2, 3, 24)
+        SpeedGrid(4.0, -75.0, 0.5, speeds, range(24), services=10).save(self.path)
+        grid = SpeedGrid.open(self.path)
+        self.assertEqual((grid.rows, grid.cols, grid.meta), (2, 3, {'services': 10}))
+        self.assertEqual(grid.cell(4.6, -74.1), (1, 1))
+        self.assertEqual(grid.speed((1, 1), 5), speeds[1, 1, 5])
+        self.assertEqual(grid.speed((7, 0), 5), 5.0)  # Outside: hourly speed
+
+    def test_refresh_builds_speeds_per_cell_and_hour(self):
+        rush = timezone.now().replace(hour=13, minute=0) - timedelta(days=1)
+        for _ in range(3):
+            self._completed(4.61, -74.08, 10.0, rush, 60)  # 10 km/h
+            self._completed(4.61, -74.08, 10.0, rush - timedelta(hours=8), 15)  # 40 km/h
+            self._completed(6.25, -75.58, 10.0, rush, 20)  # 30 km/h
+        call_command('refresh_eta_grid', output=self.path, min_samples=3, stdout=io.StringIO())
+
+        with override_settings(ETA={'GRID_PATH': self.path}):
+            engine = get_eta_engine()
+            self.assertAlmostEqual(engine.speed(4.61, -74.08, 4.62, -74.09, rush), 10.0, places=4)
+            self.assertAlmostEqual(engine.speed(4.61, -74.08, 4.61, -74.08, rush - timedelta(hours=8)), 40.0, places=4)
+            self.assertAlmostEqual(engine.speed(4.61, -74.08, 6.25, -75.58, rush), 20.0, places=4)
+            # No data at this hour anywhere: default speed.
+            self.assertEqual(engine.speed(4.61, -74.08, 4.61, -74.08, rush + timedelta(hours=5)), 40.0)
+            # Outside the grid: the city-wide speed of the hour, 60 km / 4 h.
+            self.assertAlmostEqual(engine.travel_time(0, 0, 0, 0, distance_km=5.0, when=rush).total_seconds(), 1200)
+            # Same cells and hour: memoized.
+            engine.speed(4.62, -74.09, 4.61, -74.08, rush)
+            self.assertEqual(engine.cache.stats()['hits'], 1)
+
+    def test_implausibly_slow_speeds_fall_back(self):
+        rush = timezone.now().replace(hour=13, minute=0) - timedelta(days=1)
+        for _ in range(3):
+            self._completed(4.61, -74.08, 2.0, rush, 60)  # 2 km/h: mostly waiting
+            self._completed(6.25, -75.58, 30.0, rush, 30)  # 60 km/h
+            self._completed(4.61, -74.08, 2.0, rush - timedelta(hours=8), 60)
+        call_command('refresh_eta_grid', output=self.path, min_samples=3, stdout=io.StringIO())
+
+        with override_settings(ETA={'GRID_PATH': self.path}):
+            engine = get_eta_engine()
+            # The city-wide speed of the hour, 96 km / 4.5 h, not the 10 km/h floor.
+            self.assertAlmostEqual(engine.speed(4.61, -74.08, 4.61, -74.08, rush), 96 / 4.5, places=4)
+            # The whole hour is too slow: default speed.
+            self.assertEqual(engine.speed(4.61, -74.08, 4.61, -74.08, rush - timedelta(hours=8)), 40.0)
+
+    def test_without_grid_uses_default_speed(self):
+        with override_settings(ETA={'GRID_PATH': self.path, 'DEFAULT_SPEED_KPH': 30.0}):
+            self.assertEqual(get_eta_engine().travel_time(0, 0, 0, 0, distance_km=15.0), timedelta(minutes=30))
+
+
 class AuthenticatedAPITestCase(APITestCase):
     """Base class for API tests that require authentication."""
     def setUp(self):
@@ -69,15 +656,18 @@ class AuthenticatedAPITestCase(APITestCase):
         self.token = Token.objects.create(user=self.test_user)
         # Setear el token en las credenciales del cliente
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        # Rows written by earlier tests were rolled back without bumping versions.
+        response_cache.clear()
 
 class ServiceAPITests(AuthenticatedAPITestCase):
 
     def setUp(self):
         super().setUp()
         # Create conductores de prueba
-        self.driver1 = Driver.objects.create(name="Driver One", current_latitude=10.0, current_longitude=10.0, is_available=True)
-        self.driver2 = Driver.objects.create(name="Driver Two", current_latitude=50.0, current_longitude=50.0, is_available=True)
-        self.driver3 = Driver.objects.create(name="Driver Three", current_latitude=10.1, current_longitude=10.1, is_available=False) # Unavailable
+        with self.captureOnCommitCallbacks(execute=True):
+            self.driver1 = Driver.objects.create(name="Driver One", current_latitude=10.0, current_longitude=10.0, is_available=True)
+            self.driver2 = Driver.objects.create(name="Driver Two", current_latitude=50.0, current_longitude=50.0, is_available=True)
+            self.driver3 = Driver.objects.create(name="Driver Three", current_latitude=10.1, current_longitude=10.1, is_available=False) # Unavailable
 
     def test_request_service_success(self):
         """Test requesting a service finds the nearest available driver."""
@@ -106,9 +696,12 @@ class ServiceAPITests(AuthenticatedAPITestCase):
         data = {"latitude": 20.0, "longitude": 20.0}
         response = self.client.post(url, data, format='json')
 
-        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(Service.objects.count(), 0)
-        self.assertIn("No available drivers", response.data['message'])
+        # Queued instead of rejected: the next released driver takes it
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        service = Service.objects.get()
+        self.assertEqual(service.status, Service.StatusChoices.PENDING)
+        self.assertIsNone(service.assigned_driver)
+        self.assertEqual(response.data['id'], service.pk)
 
     def test_request_service_invalid_coordinates(self):
         """Test requesting a service with invalid latitude/longitude."""
@@ -166,7 +759,7 @@ class ServiceAPITests(AuthenticatedAPITestCase):
         response = self.client.patch(url, data, format='json')
         
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertIn('Service must be in ASSIGNED state', str(response.data))
+        self.assertIn('El servicio debe estar en estado ASIGNADO', str(response.data))
         service.refresh_from_db()
         self.assertEqual(service.status, Service.StatusChoices.PENDING) # El estado no debería cambiar
 
@@ -180,6 +773,750 @@ class ServiceAPITests(AuthenticatedAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
+class AsyncServiceAPITests(AuthenticatedAPITestCase):
+    """The async views answer exactly like their DRF counterparts."""
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.driver = Driver.objects.create(name="Async", current_latitude=10.0, current_longitude=10.0)
+
+    def test_request_and_complete_service(self):
+        response = self.client.post(reverse('async-request-service'), {"latitude": 10.01, "longitude": 10.01}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        service = Service.objects.get()
+        self.assertEqual(response.json(), service_serializer.to_representation(service))
+        self.assertEqual(service.assigned_driver, self.driver)
+
+        url = reverse('async-complete-service', kwargs={'pk': service.pk})
+        response = self.client.patch(url, {"status": "COMPLETED"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['status'], Service.StatusChoices.COMPLETED)
+        self.driver.refresh_from_db()
+        self.assertTrue(self.driver.is_available)
+
+    def test_errors_match_sync_views(self):
+        pending = Service.objects.create(customer_pickup_latitude=0.0, customer_pickup_longitude=0.0)
+        cases = [
+            ('request-service', {}, 'post', {"latitude": 95.0, "longitude": -200.0}),
+            ('complete-service', {'pk': pending.pk}, 'patch', {"status": "COMPLETED"}),
+            ('complete-service', {'pk': pending.pk}, 'patch', {"status": "PENDING"}),
+            ('complete-service', {'pk': 999999}, 'patch', {"status": "COMPLETED"}),
+        ]
+        for name, kwargs, method, data in cases:
+            expected = getattr(self.client, method)(reverse(name, kwargs=kwargs), data, format='json')
+            response = getattr(self.client, method)(reverse('async-' + name, kwargs=kwargs), data, format='json')
+            self.assertEqual((response.status_code, response.json()), (expected.status_code, expected.json()))
+
+    def test_requires_token(self):
+        self.client.credentials()
+        response = self.client.post(reverse('async-request-service'), {"latitude": 0, "longitude": 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+        self.client.credentials(HTTP_AUTHORIZATION='Token invalid')
+        response = self.client.post(reverse('async-request-service'), {"latitude": 0, "longitude": 0}, format='json')
+        self.assertEqual(response.json(), {'detail': 'Invalid token.'})
+
+    @override_settings(DISPATCH={'PENDING_POLL_INTERVAL': 0.01})
+    def test_wait_on_pending_service(self):
+        pending = Service.objects.create(customer_pickup_latitude=0.0, customer_pickup_longitude=0.0)
+        url = reverse('async-service-status', kwargs={'pk': pending.pk})
+        response = self.client.get(url, {'wait': 0.05})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['status'], Service.StatusChoices.PENDING)
+        self.assertEqual(self.client.get(url, {'wait': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'wait': 'nan'}).status_code, status.HTTP_400_BAD_REQUEST)
+        missing = reverse('async-service-status', kwargs={'pk': 999999})
+        self.assertEqual(self.client.get(missing).status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(DISPATCH_JOBS={'THREADS': 0})
+class QueuedDispatchTests(AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.driver = Driver.objects.create(name="Queued", current_latitude=3.0, current_longitude=3.0)
+        # Entries left by other tests must not crowd the one-pickup pool.
+        reload_driver_index()
+
+    def test_prefer_respond_async(self):
+        response = self.client.post(
+            reverse('request-service'), {"latitude": 3.01, "longitude": 3.01}, format='json',
+            HTTP_PREFER='respond-async'
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response['Preference-Applied'], 'respond-async')
+        self.assertEqual((response.data['status'], response.data['service']), ('QUEUED', None))
+        self.assertFalse(Service.objects.exists())
+
+        self.assertEqual(drain_jobs(), 1)
+        self.assertEqual(drain_jobs(), 0)
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.data['status'], 'DONE')
+        self.assertEqual(response.data['service']['assigned_driver']['id'], self.driver.pk)
+
+    def test_queued_mode_batches_requests(self):
+        with override_settings(DISPATCH_JOBS={'MODE': 'queued', 'THREADS': 0}):
+            self.client.post(reverse('request-service'), {"latitude": 3.0, "longitude": 3.0}, format='json')
+            response = self.client.post(
+                reverse('async-request-service'), {"latitude": 3.02, "longitude": 3.02}, format='json'
+            )
+            invalid = self.client.post(reverse('request-service'), {"latitude": 95.0, "longitude": 3.0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertNotIn('Preference-Applied', response)
+        self.assertEqual(invalid.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(drain_jobs(), 2)
+        statuses = dict(DispatchJob.objects.values_list('service__status', 'pickup_latitude'))
+        self.assertEqual(statuses, {Service.StatusChoices.ASSIGNED: 3.0, Service.StatusChoices.PENDING: 3.02})
+
+    def test_failed_batch(self):
+        job = DispatchJob.objects.create(pickup_latitude=3.0, pickup_longitude=3.0)
+        with mock.patch('api.jobs.dispatch_services', side_effect=RuntimeError('boom')):
+            self.assertEqual(drain_jobs(), 1)
+        response = self.client.get(reverse('dispatch-job', kwargs={'pk': job.pk}))
+        self.assertEqual((response.data['status'], response.data['error']), ('FAILED', 'RuntimeError: boom'))
+        self.assertFalse(Service.objects.exists())
+
+    def test_purge_and_missing_job(self):
+        old = DispatchJob.objects.create(
+            pickup_latitude=0.0, pickup_longitude=0.0, finished_at=timezone.now() - timedelta(days=2)
+        )
+        queued = DispatchJob.objects.create(pickup_latitude=0.0, pickup_longitude=0.0)
+        self.assertEqual(purge_jobs(), 1)
+        self.assertEqual(list(DispatchJob.objects.values_list('pk', flat=True)), [queued.pk])
+        response = self.client.get(reverse('dispatch-job', kwargs={'pk': old.pk}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class DispatchJobPoolTests(TransactionTestCase):
+
+    @override_settings(DISPATCH_JOBS={'THREADS': 1, 'POLL_INTERVAL': 0.05})
+    def test_pool_drains_queue(self):
+        self.addCleanup(job_pool.stop)
+        Driver.objects.create(name="Pool", current_latitude=1.0, current_longitude=1.0)
+        job = enqueue_dispatch(1.0, 1.0)
+        self.assertEqual(len(job_pool), 1)
+        for _ in range(100):
+            job.refresh_from_db()
+            if job.status != DispatchJob.StatusChoices.QUEUED:
+                break
+            time.sleep(0.05)
+        self.assertEqual(job.status, DispatchJob.StatusChoices.DONE)
+        self.assertEqual(job.service.status, Service.StatusChoices.ASSIGNED)
+
+
+class IdempotencyTests(AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        idempotency_store.cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.driver = Driver.objects.create(name="Once", current_latitude=5.0, current_longitude=5.0)
+            Driver.objects.create(name="Twice", current_latitude=5.1, current_longitude=5.1)
+
+    def post(self, key, data=None, name='request-service', **extra):
+        data = data or {"latitude": 5.0, "longitude": 5.0}
+        return self.client.post(reverse(name), data, format='json', HTTP_IDEMPOTENCY_KEY=key, **extra)
+
+    def test_retry_replays_first_response(self):
+        first = self.post('retry-1')
+        second = self.post('retry-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((second.status_code, second.json()), (first.status_code, first.json()))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Service.objects.count(), 1)
+        self.assertEqual(Driver.objects.filter(is_available=False).count(), 1)
+
+        self.assertEqual(self.post('retry-2').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Service.objects.count(), 2)
+
+    def test_key_reused_for_another_request(self):
+        self.post('reused')
+        response = self.post('reused', {"latitude": 5.5, "longitude": 5.5})
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(self.post('', name='request-service').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_keys_are_per_user_and_endpoint(self):
+        self.post('shared')
+        other = User.objects.create_user(username='other', password='other')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=other).key)
+        self.assertNotIn('Idempotent-Replayed', self.post('shared'))
+        response = self.post('shared', name='async-request-service')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.post('shared', name='async-request-service').json(), response.json())
+        self.assertEqual(Service.objects.count(), 3)
+
+    def test_database_store(self):
+        with override_settings(IDEMPOTENCY={'DATABASE': True}):
+            first = self.post('db')
+            # Another worker process: nothing in its LRU.
+            idempotency_store.cache.clear()
+            second = self.post('db')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        record = IdempotencyRecord.objects.get()
+        self.assertEqual(record.status_code, status.HTTP_201_CREATED)
+        self.assertGreater(record.expires_at, timezone.now() + timedelta(hours=23))
+
+    def test_duplicates_wait_for_the_first(self):
+        stored = StoredResponse('fp', 201, b'{}', {})
+        self.assertIsNone(idempotency_store.acquire('key', 'fp'))
+        with self.assertRaises(IdempotencyKeyInProgress):
+            idempotency_store.acquire('key', 'fp', timeout=0.01)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            waiting = pool.submit(idempotency_store.acquire, 'key', 'fp', 5)
+            idempotency_store.complete('key', stored)
+            self.assertEqual(waiting.result(), stored)
+
+        self.assertIsNone(idempotency_store.acquire('released', 'fp'))
+        idempotency_store.release('released')
+        self.assertIsNone(idempotency_store.acquire('released', 'fp'))
+        idempotency_store.release('released')
+
+
+class AdmissionControlTests(AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            Driver.objects.create(name="Admitted", current_latitude=6.0, current_longitude=6.0)
+        self.url = reverse('request-service')
+        self.data = {"latitude": 6.0, "longitude": 6.0}
+
+    def test_token_bucket(self):
+        now = [0.0]
+        buckets = TokenBuckets(rate=2, burst=2, maxsize=2, clock=lambda: now[0])
+        self.assertEqual([buckets.take('a'), buckets.take('a')], [0, 0])
+        self.assertAlmostEqual(buckets.take('a'), 0.5)
+        now[0] = 0.5
+        self.assertEqual(buckets.take('a'), 0)
+        self.assertEqual(buckets.take('b'), 0)
+        buckets.take('c')
+        self.assertEqual(list(buckets._buckets), ['b', 'c'])
+
+        shared = SharedTokenBuckets(rate=2, burst=2, alias='default', clock=lambda: 10.25)
+        self.assertEqual([shared.take('a'), shared.take('a'), shared.take('b')], [0, 0, 0])
+        self.assertAlmostEqual(shared.take('a'), 0.75)
+
+    @override_settings(ADMISSION={'VIEWS': ['request-service'], 'RATE': 0.5, 'BURST': 2})
+    def test_rate_limit_per_user(self):
+        # Verify the token first: until then the request counts against its address.
+        self.assertEqual(self.client.get(reverse('driver-list')).status_code, status.HTTP_200_OK)
+        statuses = [self.client.post(self.url, self.data, format='json').status_code for _ in range(3)]
+        self.assertEqual(
+            statuses, [status.HTTP_201_CREATED, status.HTTP_202_ACCEPTED, status.HTTP_429_TOO_MANY_REQUESTS]
+        )
+        response = self.client.post(self.url, self.data, format='json')
+        self.assertEqual(response['Retry-After'], '2')
+        # Other views and other tokens are not limited.
+        self.assertEqual(self.client.get(reverse('driver-list')).status_code, status.HTTP_200_OK)
+        other = User.objects.create_user(username='other', password='other')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=other).key)
+        self.assertEqual(self.client.post(self.url, self.data, format='json').status_code, status.HTTP_202_ACCEPTED)
+        self.assertIn('api_admission_total{view="request-service",outcome="rate_limited"}', REGISTRY.render())
+
+    @override_settings(ADMISSION={'VIEWS': ['request-service'], 'RATE': 0.5, 'BURST': 2})
+    def test_unverified_tokens_are_limited_by_address(self):
+        statuses = []
+        for i in range(3):
+            self.client.credentials(HTTP_AUTHORIZATION=f'Token bogus{i}')
+            statuses.append(self.client.post(self.url, self.data, format='json').status_code)
+        self.assertEqual(
+            statuses, [status.HTTP_401_UNAUTHORIZED, status.HTTP_401_UNAUTHORIZED, status.HTTP_429_TOO_MANY_REQUESTS]
+        )
+        # Another address has its own bucket.
+        response = self.client.post(self.url, self.data, format='json', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(ADMISSION={'VIEWS': ['request-service'], 'MAX_QUEUE_TIME': 0.5})
+    def test_sheds_requests_that_queued_too_long(self):
+        start = timezone.now().timestamp()
+        response = self.client.post(self.url, self.data, format='json', HTTP_X_REQUEST_START=f't={start - 2:.3f}')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        response = self.client.post(self.url, self.data, format='json', HTTP_X_REQUEST_START=str(int(start * 1000)))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    @override_settings(ADMISSION={'VIEWS': ['request-service'], 'MAX_CONCURRENCY': 1, 'MAX_QUEUE_TIME': 0.05})
+    def test_concurrency_cap(self):
+        middleware = AdmissionControlMiddleware(lambda request: JSONRenderer().render({}))
+        request = RequestFactory().post(self.url)
+        self.assertTrue(middleware.slots.acquire(0))
+        self.assertEqual(middleware(request).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        middleware.slots.release()
+        self.assertEqual(middleware(request), b'{}')
+        self.assertEqual(middleware.slots.active, 0)
+
+
+class BatchServiceAPITests(AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('request-service-batch')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.driver_a = Driver.objects.create(name="A", current_latitude=0.0, current_longitude=0.0)
+            self.driver_b = Driver.objects.create(name="B", current_latitude=0.0, current_longitude=2.0)
+
+    def test_batch_minimizes_total_distance(self):
+        # Uno a uno, la primera solicitud tomaría a A y dejaría a la segunda lejos
+        data = [
+            {"latitude": 0.0, "longitude": 0.9},
+            {"latitude": 0.0, "longitude": -0.1},
+        ]
+        response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], [201, 201])
+        self.assertEqual(results[0]['service']['assigned_driver']['id'], self.driver_b.pk)
+        self.assertEqual(results[1]['service']['assigned_driver']['id'], self.driver_a.pk)
+        self.assertFalse(Driver.objects.filter(is_available=True).exists())
+        self.assertEqual(Service.objects.filter(status=Service.StatusChoices.ASSIGNED).count(), 2)
+
+    def test_batch_partial_failures(self):
+        data = [
+            {"latitude": 0.0, "longitude": 0.1},
+            {"latitude": 95.0, "longitude": 0.0},
+            {"latitude": 0.0, "longitude": 1.9},
+            {"latitude": 0.0, "longitude": 1.0},
+        ]
+        response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], [201, 400, 201, 202])
+        self.assertIn('latitude', results[1]['errors'])
+        self.assertEqual(results[3]['service']['status'], Service.StatusChoices.PENDING)
+        self.assertEqual(Service.objects.filter(status=Service.StatusChoices.ASSIGNED).count(), 2)
+        self.assertEqual(Service.objects.filter(status=Service.StatusChoices.PENDING).count(), 1)
+
+    def test_batch_requires_list(self):
+        response = self.client.post(self.url, {"latitude": 0.0, "longitude": 0.0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PendingQueueTests(AuthenticatedAPITestCase):
+    """Requests queued as PENDING are served as soon as a driver is released."""
+
+    def setUp(self):
+        super().setUp()
+        self.busy = Driver.objects.create(name="Busy", current_latitude=0.0, current_longitude=0.0, is_available=False)
+        self.running = Service.objects.create(
+            customer_pickup_latitude=0.0, customer_pickup_longitude=0.0,
+            assigned_driver=self.busy, status=Service.StatusChoices.ASSIGNED
+        )
+        self.first = self._request(0.0, 1.0)
+        self.second = self._request(0.0, 0.1)
+
+    def _request(self, latitude, longitude):
+        response = self.client.post(reverse('request-service'), {"latitude": latitude, "longitude": longitude}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        return Service.objects.get(pk=response.data['id'])
+
+    def _complete(self):
+        url = reverse('complete-service', kwargs={'pk': self.running.pk})
+        response = self.client.patch(url, {"status": "COMPLETED"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_completion_serves_oldest_pending(self):
+        self._complete()
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.status, Service.StatusChoices.ASSIGNED)
+        self.assertEqual(self.first.assigned_driver, self.busy)
+        self.assertIsNotNone(self.first.estimated_arrival_time)
+        self.busy.refresh_from_db()
+        self.assertFalse(self.busy.is_available)
+        response = self.client.get(reverse('service-detail', kwargs={'pk': self.second.pk}))
+        self.assertEqual(response.data['status'], Service.StatusChoices.PENDING)
+
+    def test_racing_completions_release_the_driver_once(self):
+        # Both requests read the service while it was still ASSIGNED.
+        stale = Service.objects.select_related('assigned_driver').get(pk=self.running.pk)
+        self._complete()
+        self.assertIsNone(complete_service(stale))
+        self.assertEqual(Service.objects.filter(assigned_driver=self.busy).count(), 2)
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.status, Service.StatusChoices.PENDING)
+
+        # The view's own check saw it ASSIGNED; it was cancelled right after.
+        Service.objects.filter(pk=self.first.pk).update(status=Service.StatusChoices.CANCELLED)
+        checks = [None]
+        url = reverse('complete-service', kwargs={'pk': self.first.pk})
+        with mock.patch('api.views.completion_errors', side_effect=lambda service: checks.pop() if checks else (
+            completion_errors(service)
+        )):
+            response = self.client.patch(url, {"status": "COMPLETED"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ASIGNADO', response.data['status'])
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.status, Service.StatusChoices.PENDING)
+
+    @override_settings(DISPATCH={'PENDING_ORDER': 'nearest'})
+    def test_completion_serves_nearest_pending(self):
+        self._complete()
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.assigned_driver, self.busy)
+
+    @override_settings(DISPATCH={'PENDING_MAX_AGE': 60})
+    def test_expired_requests_are_cancelled(self):
+        Service.objects.update(request_time=timezone.now() - timedelta(minutes=5))
+        self._complete()
+        self.assertFalse(Service.objects.filter(status=Service.StatusChoices.PENDING).exists())
+        response = self.client.get(reverse('service-detail', kwargs={'pk': self.first.pk}))
+        self.assertEqual(response.data['status'], Service.StatusChoices.CANCELLED)
+        self.busy.refresh_from_db()
+        self.assertTrue(self.busy.is_available)
+
+    def test_driver_freed_while_storing_a_pending_request(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            service = dispatch_service(0.0, 0.5)
+        self.assertEqual(service.status, Service.StatusChoices.PENDING)
+        # Released concurrently: that release could not see the new request.
+        with self.captureOnCommitCallbacks(execute=True):
+            free = Driver.objects.create(name="Free", current_latitude=0.0, current_longitude=0.4)
+        for callback in callbacks:
+            callback()
+        service.refresh_from_db()
+        self.assertEqual(service.status, Service.StatusChoices.ASSIGNED)
+        self.assertEqual(service.assigned_driver, free)
+
+    def test_available_driver_takes_pending(self):
+        response = self.client.post(
+            reverse('driver-list'), {"name": "New", "current_latitude": 0.0, "current_longitude": 0.0}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(response.data['is_available'])
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.assigned_driver_id, response.data['id'])
+
+        url = reverse('driver-detail', kwargs={'pk': self.busy.pk})
+        response = self.client.patch(url, {"is_available": True}, format='json')
+        self.assertFalse(response.data['is_available'])
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.assigned_driver, self.busy)
+        self.assertFalse(Service.objects.filter(status=Service.StatusChoices.PENDING).exists())
+
+
+@override_settings(LOCATION_INGEST={'FLUSH_INTERVAL': 0})
+class LocationIngestTests(AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('driver-locations')
+        self.driver = Driver.objects.create(
+            name="Moving", current_latitude=1.0, current_longitude=1.0,
+            location_updated_at=timezone.now() - timedelta(minutes=5)
+        )
+        self.now = timezone.now().timestamp()
+
+    def test_coalesces_pings_per_driver(self):
+        data = [
+            {"driver_id": self.driver.pk, "latitude": 1.1, "longitude": 1.1, "timestamp": self.now - 20},
+            [self.driver.pk, 1.3, 1.3, self.now - 10],
+            {"driver_id": self.driver.pk, "latitude": 1.2, "longitude": 1.2, "timestamp": self.now - 15},
+            {"driver_id": self.driver.pk, "latitude": 91.0, "longitude": 1.2, "timestamp": self.now},
+            {"driver_id": 999999, "latitude": 1.0, "longitude": 1.0, "timestamp": self.now},
+        ]
+        response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data, {"accepted": 2, "stale": 2, "invalid": 1})
+        self.driver.refresh_from_db()
+        self.assertEqual((self.driver.current_latitude, self.driver.current_longitude), (1.3, 1.3))
+        self.assertEqual(get_driver_index().position(self.driver.pk), (1.3, 1.3))
+
+    def test_rejects_driver_ids_out_of_range(self):
+        for driver_id in (0, -1, 2 ** 63, 2 ** 70):
+            self.assertIsNone(parse_ping([driver_id, 1.0, 1.0, self.now]))
+        self.assertEqual(parse_ping([2 ** 63 - 1, 1.0, 1.0, self.now])[0], 2 ** 63 - 1)
+        data = [[2 ** 70, 1.0, 1.0, self.now], [self.driver.pk, 1.5, 1.5, self.now]]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.data, {"accepted": 1, "stale": 0, "invalid": 1})
+        self.driver.refresh_from_db()
+        self.assertEqual(self.driver.current_latitude, 1.5)
+
+    def test_failed_flush_is_counted(self):
+        with override_settings(LOCATION_INGEST={'FLUSH_INTERVAL': 3600}):
+            self.client.post(self.url, [[self.driver.pk, 4.0, 4.0, self.now]], format='json')
+        with mock.patch('api.ingest.write_locations', side_effect=DatabaseError('boom')), \
+                self.assertLogs('api.ingest', 'ERROR'):
+            self.assertEqual(location_buffer.flush(), 0)
+        self.assertEqual(len(location_buffer), 0)
+        self.assertIn('api_location_pings_dropped_total 1\n', REGISTRY.render())
+
+    def test_drops_pings_older_than_stored_position(self):
+        data = [{"driver_id": self.driver.pk, "latitude": 2.0, "longitude": 2.0, "timestamp": self.now - 600}]
+        self.client.post(self.url, data, format='json')
+        self.driver.refresh_from_db()
+        self.assertEqual(self.driver.current_latitude, 1.0)
+
+    def test_ndjson(self):
+        timestamp = timezone.now().isoformat()
+        body = f'{{"driver_id": {self.driver.pk}, "latitude": 3.0, "longitude": 3.0, "timestamp": "{timestamp}"}}\n\n'
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.driver.refresh_from_db()
+        self.assertEqual(self.driver.current_latitude, 3.0)
+
+    def test_buffers_until_flush(self):
+        data = [[self.driver.pk, 4.0, 4.0, self.now]]
+        with override_settings(LOCATION_INGEST={'FLUSH_INTERVAL': 3600}):
+            self.client.post(self.url, data, format='json')
+            self.driver.refresh_from_db()
+            self.assertEqual(self.driver.current_latitude, 1.0)
+            self.assertEqual(location_buffer.flush(), 1)
+        self.driver.refresh_from_db()
+        self.assertEqual(self.driver.current_latitude, 4.0)
+
+
+class EventTests(AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def subscribe(self, predicate=None, maxsize=1000):
+        async def subscribe():
+            return event_bus.subscribe(predicate, maxsize)
+        subscription = self.loop.run_until_complete(subscribe())
+        self.addCleanup(subscription.close)
+        return subscription
+
+    def test_slow_subscriber_drops_oldest(self):
+        subscription = self.subscribe(maxsize=2)
+        for driver_id in (1, 2, 3):
+            event_bus.publish(position_event(driver_id, 0.0, 0.0, True))
+        events, lost = self.loop.run_until_complete(subscription.get(0))
+        self.assertEqual(([event['id'] for event in events], lost), ([2, 3], 1))
+        self.assertLess(events[0]['seq'], events[1]['seq'])
+        self.assertEqual(self.loop.run_until_complete(subscription.get(0.01)), ([], 0))
+        subscription.close()
+        self.assertFalse(event_bus)
+
+    def test_filter(self):
+        service = {'type': 'service', 'id': 1, 'assigned_driver': 7, 'latitude': 0.0, 'longitude': 179.5}
+        driver = position_event(7, 0.0, -179.5, True)
+        self.assertTrue(event_filter(bbox=(-1, 179, 1, -179))(service))
+        self.assertTrue(event_filter(bbox=(-1, 179, 1, -179))(driver))
+        self.assertFalse(event_filter(bbox=(-1, -179, 1, 179))(position_event(7, 0.0, 179.5, True)))
+        self.assertFalse(event_filter(bbox=(1, 170, 2, 180))(service))
+        self.assertTrue(event_filter(drivers={7})(service))
+        self.assertFalse(event_filter(types={'driver'}, drivers={7})(service))
+        self.assertFalse(event_filter(drivers={8})(driver))
+
+    def test_publishes_after_commit(self):
+        subscription = self.subscribe()
+        with self.captureOnCommitCallbacks(execute=True):
+            driver = Driver.objects.create(name="Live", current_latitude=2.0, current_longitude=2.0)
+            self.assertEqual(self.loop.run_until_complete(subscription.get(0)), ([], 0))
+        events, lost = self.loop.run_until_complete(subscription.get(0))
+        self.assertEqual([(event['type'], event['id']) for event in events], [('driver', driver.pk)])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('request-service'), {"latitude": 2.01, "longitude": 2.01}, format='json')
+            self.assertEqual(self.loop.run_until_complete(subscription.get(0)), ([], 0))
+        events, lost = self.loop.run_until_complete(subscription.get(0))
+        self.assertEqual(
+            [(event['type'], event['id']) for event in events],
+            [('driver', driver.pk), ('service', Service.objects.get().pk)]
+        )
+        self.assertFalse(events[0]['is_available'])
+        self.assertEqual(events[1]['status'], Service.StatusChoices.ASSIGNED)
+
+    @override_settings(EVENTS={'HEARTBEAT': 0.01, 'MAX_DURATION': 0.2})
+    async def test_stream(self):
+        headers = {'Authorization': 'Token ' + self.token.key}
+        url = reverse('async-events')
+        response = await self.async_client.get(url, {'types': 'driver', 'bbox': '0,0,1,1'}, headers=headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 3000\n\n')
+        self.assertEqual(await anext(chunks), b': keep-alive\n\n')
+        event_bus.publish(position_event(5, 2.0, 2.0, True))
+        event_bus.publish(position_event(6, 0.5, 0.5, False))
+        events = [chunk async for chunk in chunks if chunk != b': keep-alive\n\n']
+        # The stream ends by itself after MAX_DURATION and unsubscribes.
+        self.assertFalse(event_bus)
+        self.assertEqual(len(events), 1)
+        lines = events[0].decode().split('\n')
+        self.assertEqual(lines[1], 'event: driver')
+        self.assertEqual(json.loads(lines[2][len('data: '):])['id'], 6)
+
+        response = await self.async_client.get(url, {'bbox': '1,2'}, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('bbox', json.loads(response.content))
+        with override_settings(EVENTS={'MAX_SUBSCRIBERS': 0}):
+            response = await self.async_client.get(url, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class AddressLookupTests(AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.plaza = Address.objects.create(
+            street_address="Carrera 7 # 11-10", city="Bogotá", state="DC", postal_code="111711",
+            latitude=4.5981, longitude=-74.0760
+        )
+        self.parque = Address.objects.create(
+            street_address="Calle 93 # 11-27", city="Bogotá", state="DC", postal_code="110221",
+            latitude=4.6766, longitude=-74.0483
+        )
+        reload_address_index()
+
+    def test_nearby_addresses_by_distance(self):
+        response = self.client.get(reverse('address-nearby'), {'lat': 4.60, 'lon': -74.07})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data], [self.plaza.pk, self.parque.pk])
+        self.assertAlmostEqual(response.data[0]['distance_km'], haversine(4.60, -74.07, 4.5981, -74.0760))
+        self.assertEqual(response.data[0]['street_address'], self.plaza.street_address)
+
+        response = self.client.get(reverse('address-nearby'), {'lat': 4.60, 'lon': -74.07, 'radius_km': 2})
+        self.assertEqual([item['id'] for item in response.data], [self.plaza.pk])
+        response = self.client.get(reverse('address-nearby'), {'lat': 4.68, 'lon': -74.05, 'k': 1})
+        self.assertEqual([item['id'] for item in response.data], [self.parque.pk])
+
+    def test_invalid_query(self):
+        response = self.client.get(reverse('address-nearby'), {'lat': 95, 'k': 1000})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('lat', response.data)
+        self.assertIn('lon', response.data)
+
+    def test_non_finite_query_is_rejected(self):
+        # A NaN radius never satisfied the index's stop condition.
+        response = self.client.get(
+            reverse('address-nearby'), {'lat': 4.6, 'lon': -74.1, 'k': 5, 'radius_km': 'nan'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('radius_km', response.data)
+        response = self.client.get(reverse('address-reverse'), {'lat': 'nan', 'lon': -74.1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('lat', response.data)
+
+    def test_reverse_geocode(self):
+        response = self.client.get(reverse('address-reverse'), {'lat': 4.6768, 'lon': -74.0485})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], self.parque.pk)
+        self.assertLess(response.data['distance_km'], 0.1)
+
+        response = self.client.get(reverse('address-reverse'), {'lat': 4.64, 'lon': -74.06})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_index_follows_api_writes(self):
+        url = reverse('address-detail', kwargs={'pk': self.plaza.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'latitude': 4.6400, 'longitude': -74.0600}, format='json')
+        response = self.client.get(reverse('address-reverse'), {'lat': 4.64, 'lon': -74.06})
+        self.assertEqual(response.data['id'], self.plaza.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(url)
+        self.assertEqual(len(get_address_index()), 1)
+        response = self.client.get(reverse('address-reverse'), {'lat': 4.64, 'lon': -74.06})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class DriverNearbyTests(AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('driver-nearby')
+        self.near = Driver.objects.create(name="Near", current_latitude=4.601, current_longitude=-74.071)
+        self.busy = Driver.objects.create(name="Busy", current_latitude=4.602, current_longitude=-74.072, is_available=False)
+        self.middle = Driver.objects.create(name="Middle", current_latitude=4.63, current_longitude=-74.07)
+        self.far = Driver.objects.create(name="Far", current_latitude=6.25, current_longitude=-75.58)
+        reload_driver_index()
+        nearby_driver_cache.clear()
+
+    def ids(self, **params):
+        response = self.client.get(self.url, {'lat': 4.60, 'lon': -74.07, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['id'] for row in response.data]
+
+    def test_nearest_drivers_with_distances(self):
+        response = self.client.get(self.url, {'lat': 4.60, 'lon': -74.07, 'k': 2})
+        self.assertEqual([row['id'] for row in response.data], [self.near.pk, self.busy.pk])
+        self.assertAlmostEqual(response.data[0]['distance_km'], haversine(4.60, -74.07, 4.601, -74.071))
+        self.assertEqual(response.data[0]['name'], "Near")
+        self.assertEqual(response['Cache-Control'], 'private, max-age=2')
+
+    def test_filters(self):
+        for mode in ('index', 'database'):
+            with self.subTest(mode=mode), override_settings(DISPATCH={'MODE': mode}):
+                nearby_driver_cache.clear()
+                # Far (~240 km) is outside the default 50 km radius
+                self.assertEqual(self.ids(available='true'), [self.near.pk, self.middle.pk])
+                self.assertEqual(self.ids(available='false'), [self.busy.pk])
+                self.assertEqual(self.ids(radius_km=10), [self.near.pk, self.busy.pk, self.middle.pk])
+                self.assertEqual(self.ids(available='true', k=1), [self.near.pk])
+
+    def test_same_cell_is_served_from_cache(self):
+        self.client.get(self.url, {'lat': 4.6012, 'lon': -74.0712, 'k': 2})
+        Driver.objects.filter(pk=self.near.pk).delete()
+        # Another client in the same cell, within the TTL
+        response = self.client.get(self.url, {'lat': 4.6013, 'lon': -74.0713, 'k': 2})
+        self.assertEqual([row['id'] for row in response.data], [self.near.pk, self.busy.pk])
+        self.assertAlmostEqual(response.data[0]['distance_km'], haversine(4.6013, -74.0713, 4.601, -74.071))
+        self.assertEqual(nearby_driver_cache.stats()['hits'], 1)
+        with override_settings(DRIVER_NEARBY={'CACHE_TTL': 0}):
+            self.assertEqual(self.ids(k=2), [self.busy.pk, self.middle.pk])
+
+    def test_invalid_query(self):
+        response = self.client.get(self.url, {'lat': 4.6, 'lon': -74.07, 'radius_km': 500, 'available': 'maybe'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('available', response.data)
+
+    def test_non_finite_query_is_rejected(self):
+        # NaN used to reach math.floor() in the cell key and answer 500.
+        for params in ({'lat': 'nan', 'lon': -74.1}, {'lat': 4.6, 'lon': 'nan', 'radius_km': 'nan'}):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertTrue({'lat', 'lon'} & set(response.data))
+
+
+class ServiceViewSetTests(AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.driver = Driver.objects.create(name="Driver S", current_latitude=1.0, current_longitude=1.0)
+        self.assigned = Service.objects.create(
+            customer_pickup_latitude=1.0, customer_pickup_longitude=1.0,
+            assigned_driver=self.driver, status=Service.StatusChoices.ASSIGNED
+        )
+        self.pending = Service.objects.create(customer_pickup_latitude=2.0, customer_pickup_longitude=2.0)
+
+    def test_list_services(self):
+        response = self.client.get(reverse('service-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([s['id'] for s in response.data['results']], [self.assigned.pk, self.pending.pk])
+        self.assertEqual(response.data['results'][0]['assigned_driver']['name'], "Driver S")
+
+    def test_filter_services(self):
+        response = self.client.get(reverse('service-list'), {'status': 'PENDING'})
+        self.assertEqual([s['id'] for s in response.data['results']], [self.pending.pk])
+        response = self.client.get(reverse('service-list'), {'assigned_driver': self.driver.pk})
+        self.assertEqual([s['id'] for s in response.data['results']], [self.assigned.pk])
+        response = self.client.get(reverse('service-list'), {'status': 'LOST'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for driver in ('abc', '²', '99999999999999999999'):
+            response = self.client.get(reverse('service-list'), {'assigned_driver': driver})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, driver)
+
+    def test_export_services_filtered(self):
+        response = self.client.get(reverse('service-export'), {'status': 'ASSIGNED'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['assigned_driver_id'], self.driver.pk)
+
+    def test_services_are_read_only(self):
+        response = self.client.post(reverse('service-list'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
 class DriverViewSetTests(AuthenticatedAPITestCase):
     def setUp(self):
         super().setUp()
@@ -190,7 +1527,29 @@ class DriverViewSetTests(AuthenticatedAPITestCase):
     def test_list_drivers(self):
         response = self.client.get(self.list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_list_drivers_keyset_pages(self):
+        Driver.objects.bulk_create(
+            Driver(name=f"Driver {i}", current_latitude=1.0, current_longitude=1.0) for i in range(4)
+        )
+        names, url = [], self.list_url + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            names += [driver['name'] for driver in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(names, list(Driver.objects.order_by('pk').values_list('name', flat=True)))
+
+    def test_export_drivers_ndjson(self):
+        Driver.objects.create(name="Driver B", current_latitude=2.0, current_longitude=2.0, is_available=False)
+        response = self.client.get(reverse('driver-export'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['name'] for row in rows], ["Driver A", "Driver B"])
+        self.assertEqual(rows[1]['is_available'], False)
 
     def test_retrieve_driver(self):
         response = self.client.get(self.detail_url)
@@ -224,3 +1583,407 @@ class DriverViewSetTests(AuthenticatedAPITestCase):
         response = self.client.delete(self.detail_url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Driver.objects.count(), 0)
+
+
+class ConditionalGetTests(AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.address = Address.objects.create(
+            street_address="Calle 26 # 59-51", city="Bogotá", state="DC", postal_code="111321",
+            latitude=4.6486, longitude=-74.0945
+        )
+        self.driver = Driver.objects.create(
+            name="Versioned", current_latitude=1.0, current_longitude=1.0,
+            location_updated_at=timezone.now() - timedelta(minutes=5)
+        )
+
+    def test_not_modified_until_saved(self):
+        url = reverse('address-detail', args=[self.address.pk])
+        response = self.client.get(url)
+        etag = response['ETag']
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], etag)
+        # Dates are only precise to the second: a write within it would be missed.
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date()).status_code, status.HTTP_200_OK
+        )
+
+        self.address.city = "Chía"
+        self.address.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['city'], "Chía")
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_equivalent_paths_share_a_version(self):
+        url = f"{reverse('address-list')}0{self.address.pk}/"
+        etag = self.client.get(url)['ETag']
+        self.address.city = "Chía"
+        self.address.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['city'], "Chía")
+        self.assertEqual(self.client.get(f"{reverse('address-list')}x/").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_served_from_cache_until_a_write(self):
+        url = reverse('driver-list')
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(cached.data, first.data)
+        self.assertEqual(cached['ETag'], first['ETag'])
+        # Another page is another entry under the same version.
+        self.assertEqual(self.client.get(url, {'page_size': 1})['ETag'], first['ETag'])
+
+        Driver.objects.create(name="Newcomer", current_latitude=2.0, current_longitude=2.0)
+        response = self.client.get(url)
+        self.assertEqual([row['name'] for row in response.data['results']], ["Versioned", "Newcomer"])
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertIn('api_conditional_responses_total{resource="api.driver",outcome="cache_hit"}', REGISTRY.render())
+
+    def test_bulk_location_writes_bump_versions(self):
+        url = reverse('driver-detail', args=[self.driver.pk])
+        etag = self.client.get(url)['ETag']
+        self.client.post(
+            reverse('driver-locations'),
+            [[self.driver.pk, 1.5, 1.5, timezone.now().timestamp()]], format='json'
+        )
+        location_buffer.flush()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['current_latitude'], 1.5)
+
+    @override_settings(DATABASE_REPLICAS={'ALIASES': ['default'], 'STICKY_SECONDS': 5})
+    def test_young_versions_are_read_from_the_primary(self):
+        url = reverse('driver-detail', args=[self.driver.pk])
+        replica_reads.clear()
+        # Just saved: a replica could still serve the old row under the new ETag.
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertNotIn('api_replica_reads_total', REGISTRY.render())
+        later = time.time() + 10
+        with mock.patch('api.conditional.time.time', return_value=later):
+            # Another cache entry, so the view queries again.
+            self.assertEqual(self.client.get(url, {'page': 1}).status_code, status.HTTP_200_OK)
+        self.assertIn('api_replica_reads_total{database="default"}', REGISTRY.render())
+
+    @override_settings(RESPONSE_CACHE={'ENABLED': False})
+    def test_disabled(self):
+        response = self.client.get(reverse('address-list'))
+        self.assertNotIn('ETag', response)
+
+
+class LRUCacheTests(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        now = [0.0]
+        cache = LRUCache(maxsize=10, ttl=5, clock=lambda: now[0])
+        cache.set('a', 1)
+        now[0] = 4.9
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 5.0
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 1, 0))
+
+
+# The listing must hit the database so the token lookups can be counted.
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class TokenCacheTests(AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        token_cache.clear()
+        token_cache.local.reset_stats()
+
+    def test_cached_token_skips_database(self):
+        self.client.get(reverse('driver-list'))
+        with self.assertNumQueries(1):  # only the listing itself
+            response = self.client.get(reverse('driver-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+
+    def test_deleted_token_is_rejected(self):
+        self.client.get(reverse('driver-list'))
+        self.token.delete()
+        response = self.client.get(reverse('driver-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get(reverse('driver-list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.test_user.is_active = False
+            self.test_user.save()
+        response = self.client.get(reverse('driver-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_rolled_back_user_change_keeps_the_cache(self):
+        self.client.get(reverse('driver-list'))
+        try:
+            with transaction.atomic():
+                self.test_user.is_active = False
+                self.test_user.save()
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        self.assertEqual(token_cache.user_id(self.token.key), self.test_user.pk)
+
+    @override_settings(TOKEN_CACHE={'MAX_SIZE': 100, 'TTL': 60, 'SHARED': 'default'})
+    def test_shared_cache_fills_local_cache(self):
+        self.client.get(reverse('driver-list'))
+        token_cache.local.clear()
+        # The user row is loaded, the token itself is not looked up.
+        with self.assertNumQueries(2):
+            self.client.get(reverse('driver-list'))
+        self.assertEqual(token_cache.stats()['shared_hits'], 1)
+        with self.assertNumQueries(1):
+            self.client.get(reverse('driver-list'))
+
+    @override_settings(TOKEN_CACHE={'MAX_SIZE': 100, 'TTL': 60, 'SHARED': 'default'})
+    def test_shared_cache_holds_no_user_data(self):
+        self.client.get(reverse('driver-list'))
+        entry = token_cache.shared.get(token_cache._shared_key(self.token.key))
+        self.assertEqual(entry, (self.token.key, self.test_user.pk, True))
+
+    def test_stats_endpoint_requires_staff(self):
+        url = reverse('token-cache-stats')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.test_user.is_staff = True
+            self.test_user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hit_ratio', response.data)
+
+
+class MetricsTests(AuthenticatedAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        REGISTRY.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            Driver.objects.create(name="Metrics", current_latitude=1.0, current_longitude=1.0)
+
+    def scrape(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.test_user.is_staff = True
+            self.test_user.save()
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_request_is_recorded(self):
+        self.client.post(reverse('request-service'), {"latitude": 1.0, "longitude": 1.0}, format='json')
+        text = self.scrape()
+        self.assertIn('api_request_seconds_count{view="request-service",method="POST"} 1\n', text)
+        self.assertIn('api_responses_total{view="request-service",status="201"} 1\n', text)
+        self.assertIn('api_phase_seconds_count{view="request-service",phase="nearest_driver"} 1\n', text)
+        self.assertIn('api_phase_seconds_count{view="request-service",phase="serialize"} 1\n', text)
+        self.assertIn('api_db_queries_bucket{view="request-service",le="0.0"} 0\n', text)
+        self.assertIn('api_token_cache_hits_total', text)
+
+    async def test_async_view_is_recorded(self):
+        # No sync process_view hook, so the request stays on the event loop.
+        service = await Service.objects.acreate(customer_pickup_latitude=1.0, customer_pickup_longitude=1.0)
+        response = await self.async_client.get(
+            reverse('async-service-status', args=[service.pk]), headers={'Authorization': 'Token ' + self.token.key}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('api_request_seconds_count{view="async-service-status",method="GET"} 1\n', REGISTRY.render())
+
+    def test_metrics_require_staff(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('latency', 'Test.', ('view',), buckets=(1, 2))
+        for value in (0.5, 1, 1.5, 3):
+            histogram.observe(value, 'v')
+        samples = [(suffix, labels, value) for suffix, labels, _, value in histogram.samples()]
+        self.assertEqual(samples, [
+            ('_bucket', ('v', '1.0'), 2), ('_bucket', ('v', '2.0'), 3), ('_bucket', ('v', '+Inf'), 4),
+            ('_sum', ('v',), 6.0), ('_count', ('v',), 4),
+        ])
+
+    def test_profile_header_dumps_stats(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS={'PROFILE_DIR': directory}):
+                client = APIClient()
+                client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+                response = client.get(reverse('driver-list'), HTTP_X_PROFILE='1')
+            self.assertEqual(os.listdir(directory), [response['X-Profile-Dump']])
+            self.assertTrue(response['X-Profile-Dump'].startswith('driver-list-'))
+
+
+class SchemaTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(OPENAPI_SCHEMA={'DIRECTORY': self.directory})
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def test_generated_once_and_revalidated_with_etag(self):
+        with mock.patch('api.schema.generate_schema', wraps=generate_schema) as generate:
+            response = self.client.get('/swagger.json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('/api/services/request/', json.loads(response.content)['paths'])
+            self.assertEqual(response['Cache-Control'], 'no-cache')
+
+            etag = response['ETag']
+            self.assertEqual(self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            yaml = self.client.get('/swagger.yaml')
+            self.assertEqual(yaml['Content-Type'], 'application/yaml')
+            self.assertNotEqual(yaml['ETag'], etag)
+            # The UI pages fetch the cached document too.
+            self.assertEqual(self.client.get('/redoc/?format=openapi')['ETag'], etag)
+            self.assertEqual(generate.call_count, 1)
+
+    def test_served_from_generated_files(self):
+        call_command('generate_schema', stdout=io.StringIO())
+        self.assertEqual(sorted(os.listdir(self.directory)), ['openapi.json', 'openapi.yaml'])
+        with open(os.path.join(self.directory, 'openapi.json'), 'wb') as f:
+            f.write(b'{"swagger": "2.0", "paths": {}}')
+        schema_cache.clear()
+
+        with mock.patch('api.schema.generate_schema') as generate:
+            self.assertEqual(self.client.get('/swagger.json').content, b'{"swagger": "2.0", "paths": {}}')
+            generate.assert_not_called()
+
+    def test_ui_pages_point_at_cached_document(self):
+        for name in ('schema-swagger-ui', 'schema-redoc'):
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertContains(response, '/swagger.json')
+
+
+@override_settings(DATABASE_REPLICAS={'ALIASES': ['replica_a', 'replica_b'], 'STICKY_SECONDS': 5})
+class ReplicaRoutingTests(AuthenticatedAPITestCase):
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Driver), 'default')
+
+        token = replicas.enter('client')
+        try:
+            self.assertEqual(router.db_for_read(Driver), 'default')
+            allow_replica_reads()
+            # The test's own transaction on the primary keeps reads there.
+            self.assertEqual(router.db_for_read(Driver), 'default')
+            with mock.patch.object(connection, 'in_atomic_block', False):
+                replica = router.db_for_read(Driver)
+                self.assertIn(replica, ['replica_a', 'replica_b'])
+                self.assertEqual(router.db_for_read(Address), replica)
+                # Read-after-write within the request.
+                self.assertEqual(router.db_for_write(Driver), 'default')
+                self.assertEqual(router.db_for_read(Driver), 'default')
+        finally:
+            replicas.leave(token)
+        self.assertIsNone(current_state())
+
+        # And for the client's next requests, until STICKY_SECONDS pass.
+        token = replicas.enter('client')
+        try:
+            allow_replica_reads()
+            with mock.patch.object(connection, 'in_atomic_block', False):
+                self.assertEqual(router.db_for_read(Driver), 'default')
+        finally:
+            replicas.leave(token)
+        self.assertFalse(router.allow_migrate('replica_a', 'api'))
+        self.assertIsNone(router.allow_migrate('default', 'api'))
+
+    @override_settings(DATABASE_REPLICAS={'ALIASES': ['default'], 'STICKY_SECONDS': 5})
+    def test_writes_make_client_sticky(self):
+        client = 'token:' + hashlib.sha256(f'Token {self.token.key}'.encode()).hexdigest()[:32]
+        self.assertEqual(self.client.get(reverse('driver-list')).status_code, status.HTTP_200_OK)
+        self.assertNotIn(client, sticky_clients)
+        self.client.post(
+            reverse('driver-list'), {"name": "Fresh", "current_latitude": 1.0, "current_longitude": 1.0}, format='json'
+        )
+        self.assertIn(client, sticky_clients)
+
+
+@skipUnless('replica_0' in connections, 'Set DB_REPLICA_HOSTS to run against a replica alias.')
+class ReplicaDatabaseTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpassword123')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        Driver.objects.create(name="Replicated", current_latitude=1.0, current_longitude=1.0)
+
+    @override_settings(DATABASE_REPLICAS={'ALIASES': ['replica_0'], 'STICKY_SECONDS': 5})
+    def test_listing_reads_from_replica_until_client_writes(self):
+        # Once the listing's version is older than STICKY_SECONDS.
+        later = time.time() + 10
+        with CaptureQueriesContext(connections['replica_0']) as replica_queries, \
+                mock.patch('api.conditional.time.time', return_value=later):
+            response = self.client.get(reverse('driver-list'))
+        self.assertEqual(response.data['results'][0]['name'], "Replicated")
+        self.assertTrue(replica_queries.captured_queries)
+
+        self.client.post(reverse('request-service'), {"latitude": 1.0, "longitude": 1.0}, format='json')
+        with CaptureQueriesContext(connections['replica_0']) as replica_queries:
+            self.assertEqual(self.client.get(reverse('service-list')).data['results'][0]['status'], 'ASSIGNED')
+        self.assertFalse(replica_queries.captured_queries)
+
+
+@skipUnless(connection.features.has_select_for_update_skip_locked, "Requires SELECT ... FOR UPDATE SKIP LOCKED")
+class ConcurrentDispatchTests(TransactionTestCase):
+    driver_count = 40
+    request_count = 200
+
+    def setUp(self):
+        fake = Faker()
+        Faker.seed(99)
+        self.token = Token.objects.create(user=User.objects.create_user(username='load', password='load'))
+        Driver.objects.bulk_create(
+            Driver(
+                name=fake.name(),
+                current_latitude=4.6 + fake.pyfloat(min_value=-0.1, max_value=0.1),
+                current_longitude=-74.1 + fake.pyfloat(min_value=-0.1, max_value=0.1)
+            )
+            for _ in range(self.driver_count)
+        )
+        reload_driver_index()
+
+    def request_service(self, _):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        try:
+            return client.post(reverse('request-service'), {"latitude": 4.6, "longitude": -74.1}, format='json').status_code
+        finally:
+            connection.close()
+
+    def assert_no_double_assignment(self):
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            codes = list(pool.map(self.request_service, range(self.request_count)))
+
+        self.assertEqual(codes.count(status.HTTP_201_CREATED), self.driver_count)
+        self.assertEqual(codes.count(status.HTTP_202_ACCEPTED), self.request_count - self.driver_count)
+        self.assertEqual(
+            Service.objects.filter(status=Service.StatusChoices.PENDING).count(), self.request_count - self.driver_count
+        )
+        assigned = list(Service.objects.filter(assigned_driver__isnull=False).values_list('assigned_driver', flat=True))
+        self.assertEqual(len(assigned), self.driver_count)
+        self.assertEqual(len(set(assigned)), self.driver_count)
+        self.assertFalse(Driver.objects.filter(is_available=True).exists())
+
+    @override_settings(DISPATCH={'MODE': 'index'})
+    def test_index_mode(self):
+        self.assert_no_double_assignment()
+
+    @override_settings(DISPATCH={'MODE': 'database'})
+    def test_database_mode(self):
+        self.assert_no_double_assignment()
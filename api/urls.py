@@ -1,13 +1,33 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AddressViewSet, DriverViewSet, RequestServiceView, CompleteServiceView
+from .async_views import (
+    AsyncCompleteServiceView, AsyncEventStreamView, AsyncRequestServiceView, AsyncServiceStatusView
+)
+from .views import (
+    AddressViewSet, DriverViewSet, ServiceViewSet, RequestServiceView,
+    BatchRequestServiceView, CompleteServiceView, DispatchJobView, TokenCacheStatsView, MetricsView
+)
 
 router = DefaultRouter()
 router.register(r'addresses', AddressViewSet, basename='address')
 router.register(r'drivers', DriverViewSet, basename='driver')
+router.register(r'services', ServiceViewSet, basename='service')
 
+# Las rutas explícitas de servicios van antes del router para que
+# 'services/request/' no se interprete como el detalle de un servicio.
 urlpatterns = [
-    path('', include(router.urls)),
     path('services/request/', RequestServiceView.as_view(), name='request-service'),
+    path('services/request/batch/', BatchRequestServiceView.as_view(), name='request-service-batch'),
     path('services/<int:pk>/complete/', CompleteServiceView.as_view(), name='complete-service'),
+    path('services/jobs/<uuid:pk>/', DispatchJobView.as_view(), name='dispatch-job'),
+    # Versiones async (ASGI) de solicitar y completar servicio, y espera de
+    # servicios pendientes.
+    path('async/services/request/', AsyncRequestServiceView.as_view(), name='async-request-service'),
+    path('async/services/<int:pk>/complete/', AsyncCompleteServiceView.as_view(), name='async-complete-service'),
+    path('async/services/<int:pk>/', AsyncServiceStatusView.as_view(), name='async-service-status'),
+    # Flujo SSE de cambios de conductores y servicios (solo ASGI).
+    path('async/events/', AsyncEventStreamView.as_view(), name='async-events'),
+    path('auth/token-cache/', TokenCacheStatsView.as_view(), name='token-cache-stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('', include(router.urls)),
 ] 
\ No newline at end of file
@@ -1,75 +1,355 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
-from rest_framework import viewsets, status, generics, serializers
+from rest_framework import viewsets, status, generics, permissions, serializers
+from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from django.utils import timezone
-from datetime import timedelta
+from django.urls import reverse
+from django.db import transaction
 import math
 
-from .models import Address, Driver, Service, calculate_haversine_distance
+from .authentication import token_cache
+from .conditional import ConditionalGetMixin
+from .cache import LRUCache
+from .dispatch import (
+    complete_service, dispatch_service, dispatch_services, dispatch_settings, nearby_drivers, release_driver
+)
+from .fast_serializers import (
+    address_serializer, driver_serializer, fast_serialization_enabled, service_serializer
+)
+from .geo import haversine
+from .geocode import nearby_addresses, reverse_geocode
+from .idempotency import idempotent
+from .ingest import MAX_DRIVER_ID, ingest_settings, location_buffer, parse_ping
+from .jobs import enqueue_dispatch, job_settings
+from .metrics import REGISTRY, phase
+from .models import Address, DispatchJob, Driver, Service
+from .parsers import NDJSONParser
+from .renderers import PrometheusRenderer
+from .replicas import ReplicaReadMixin
 from .serializers import (
-    AddressSerializer, DriverSerializer, ServiceSerializer, 
+    AddressSerializer, DriverNearbyQuerySerializer, DriverSerializer, NearbyQuerySerializer, ServiceSerializer,
     ServiceRequestSerializer, ServiceUpdateSerializer
 )
 
 
 
-class AddressViewSet(viewsets.ModelViewSet):
+def driver_nearby_settings():
+    return getattr(settings, 'DRIVER_NEARBY', {})
+
+
+# Serialized drivers/nearby/ results per (cell, k, radius, available).
+nearby_driver_cache = LRUCache(maxsize=driver_nearby_settings().get('CACHE_SIZE', 10000))
+
+
+@REGISTRY.register_collector
+def _nearby_cache_metrics():
+    stats = nearby_driver_cache.stats()
+    yield 'api_nearby_cache_hits_total', 'counter', 'drivers/nearby/ answers served from the cell cache.', stats['hits']
+    yield 'api_nearby_cache_misses_total', 'counter', 'drivers/nearby/ searches run.', stats['misses']
+
+
+class NDJSONExportMixin:
+    """
+    Adds ``GET <list>/export/``: every row as NDJSON, streamed in constant memory.
+
+    Rows come from ``.values()`` over a chunked ``.iterator()``, so no model
+    instances or serializers are built and only one chunk is held at a time.
+    """
+    export_fields = None
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        queryset = self.filter_queryset(self.get_queryset()).order_by('pk')
+        # Rows are streamed after the view returns: pin the database routed now.
+        queryset = queryset.using(queryset.db)
+        fields = self.export_fields or [field.attname for field in queryset.model._meta.concrete_fields]
+        chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+        rows = queryset.values(*fields).iterator(chunk_size=chunk_size)
+        response = StreamingHttpResponse(_ndjson_lines(rows, chunk_size), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="{queryset.model._meta.model_name}s.ndjson"'
+        return response
+
+
+def _ndjson_lines(rows, chunk_size):
+    encode = DjangoJSONEncoder(separators=(',', ':')).encode
+    lines = []
+    for row in rows:
+        lines.append(encode(row))
+        if len(lines) >= chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+class FastListMixin:
+    """
+    Serves ``list`` from ``.values()`` rows through a ``CompiledSerializer``.
+
+    The JSON is identical to the ``serializer_class`` output; set
+    ``FAST_SERIALIZATION = False`` to go back to the DRF serializers.
+    """
+    fast_serializer = None
+
+    def list(self, request, *args, **kwargs):
+        if self.fast_serializer is None or not fast_serialization_enabled():
+            return super().list(request, *args, **kwargs)
+        rows = self.fast_serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        with phase('serialize'):
+            data = self.fast_serializer.from_values(page if page is not None else rows)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
+def completion_errors(service):
+    """Reasons ``service`` cannot be completed, or ``None``."""
+    if service.status != Service.StatusChoices.ASSIGNED:
+        return {"status": "El servicio debe estar en estado ASIGNADO para ser completado."}
+    if not service.assigned_driver:
+        return {"driver": "Conductor no asignado a este servicio."}
+    return None
+
+
+def dispatch_status(service):
+    """201 for an assigned service, 202 for one queued as pending."""
+    if service.status == Service.StatusChoices.PENDING:
+        return status.HTTP_202_ACCEPTED
+    return status.HTTP_201_CREATED
+
+
+def wants_queued_dispatch(request):
+    """``DISPATCH_JOBS['MODE'] = 'queued'``, or a ``Prefer: respond-async`` header (RFC 7240)."""
+    if job_settings().get('MODE', 'inline') == 'queued':
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+
+def queued_response_headers(request, job):
+    headers = {'Location': reverse('dispatch-job', kwargs={'pk': job.pk})}
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        headers['Preference-Applied'] = 'respond-async'
+    return headers
+
+
+def job_data(job):
+    return {
+        "id": str(job.pk),
+        "status": job.status,
+        "service": service_data(job.service) if job.service_id is not None else None,
+        "error": job.error or None,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def service_data(service):
+    with phase('serialize'):
+        if fast_serialization_enabled():
+            return service_serializer.to_representation(service)
+        return ServiceSerializer(service).data
+
+
+class AddressViewSet(ReplicaReadMixin, ConditionalGetMixin, FastListMixin, NDJSONExportMixin, viewsets.ModelViewSet):
     queryset = Address.objects.all()
     serializer_class = AddressSerializer
+    fast_serializer = address_serializer
+
+    @action(detail=False, methods=['get'], url_path='nearby')
+    def nearby(self, request):
+        """The ``k`` closest addresses to ``lat``/``lon`` within ``radius_km``, with their distance."""
+        query = self._lookup_query(request, getattr(settings, 'ADDRESS_INDEX', {}).get('MAX_RADIUS_KM', 50.0))
+        found = nearby_addresses(query['lat'], query['lon'], query['k'], query['radius_km'])
+        return Response([self._address_data(address, distance) for address, distance in found])
 
-class DriverViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'], url_path='reverse')
+    def reverse(self, request):
+        """Reverse geocode: the known address closest to ``lat``/``lon`` within ``radius_km``."""
+        query = self._lookup_query(request, getattr(settings, 'ADDRESS_INDEX', {}).get('REVERSE_RADIUS_KM', 0.5))
+        found = reverse_geocode(query['lat'], query['lon'], query['radius_km'])
+        if found is None:
+            return Response({"message": "No hay direcciones conocidas cerca de este punto."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self._address_data(*found))
+
+    @staticmethod
+    def _lookup_query(request, default_radius):
+        query = NearbyQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return {'radius_km': default_radius, **query.validated_data}
+
+    @staticmethod
+    def _address_data(address, distance):
+        data = address_serializer.to_representation(address)
+        data['distance_km'] = distance
+        return data
+
+class DriverViewSet(ReplicaReadMixin, ConditionalGetMixin, FastListMixin, NDJSONExportMixin, viewsets.ModelViewSet):
     queryset = Driver.objects.all()
     serializer_class = DriverSerializer
+    fast_serializer = driver_serializer
+
+    @action(detail=False, methods=['get'], url_path='nearby')
+    def nearby(self, request):
+        """
+        The ``k`` closest drivers to ``lat``/``lon`` within ``radius_km``, with their distance.
+
+        The search runs from the center of the query's ``CACHE_CELL_DEG``
+        cell and is cached for ``CACHE_TTL`` seconds, so every client in the
+        cell shares it. Distances are then measured from each client's own
+        point, so radius edges are approximate to half a cell.
+        """
+        query = DriverNearbyQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        options = driver_nearby_settings()
+        lat, lon, k = query.validated_data['lat'], query.validated_data['lon'], query.validated_data['k']
+        radius = query.validated_data.get('radius_km', options.get('MAX_RADIUS_KM', 50.0))
+        available = query.validated_data['available']
+        cell, ttl = options.get('CACHE_CELL_DEG', 0.005), options.get('CACHE_TTL', 2)
+
+        key = (math.floor(lat / cell), math.floor(lon / cell), k, radius, available)
+        rows = nearby_driver_cache.get(key) if ttl else None
+        if rows is None:
+            center = (min((key[0] + 0.5) * cell, 90.0), min((key[1] + 0.5) * cell, 180.0))
+            with phase('nearby_search'):
+                found = nearby_drivers(*center, k, radius, available)
+            rows = [driver_serializer.to_representation(driver) for driver, _ in found]
+            if ttl:
+                nearby_driver_cache.set(key, rows, ttl=ttl)
+
+        results = [
+            {**row, 'distance_km': haversine(lat, lon, row['current_latitude'], row['current_longitude'])}
+            for row in rows
+        ]
+        results.sort(key=lambda row: (row['distance_km'], row['id']))
+        response = Response(results)
+        response['Cache-Control'] = f'private, max-age={ttl}'
+        return response
+
+    def perform_create(self, serializer):
+        self._save_and_match(serializer)
+
+    def perform_update(self, serializer):
+        self._save_and_match(serializer)
+
+    def _save_and_match(self, serializer):
+        # An available driver takes the next pending request right away.
+        with transaction.atomic():
+            driver = serializer.save()
+            if driver.is_available:
+                release_driver(driver)
+
+    @action(detail=False, methods=['post'], url_path='locations', parser_classes=[JSONParser, NDJSONParser])
+    def locations(self, request):
+        """Bulk GPS ingest: a JSON array or NDJSON of (driver_id, latitude, longitude, timestamp) pings."""
+        items = request.data
+        if not isinstance(items, list):
+            return Response({"message": "Se espera una lista de posiciones."}, status=status.HTTP_400_BAD_REQUEST)
+        max_pings = ingest_settings().get('MAX_PINGS', 10000)
+        if len(items) > max_pings:
+            return Response({"message": f"Máximo {max_pings} posiciones por solicitud."}, status=status.HTTP_400_BAD_REQUEST)
+
+        pings = [ping for ping in map(parse_ping, items) if ping is not None]
+        # Newest first within the request, so older duplicates count as stale.
+        pings.sort(key=lambda ping: ping[3], reverse=True)
+        accepted, stale = location_buffer.add(pings)
+        return Response(
+            {"accepted": accepted, "stale": stale, "invalid": len(items) - len(pings)},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+class ServiceViewSet(ReplicaReadMixin, FastListMixin, NDJSONExportMixin, viewsets.ReadOnlyModelViewSet):
+    """Read-only service listing, filterable by ``?status=`` and ``?assigned_driver=``."""
+    queryset = Service.objects.select_related('assigned_driver')
+    serializer_class = ServiceSerializer
+    fast_serializer = service_serializer
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        params = self.request.query_params
+        service_status = params.get('status')
+        if service_status:
+            if service_status not in Service.StatusChoices.values:
+                raise serializers.ValidationError({"status": f"Estado inválido: {service_status}."})
+            queryset = queryset.filter(status=service_status)
+        driver = params.get('assigned_driver')
+        if driver:
+            try:
+                driver = int(driver)
+            except ValueError:
+                driver = None
+            # Not isdigit(): it accepts '²', which int() rejects. Ids beyond a bigint overflow SQLite.
+            if driver is None or not 1 <= driver <= MAX_DRIVER_ID:
+                raise serializers.ValidationError({"assigned_driver": "Debe ser un id de conductor."})
+            queryset = queryset.filter(assigned_driver=driver)
+        return queryset
 
 
 class RequestServiceView(APIView):
 
+    @idempotent
     def post(self, request, *args, **kwargs):
-        request_serializer = ServiceRequestSerializer(data=request.data)
-        if not request_serializer.is_valid():
+        with phase('validate'):
+            request_serializer = ServiceRequestSerializer(data=request.data)
+            valid = request_serializer.is_valid()
+        if not valid:
             return Response(request_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         customer_lat = request_serializer.validated_data['latitude']
         customer_lon = request_serializer.validated_data['longitude']
 
-        available_drivers = Driver.objects.filter(is_available=True)
-        if not available_drivers.exists():
-            return Response({"message": "Conductores no disponibles en este momento."}, status=status.HTTP_404_NOT_FOUND)
+        if wants_queued_dispatch(request):
+            # Answered right away; the dispatch workers assign the driver and
+            # services/jobs/<id>/ reports the outcome.
+            job = enqueue_dispatch(customer_lat, customer_lon)
+            return Response(
+                job_data(job), status=status.HTTP_202_ACCEPTED, headers=queued_response_headers(request, job)
+            )
 
-        closest_driver = None
-        min_distance = float('inf')
+        # Without a free driver the service is queued as PENDING (202) and
+        # assigned when one is released; poll services/<pk>/ for the result.
+        service = dispatch_service(customer_lat, customer_lon)
+        return Response(service_data(service), status=dispatch_status(service))
 
-        for driver in available_drivers:
-            distance = calculate_haversine_distance(
-                driver.current_latitude, driver.current_longitude,
-                customer_lat, customer_lon
-            )
-            if distance < min_distance:
-                min_distance = distance
-                closest_driver = driver
-        
-        if closest_driver is None:
-             return Response({"message": "No se pudo encontrar un conductor adecuado."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        average_speed_kph = 40
-        estimated_time_hours = min_distance / average_speed_kph
-        estimated_arrival = timezone.now() + timedelta(hours=estimated_time_hours)
-
-        service = Service.objects.create(
-            customer_pickup_latitude=customer_lat,
-            customer_pickup_longitude=customer_lon,
-            assigned_driver=closest_driver,
-            status=Service.StatusChoices.ASSIGNED,
-            estimated_arrival_time=estimated_arrival
+class DispatchJobView(APIView):
+    """Outcome of a queued service request: QUEUED, DONE (with the service) or FAILED."""
+
+    def get(self, request, pk, *args, **kwargs):
+        job = get_object_or_404(
+            DispatchJob.objects.select_related('service__assigned_driver'), pk=pk
         )
+        return Response(job_data(job))
+
+class BatchRequestServiceView(APIView):
+    """Request services for many pickups at once, assigned as a single batch."""
+
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return Response({"message": "Se espera una lista de solicitudes."}, status=status.HTTP_400_BAD_REQUEST)
+        max_size = dispatch_settings().get('BATCH_MAX_SIZE', 500)
+        if len(request.data) > max_size:
+            return Response({"message": f"Máximo {max_size} solicitudes por lote."}, status=status.HTTP_400_BAD_REQUEST)
 
-        closest_driver.is_available = False
-        closest_driver.save()
+        results = [None] * len(request.data)
+        pickups, positions = [], []
+        for position, item in enumerate(request.data):
+            request_serializer = ServiceRequestSerializer(data=item)
+            if not request_serializer.is_valid():
+                results[position] = {"status": status.HTTP_400_BAD_REQUEST, "errors": request_serializer.errors}
+                continue
+            pickups.append((request_serializer.validated_data['latitude'], request_serializer.validated_data['longitude']))
+            positions.append(position)
 
-        service_serializer = ServiceSerializer(service)
-        return Response(service_serializer.data, status=status.HTTP_201_CREATED)
+        for position, service in zip(positions, dispatch_services(pickups)):
+            results[position] = {"status": dispatch_status(service), "service": service_data(service)}
+        return Response({"results": results}, status=status.HTTP_200_OK)
 
 class CompleteServiceView(generics.UpdateAPIView):
     queryset = Service.objects.all()
@@ -78,22 +358,13 @@ class CompleteServiceView(generics.UpdateAPIView):
 
     def perform_update(self, serializer):
         service = serializer.instance
-        
-        if service.status != Service.StatusChoices.ASSIGNED:
-            raise serializers.ValidationError({"status": "El servicio debe estar en estado ASIGNADO para ser completado."}, code='invalid_state')
-        
-        if not service.assigned_driver:
-             raise serializers.ValidationError({"driver": "Conductor no asignado a este servicio."}, code='estado_invalido')
-
-        validated_status = serializer.validated_data['status']
-        
-        service.status = validated_status
-        service.completion_time = timezone.now()
-        service.save()
-
-        driver = service.assigned_driver
-        driver.is_available = True
-        driver.save()
+        errors = completion_errors(service)
+        if errors:
+            raise serializers.ValidationError(errors, code='invalid_state')
+        if complete_service(service, serializer.validated_data['status']) is None:
+            # Completed or cancelled by a concurrent request.
+            service.refresh_from_db()
+            raise serializers.ValidationError(completion_errors(service), code='invalid_state')
 
 
     def update(self, request, *args, **kwargs):
@@ -107,8 +378,23 @@ class CompleteServiceView(generics.UpdateAPIView):
             if getattr(instance, '_prefetched_objects_cache', None):
                 instance._prefetched_objects_cache = {}
 
-            full_serializer = ServiceSerializer(instance)
-            return Response(full_serializer.data)
+            return Response(service_data(instance))
 
         except serializers.ValidationError as e:
              return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+class TokenCacheStatsView(APIView):
+    """Hit/miss counters of the cached token authentication (staff only)."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(token_cache.stats())
+
+
+class MetricsView(APIView):
+    """Request, database and phase histograms in the Prometheus text format (staff only)."""
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request, *args, **kwargs):
+        return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
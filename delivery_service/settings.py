@@ -26,6 +26,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.AdmissionControlMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -33,6 +36,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.TraceRecorderMiddleware',
 ]
 
 ROOT_URLCONF = 'delivery_service.urls'
@@ -65,9 +69,41 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PASSWORD', 'alfred_pass'),
         'HOST': os.environ.get('DB_HOST', 'localhost'),
         'PORT': os.environ.get('DB_PORT', '5432'),
+        # Persistent connections per worker thread, checked before reuse.
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Local runs (tests, `manage.py bench`) without a Postgres server.
+if os.environ.get('DB_ENGINE') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    }
+
+# Read replicas (env DB_REPLICA_HOSTS, comma separated 'host' or
+# 'host:port'), aliased replica_0, replica_1... Safe requests to the views
+# using api.replicas.ReplicaReadMixin read from one of them, except for
+# clients that wrote in the last STICKY_SECONDS (remembered in process, and
+# in the SHARED CACHES alias if set). Under test they mirror the default
+# database, so DB_REPLICA_HOSTS=<the default host> exercises the routing.
+DATABASE_REPLICAS = {
+    'ALIASES': [],
+    'STICKY_SECONDS': 5,
+    'SHARED': None,
+}
+for n, replica in enumerate(host for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host):
+    host, _, port = replica.partition(':')
+    DATABASES[f'replica_{n}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default'].get('PORT', ''),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS['ALIASES'].append(f'replica_{n}')
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
 
 
 
@@ -105,9 +141,210 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
-    )
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+}
+
+# OpenAPI documents (/swagger.json, /swagger.yaml) are built once per process
+# and served from memory with an ETag: read from DIRECTORY when `manage.py
+# generate_schema` wrote them there at deploy time, else generated on the
+# first request. The Swagger UI and ReDoc pages load that cached document.
+OPENAPI_SCHEMA = {
+    'DIRECTORY': os.environ.get('OPENAPI_SCHEMA_DIR', str(BASE_DIR / 'var' / 'openapi')),
+    'URL': None,
+}
+SWAGGER_SETTINGS = {'SPEC_URL': ('schema-json', {'format': '.json'})}
+REDOC_SETTINGS = {'SPEC_URL': ('schema-json', {'format': '.json'})}
+
+# Resolved API tokens kept in-process (LRU, TTL seconds). SHARED names a
+# CACHES alias used as a second level shared between processes.
+TOKEN_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+    'SHARED': None,
+}
+
+# Per-view latency, DB and phase histograms served at /api/metrics/. With
+# PROFILE_DIR set, requests sent with an `X-Profile` header are run under
+# cProfile (sampled at PROFILE_SAMPLE_RATE) and dumped there.
+METRICS = {
+    'ENABLED': True,
+    'PROFILE_DIR': os.environ.get('PROFILE_DIR'),
+    'PROFILE_SAMPLE_RATE': 1.0,
+}
+
+# Append every API request to this JSONL file for `manage.py bench replay`.
+BENCH_TRACE_FILE = os.environ.get('BENCH_TRACE_FILE')
+
+# Serve listings and the request/complete responses through the precompiled
+# serializers in api.fast_serializers (same JSON as the DRF serializers).
+FAST_SERIALIZATION = True
+
+# Rows fetched per round trip by the NDJSON export endpoints.
+EXPORT_CHUNK_SIZE = 2000
+
+# Nearest-driver search strategy: 'index' (in-process spatial index), 'scan'
+# (vectorized scan of the available fleet) or 'database' (bounding-box search
+# in the database, growing the radius until a driver is found).
+DISPATCH = {
+    'MODE': os.environ.get('DISPATCH_MODE', 'index'),
+    'SEARCH_RADIUS_KM': 5.0,
+    'SEARCH_RADIUS_GROWTH': 2.0,
+    # Batch dispatch: nearest drivers considered per pickup, pickups per request.
+    'BATCH_CANDIDATES': 32,
+    'BATCH_MAX_SIZE': 500,
+    # Requests without a free driver are queued as PENDING and served
+    # ('oldest' or 'nearest' first) when a driver is released; those older
+    # than PENDING_MAX_AGE seconds are cancelled instead. Clients may
+    # long-poll up to PENDING_WAIT_MAX seconds on the async status endpoint.
+    'PENDING_ORDER': 'oldest',
+    'PENDING_MAX_AGE': 900,
+    'PENDING_WAIT_MAX': 30,
+    'PENDING_POLL_INTERVAL': 0.5,
+}
+
+# In-process index over Address coordinates for nearby/reverse lookups.
+# Searches start at SEARCH_RADIUS_KM and grow by SEARCH_RADIUS_GROWTH up to
+# the requested radius; edits are folded in after COMPACT_AFTER changes.
+ADDRESS_INDEX = {
+    'CELL_DEG': 0.01,
+    'SEARCH_RADIUS_KM': 0.5,
+    'SEARCH_RADIUS_GROWTH': 2.0,
+    'COMPACT_AFTER': 2000,
+    'MAX_AGE': 3600,
+    'MAX_K': 100,
+    'MAX_RADIUS_KM': 50.0,
+    'REVERSE_RADIUS_KM': 0.5,
+}
+
+# drivers/nearby/: results are cached per CACHE_CELL_DEG cell for CACHE_TTL
+# seconds (0 disables), so clients polling the same area share one search.
+DRIVER_NEARBY = {
+    'CACHE_CELL_DEG': 0.005,
+    'CACHE_TTL': 2,
+    'CACHE_SIZE': 10000,
+    'MAX_K': 100,
+    'MAX_RADIUS_KM': 50.0,
+}
+
+# Server-sent change events (/api/async/events/). Each subscriber buffers at
+# most BUFFER_SIZE events (older ones are dropped and reported); streams
+# send a comment every HEARTBEAT seconds and close after MAX_DURATION.
+EVENTS = {
+    'BUFFER_SIZE': 1000,
+    'HEARTBEAT': 15,
+    'MAX_DURATION': 300,
+    'MAX_SUBSCRIBERS': 1000,
+    'RETRY_MS': 3000,
+}
+
+# Arrival estimates. GridETA reads per-cell, per-hour speeds from GRID_PATH
+# (built by `manage.py refresh_eta_grid`), memoized in an LRU of
+# CACHE_SIZE cell pairs, and falls back to DEFAULT_SPEED_KPH without a grid.
+ETA = {
+    'ENGINE': 'api.eta.GridETA',
+    'GRID_PATH': os.environ.get('ETA_GRID_PATH', str(BASE_DIR / 'var' / 'eta_grid.bin')),
+    'DEFAULT_SPEED_KPH': 40.0,
+    'CACHE_SIZE': 100000,
+    'RELOAD_INTERVAL': 60,
+}
+
+# Admission control for the dispatch endpoints (VIEWS are URL names).
+# RATE requests/s per client (the user of an already verified token, else the
+# address) with bursts of BURST (None disables), kept in memory or in the
+# SHARED CACHES alias; at most MAX_CONCURRENCY requests in flight per process.
+# A request that has queued (X-Request-Start plus the wait for a slot) longer
+# than MAX_QUEUE_TIME seconds gets a 503.
+ADMISSION = {
+    'ENABLED': True,
+    'VIEWS': ['request-service', 'request-service-batch', 'async-request-service'],
+    'RATE': float(os.environ['ADMISSION_RATE']) if os.environ.get('ADMISSION_RATE') else None,
+    'BURST': 20,
+    'SHARED': None,
+    'MAX_CONCURRENCY': 32,
+    'MAX_QUEUE_TIME': 1.0,
+    'RETRY_AFTER': 1,
+}
+
+# Idempotency-Key support on service requests. Responses are replayed for
+# TTL seconds from an in-process LRU of CACHE_SIZE entries and, with
+# DATABASE (env IDEMPOTENCY_DATABASE=1, for several worker processes), the
+# IdempotencyRecord table. Duplicates of a request still running wait up to
+# WAIT seconds for its response; a crashed worker's claim lapses after
+# LOCK_TIMEOUT seconds.
+IDEMPOTENCY = {
+    'TTL': 86400,
+    'CACHE_SIZE': 10000,
+    'DATABASE': os.environ.get('IDEMPOTENCY_DATABASE', '0') == '1',
+    'WAIT': 10,
+    'POLL_INTERVAL': 0.05,
+    'LOCK_TIMEOUT': 60,
+    'PURGE_INTERVAL': 300,
+}
+
+# Queued dispatch. In 'queued' MODE (or with a `Prefer: respond-async`
+# header) service requests are stored as jobs and answered 202 right away;
+# THREADS per process (started on first use; 0 leaves it to `manage.py
+# run_dispatch_jobs`) dispatch them in batches of up to BATCH_SIZE, waking
+# on enqueue or every POLL_INTERVAL seconds. Finished jobs are deleted
+# after RETENTION seconds.
+DISPATCH_JOBS = {
+    'MODE': os.environ.get('DISPATCH_REQUEST_MODE', 'inline'),
+    'THREADS': 2,
+    'BATCH_SIZE': 50,
+    'BATCH_WAIT': 0.01,
+    'POLL_INTERVAL': 1.0,
+    'RETENTION': 86400,
+    'PURGE_INTERVAL': 300,
+}
+
+# Region-sharded dispatch. With WORKERS set ('host:port' or Unix socket
+# paths, env DISPATCH_WORKERS comma separated), single service requests are
+# sent to the `manage.py dispatch_worker <n>` process owning the pickup's
+# geohash cell of PRECISION characters. Workers rebuild their driver index
+# every RELOAD_INTERVAL seconds. AUTHKEY defaults to SECRET_KEY.
+DISPATCH_SHARDS = {
+    'WORKERS': [address for address in os.environ.get('DISPATCH_WORKERS', '').split(',') if address],
+    'PRECISION': 4,
+    'RELOAD_INTERVAL': 10,
+    'AUTHKEY': os.environ.get('DISPATCH_WORKERS_AUTHKEY'),
+}
+
+# Conditional GETs on addresses and drivers (list and detail). Responses
+# carry an ETag from a version bumped on every write, and their data is
+# cached by version in an LRU of MAX_ENTRIES for TTL seconds.
+# Versions are tracked per process (up to VERSIONS_SIZE, forgotten after
+# TTL, so writes seen only by other processes show up within TTL) or, with
+# SHARED set to a CACHES alias, shared by all processes.
+RESPONSE_CACHE = {
+    'ENABLED': True,
+    'TTL': 30,
+    'MAX_ENTRIES': 10000,
+    'VERSIONS_SIZE': 100000,
+    'SHARED': None,
+}
+
+# In-process spatial index used by the 'index' dispatch mode.
+DRIVER_INDEX = {
+    'CELL_KM': 1.0,
+    'MAX_AGE': 60,
+}
+
+# Bulk driver GPS ingest (POST /api/drivers/locations/). Pings are coalesced
+# per driver and written every FLUSH_INTERVAL seconds, or as soon as
+# MAX_PENDING drivers are waiting.
+LOCATION_INGEST = {
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_PENDING': 10000,
+    'MAX_PINGS': 10000,
+    'MAX_CLOCK_SKEW': 60,
 }
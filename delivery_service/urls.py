@@ -2,22 +2,7 @@ from django.contrib import admin
 from django.urls import path, include, re_path
 from rest_framework.authtoken import views as authtoken_views
 
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
-
-schema_view = get_schema_view(
-   openapi.Info(
-      title="Delivery Service API",
-      default_version='v1',
-      description="API for managing and assigning delivery services.",
-      terms_of_service="https://www.google.com/policies/terms/",
-      contact=openapi.Contact(email="contact@example.com"),
-      license=openapi.License(name="BSD License"), 
-   ),
-   public=True, 
-   permission_classes=(permissions.AllowAny,),
-)
+from api.schema import schema_document, schema_ui
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -25,7 +10,7 @@ urlpatterns = [
     
     path('api-token-auth/', authtoken_views.obtain_auth_token, name='api-token-auth'),
 
-    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_document, name='schema-json'),
+    path('swagger/', schema_ui('swagger'), name='schema-swagger-ui'),
+    path('redoc/', schema_ui('redoc'), name='schema-redoc'),
 ]